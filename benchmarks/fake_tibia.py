@@ -0,0 +1,518 @@
+"""Fake TibiaData, Tibia.com, guildstats.eu and tibiabosses.com server, to load test NabBot without the real services.
+
+Synthetic worlds are generated, each with a population of characters, part of them online. Every tick, some online
+characters log out and offline ones log in, online characters gain levels and some of them die.
+
+Responses follow the same format as the real services, for the parts NabBot reads. To use it, set `tibiadata_url`,
+`tibia_url`, `guildstats_url` and `tibiabosses_url` in config.yml to the server's address.
+
+The generated characters and the time of every level up are available in /fake/characters.json and
+/fake/level_ups.json, used by benchmarks.tracker.
+
+Run from NabBot's root folder:
+    python -m benchmarks.fake_tibia --worlds 50 --players 1000 --port 8080
+"""
+import argparse
+import asyncio
+import datetime as dt
+import json
+import random
+import time
+import urllib.parse
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+VOCATIONS = ["Elite Knight", "Royal Paladin", "Master Sorcerer", "Elder Druid"]
+# Vocation filters used by Tibia.com's highscores and TibiaData's highscores
+PROFESSIONS = {1: "Elite Knight", 2: "Royal Paladin", 3: "Master Sorcerer", 4: "Elder Druid"}
+HIGHSCORE_VOCATIONS = {"knight": "Elite Knight", "paladin": "Royal Paladin", "sorcerer": "Master Sorcerer",
+                       "druid": "Elder Druid"}
+LOCATIONS = ["Europe", "North America", "South America"]
+PVP_TYPES = ["Open PvP", "Optional PvP", "Hardcore PvP", "Retro Open PvP"]
+CREATURES = ["a dragon lord", "a demon", "a hydra", "a giant spider", "a rat", "a hellhound", "a grim reaper",
+             "a frost dragon", "a warlock", "an undead dragon"]
+LOYALTY_TITLES = ["Scout of Tibia", "Sentinel of Tibia", "Steward of Tibia", "Warden of Tibia", "Squire of Tibia"]
+HIGHSCORES_PER_PAGE = 25
+HIGHSCORES_PAGES = 12
+DEATHS_KEPT = 20
+SYLLABLES = ["ka", "lo", "mi", "ra", "te", "no", "su", "vi", "del", "mar", "gor", "thi", "an", "bel", "cor", "dra",
+             "el", "fen", "gal", "har", "is", "jor", "kel", "lun", "mor", "nar", "or", "pel", "quin", "ros", "sar",
+             "tor", "ul", "val", "wen", "xan", "yor", "zen"]
+
+
+class FakeCharacter:
+    __slots__ = ("name", "world", "level", "vocation", "sex", "guild", "rank", "online", "last_login", "deaths",
+                 "achievement_points", "skills")
+
+    def __init__(self, name: str, world: str, level: int, vocation: str, sex: str):
+        self.name = name
+        self.world = world
+        self.level = level
+        self.vocation = vocation
+        self.sex = sex
+        self.guild: Optional[str] = None
+        self.rank: Optional[str] = None
+        self.online = False
+        self.last_login = time.time()
+        # Deaths as (timestamp, level, killers, players involved), newest first
+        self.deaths = []
+        self.achievement_points = 0
+        self.skills: Dict[str, int] = {}
+
+
+class FakeGuild:
+    __slots__ = ("name", "world", "founded", "members")
+
+    def __init__(self, name: str, world: str, founded: str):
+        self.name = name
+        self.world = world
+        self.founded = founded
+        self.members: List[FakeCharacter] = []
+
+
+class FakeWorld:
+    __slots__ = ("name", "location", "pvp_type", "creation", "characters", "online", "record")
+
+    def __init__(self, name: str, location: str, pvp_type: str, creation: str):
+        self.name = name
+        self.location = location
+        self.pvp_type = pvp_type
+        self.creation = creation
+        self.characters: List[FakeCharacter] = []
+        self.online: List[FakeCharacter] = []
+        self.record = 0
+
+
+def tibiadata_time(timestamp: float) -> Dict:
+    """Gets a time object in TibiaData's format, in CET."""
+    date = dt.datetime.utcfromtimestamp(timestamp) + dt.timedelta(hours=1)
+    return {"date": date.strftime("%Y-%m-%d %H:%M:%S.%f"), "timezone_type": 2, "timezone": "CET"}
+
+
+def experience_for_level(level: int) -> int:
+    return int((50 * level ** 3 - 150 * level ** 2 + 400 * level) / 3)
+
+
+class FakeTibia:
+    """Synthetic Tibia worlds and characters.
+
+    The state advances one tick every `tick` seconds, when data is requested.
+
+    :param worlds: The number of worlds.
+    :param players: The number of characters online in each world.
+    :param population: The number of characters in each world, relative to the players online.
+    :param churn: The fraction of online characters that log out every tick, replaced by offline characters logging in.
+    :param level_rate: The chance of an online character gaining a level every tick.
+    :param death_rate: The chance of an online character dying every tick. Characters log out when they die.
+    :param pvp_rate: The fraction of deaths caused by other players.
+    :param guild_ratio: The fraction of characters in a guild.
+    :param guild_size: The average number of members of a guild.
+    :param tick: Seconds between ticks, 0 to only advance the state by calling `step`.
+    :param seed: The random seed, the same seed generates the same worlds and events.
+    """
+    def __init__(self, worlds: int = 50, players: int = 1000, *, population: float = 2.0, churn: float = 0.05,
+                 level_rate: float = 0.02, death_rate: float = 0.005, pvp_rate: float = 0.2,
+                 guild_ratio: float = 0.3, guild_size: int = 50, tick: float = 60, seed: int = 0):
+        self.players = players
+        self.churn = churn
+        self.level_rate = level_rate
+        self.death_rate = death_rate
+        self.pvp_rate = pvp_rate
+        self.tick = tick
+        self.random = random.Random(seed)
+        self.worlds: Dict[str, FakeWorld] = {}
+        self.characters: Dict[str, FakeCharacter] = {}
+        self.guilds: Dict[str, FakeGuild] = {}
+        # Time each level was reached, to measure how long it takes to be announced, key:value = (name, level):time
+        self.level_ups: Dict[Tuple[str, int], float] = {}
+        self.ticks = 0
+        self.last_tick = time.time()
+        self._names = set()
+        self._skill_rankings: Dict[tuple, List[FakeCharacter]] = {}
+
+        for _ in range(worlds):
+            self._create_world(int(players * population), guild_ratio, guild_size)
+
+    def _create_name(self, words: int, syllables: int) -> str:
+        while True:
+            name = " ".join("".join(self.random.choice(SYLLABLES) for _ in range(self.random.randint(2, syllables)))
+                            .capitalize() for _ in range(words))
+            if name.lower() not in self._names:
+                self._names.add(name.lower())
+                return name
+
+    def _create_world(self, population: int, guild_ratio: float, guild_size: int):
+        world = FakeWorld(self._create_name(1, 3), self.random.choice(LOCATIONS), self.random.choice(PVP_TYPES),
+                          f"{self.random.randint(1997, 2018)}-{self.random.randint(1, 12):02}")
+        self.worlds[world.name.lower()] = world
+        for _ in range(population):
+            level = min(int(self.random.expovariate(1 / 120)) + 8, 1500)
+            vocation = self.random.choice(VOCATIONS)
+            char = FakeCharacter(self._create_name(2, 3), world.name, level, vocation,
+                                 self.random.choice(["male", "female"]))
+            char.achievement_points = self.random.randint(0, level * 2)
+            char.last_login -= self.random.randint(0, 60 * 60 * 24 * 30)
+            world.characters.append(char)
+            self.characters[char.name.lower()] = char
+        guilded = self.random.sample(world.characters, int(population * guild_ratio))
+        for i in range(0, len(guilded), guild_size):
+            guild = FakeGuild(self._create_name(2, 2), world.name,
+                              f"{self.random.randint(1997, 2018)}-{self.random.randint(1, 12):02}-01")
+            self.guilds[guild.name.lower()] = guild
+            for j, char in enumerate(guilded[i:i + guild_size]):
+                char.guild = guild.name
+                char.rank = "Leader" if j == 0 else self.random.choice(["Vice Leader", "Member", "Member"])
+                guild.members.append(char)
+        for char in self.random.sample(world.characters, min(self.players, population)):
+            char.online = True
+            world.online.append(char)
+        world.record = len(world.online)
+
+    def update(self):
+        """Advances the state by the ticks elapsed since the last update."""
+        if self.tick <= 0:
+            return
+        now = time.time()
+        while now - self.last_tick >= self.tick:
+            self.last_tick += self.tick
+            self.step(self.last_tick)
+
+    def step(self, now: float = None):
+        """Advances the state by one tick."""
+        now = time.time() if now is None else now
+        self.ticks += 1
+        for world in self.worlds.values():
+            # Deaths and level ups
+            for char in list(world.online):
+                roll = self.random.random()
+                if roll < self.death_rate:
+                    self._kill(world, char, now)
+                elif roll < self.death_rate + self.level_rate:
+                    char.level += 1
+                    self.level_ups[(char.name, char.level)] = now
+            # Logouts and logins
+            logouts = int(len(world.online) * self.churn)
+            for char in self.random.sample(world.online, logouts):
+                char.online = False
+                world.online.remove(char)
+            offline = [c for c in world.characters if not c.online]
+            for char in self.random.sample(offline, min(self.players - len(world.online), len(offline))):
+                char.online = True
+                char.last_login = now
+                world.online.append(char)
+            world.record = max(world.record, len(world.online))
+
+    def _kill(self, world: FakeWorld, char: FakeCharacter, now: float):
+        killers = [self.random.choice(CREATURES)]
+        involved = []
+        if self.random.random() < self.pvp_rate:
+            involved = [c.name for c in self.random.sample(world.online, min(2, len(world.online))) if c is not char]
+            if involved:
+                killers = involved
+        char.deaths.insert(0, (now, char.level, killers, involved))
+        del char.deaths[DEATHS_KEPT:]
+        if char.level > 8:
+            char.level -= 1
+        char.online = False
+        world.online.remove(char)
+
+    def get_ranking(self, world: FakeWorld, category: str, vocation: str = None) -> List[FakeCharacter]:
+        """Gets a world's characters sorted by a highscores category."""
+        key = (world.name, category, vocation)
+        if category not in ("experience", "achievements") and key in self._skill_rankings:
+            return self._skill_rankings[key]
+        chars = [c for c in world.characters if vocation is None or c.vocation == vocation]
+        if category == "experience":
+            return sorted(chars, key=lambda c: c.level, reverse=True)
+        if category == "achievements":
+            return sorted(chars, key=lambda c: c.achievement_points, reverse=True)
+        for char in chars:
+            if category not in char.skills:
+                char.skills[category] = self.random.randint(10, 130)
+        ranking = self._skill_rankings[key] = sorted(chars, key=lambda c: c.skills[category], reverse=True)
+        return ranking
+
+    @staticmethod
+    def get_score(char: FakeCharacter, category: str) -> int:
+        if category == "experience":
+            return experience_for_level(char.level)
+        if category == "achievements":
+            return char.achievement_points
+        return char.skills[category]
+
+    # TibiaData
+    def get_worlds_json(self) -> Dict:
+        worlds = [{"name": w.name, "online": len(w.online), "location": w.location, "worldtype": w.pvp_type,
+                   "additional": ""} for w in self.worlds.values()]
+        return {"worlds": {"online": sum(w["online"] for w in worlds), "allworlds": worlds}}
+
+    def get_world_json(self, name: str) -> Dict:
+        world = self.worlds.get(name.lower())
+        if world is None:
+            return {"world": {"world_information": {"name": name}}}
+        return {"world": {
+            "world_information": {
+                "name": world.name,
+                "players_online": len(world.online),
+                "online_record": {"players": world.record, "date": tibiadata_time(self.last_tick)},
+                "creation_date": world.creation,
+                "location": world.location,
+                "pvp_type": world.pvp_type,
+                "premium_type": "premium",
+                "transfer_type": "regular",
+                "world_quest_titles": ["Rise of Devovorga"],
+            },
+            "players_online": [{"name": c.name, "level": c.level, "vocation": c.vocation} for c in world.online]
+        }}
+
+    def get_character_json(self, name: str) -> Dict:
+        char = self.characters.get(name.lower())
+        if char is None:
+            return {"characters": {"error": "Character does not exist."}}
+        data = {
+            "name": char.name,
+            "sex": char.sex,
+            "vocation": char.vocation,
+            "level": char.level,
+            "achievement_points": char.achievement_points,
+            "world": char.world,
+            "residence": "Thais",
+            "last_login": [tibiadata_time(char.last_login)],
+            "account_status": "Premium Account",
+            "status": "online" if char.online else "offline",
+        }
+        if char.guild is not None:
+            data["guild"] = {"name": char.guild, "rank": char.rank}
+        deaths = []
+        for timestamp, level, killers, involved in char.deaths:
+            killed_by = killers[0] if len(killers) == 1 else f"{', '.join(killers[:-1])} and {killers[-1]}"
+            deaths.append({"date": tibiadata_time(timestamp), "level": level,
+                           "reason": f"Killed at Level {level} by {killed_by}.",
+                           "involved": [{"name": n} for n in involved]})
+        return {"characters": {"data": data, "achievements": [], "deaths": deaths, "account_information": [],
+                               "other_characters": []}}
+
+    def get_guild_json(self, name: str) -> Dict:
+        guild = self.guilds.get(name.lower())
+        # Guild names are case sensitive
+        if guild is None or guild.name != name:
+            return {"guild": {"error": "Guild does not exist."}}
+        ranks = {}
+        for char in guild.members:
+            ranks.setdefault(char.rank, []).append({
+                "name": char.name, "nick": "", "level": char.level, "vocation": char.vocation,
+                "joined": guild.founded, "status": "online" if char.online else "offline"
+            })
+        online = sum(1 for c in guild.members if c.online)
+        return {"guild": {
+            "data": {
+                "name": guild.name, "description": f"The {guild.name} guild.", "guildhall": False,
+                "application": True, "war": False, "online_status": online,
+                "offline_status": len(guild.members) - online, "disbanded": False,
+                "totalmembers": len(guild.members), "totalinvited": 0, "world": guild.world,
+                "founded": guild.founded, "active": True,
+                "guildlogo": "https://static.tibia.com/images/community/default_logo.gif"
+            },
+            "members": [{"rank_title": rank, "characters": members} for rank, members in ranks.items()],
+            "invited": []
+        }}
+
+    def get_highscores_json(self, world_name: str, category: str, vocation: str) -> Dict:
+        world = self.worlds.get(world_name.lower())
+        if world is None:
+            return {"highscores": {"error": "World does not exist."}}
+        ranking = self.get_ranking(world, category, HIGHSCORE_VOCATIONS.get(vocation))
+        entries = []
+        for i, char in enumerate(ranking[:HIGHSCORES_PER_PAGE * HIGHSCORES_PAGES], 1):
+            entry = {"name": char.name, "rank": i, "voc": char.vocation}
+            if category == "experience":
+                entry["level"] = char.level
+                entry["points"] = experience_for_level(char.level)
+            else:
+                entry["level"] = self.get_score(char, category)
+            entries.append(entry)
+        return {"highscores": {"world": world.name, "type": category, "data": entries}}
+
+    def get_news_json(self) -> Dict:
+        today = time.time()
+        return {"newslist": {"type": "news", "data": [
+            {"id": 4000 - i, "type": "News", "news": f"News article {4000 - i}",
+             "date": tibiadata_time(today - i * 60 * 60 * 24),
+             "tibiaurl": f"https://www.tibia.com/news/?subtopic=newsarchive&id={4000 - i}"} for i in range(20)
+        ]}}
+
+    def get_article_json(self, article_id: int) -> Dict:
+        if not 3980 < article_id <= 4000:
+            return {"news": {"error": "News does not exist."}}
+        return {"news": {"id": article_id, "title": f"News article {article_id}",
+                         "content": "<p>This is a news article.</p>",
+                         "date": tibiadata_time(time.time() - (4000 - article_id) * 60 * 60 * 24)}}
+
+    # Tibia.com
+    def get_highscores_html(self, world_name: str, category: str, profession: int, page: int) -> Optional[str]:
+        world = self.worlds.get(world_name.lower())
+        if world is None:
+            return None
+        ranking = self.get_ranking(world, category, PROFESSIONS.get(profession))
+        start = (page - 1) * HIGHSCORES_PER_PAGE
+        rows = []
+        for i, char in enumerate(ranking[start:start + HIGHSCORES_PER_PAGE], start + 1):
+            url = "https://secure.tibia.com/community/?subtopic=characters&name=" + urllib.parse.quote_plus(char.name)
+            title = f"<td>{LOYALTY_TITLES[i % len(LOYALTY_TITLES)]}</TD>" if category == "loyalty" else ""
+            rows.append(f'<TR><td>{i}</TD><td><a href="{url}" >{char.name}</a></td><td>{char.vocation}</TD>{title}'
+                        f'<td style="text-align: right;" >{self.get_score(char, category):,}</TD></TR>')
+        return ('<html><body><table><TR><td style="width: 10%;" >Rank</td><td style="width: 20%;" >Vocation</td></TR>'
+                + "".join(rows)
+                + '</table><div style="float: left;"><b>&raquo; Pages:</b></div></body></html>')
+
+    # Benchmarks
+    def get_characters_json(self) -> Dict:
+        return {"characters": [{"name": c.name, "world": c.world, "level": c.level, "vocation": c.vocation,
+                                "guild": c.guild} for c in self.characters.values()],
+                "guilds": [{"name": g.name, "world": g.world} for g in self.guilds.values()]}
+
+    def get_level_ups_json(self) -> Dict:
+        return {"level_ups": [[name, level, timestamp] for (name, level), timestamp in self.level_ups.items()]}
+
+    # guildstats.eu
+    def get_guildstats_html(self, name: str) -> str:
+        guild = self.guilds.get(name.lower())
+        if guild is None:
+            return '<html><body><div>Sorry! This guild does not exist.</div><div class="footer"></div></body></html>'
+        return (f'<html><body><div>General info<a href="set={urllib.parse.quote_plus(guild.name)}">'
+                f'{guild.name}</a></div><div>Recruitment</div><div class="footer"></div></body></html>')
+
+
+def create_app(fake: FakeTibia, *, latency: float = 0.0, jitter: float = 0.0) -> web.Application:
+    """Creates the web application serving the fake data.
+
+    :param fake: The fake data to serve.
+    :param latency: Seconds every response is delayed by.
+    :param jitter: Maximum random seconds added to the latency.
+    :return: The application.
+    """
+    @web.middleware
+    async def simulate(request: web.Request, handler):
+        if latency or jitter:
+            await asyncio.sleep(latency + random.uniform(0, jitter))
+        fake.update()
+        return await handler(request)
+
+    def json_response(content: Dict) -> web.Response:
+        return web.Response(text=json.dumps(content), content_type="application/json")
+
+    async def worlds(request: web.Request):
+        return json_response(fake.get_worlds_json())
+
+    async def world(request: web.Request):
+        return json_response(fake.get_world_json(request.match_info["name"]))
+
+    async def character(request: web.Request):
+        return json_response(fake.get_character_json(request.match_info["name"]))
+
+    async def guild(request: web.Request):
+        return json_response(fake.get_guild_json(request.match_info["name"]))
+
+    async def highscores(request: web.Request):
+        info = request.match_info
+        return json_response(fake.get_highscores_json(info["world"], info["category"], info["vocation"]))
+
+    async def latest_news(request: web.Request):
+        return json_response(fake.get_news_json())
+
+    async def news(request: web.Request):
+        return json_response(fake.get_article_json(int(request.match_info["id"])))
+
+    async def community(request: web.Request):
+        query = request.query
+        if query.get("subtopic") == "highscores":
+            try:
+                content = fake.get_highscores_html(query.get("world", ""), query.get("list", "experience"),
+                                                   int(query.get("profession", 0)), int(query.get("currentpage", 1)))
+            except ValueError:
+                content = None
+            if content is not None:
+                return web.Response(text=content, content_type="text/html")
+        return web.Response(text="<html><body>Not found</body></html>", content_type="text/html", status=404)
+
+    async def guildstats(request: web.Request):
+        return web.Response(text=fake.get_guildstats_html(request.query.get("guild", "")), content_type="text/html")
+
+    async def characters(request: web.Request):
+        return json_response(fake.get_characters_json())
+
+    async def level_ups(request: web.Request):
+        return json_response(fake.get_level_ups_json())
+
+    async def bosses(request: web.Request):
+        return web.Response(text="<html><body></body></html>", content_type="text/html")
+
+    app = web.Application(middlewares=[simulate])
+    app.router.add_get("/v2/worlds.json", worlds)
+    app.router.add_get("/v2/world/{name}.json", world)
+    app.router.add_get("/v2/characters/{name}.json", character)
+    app.router.add_get("/v2/guild/{name}.json", guild)
+    app.router.add_get("/v2/highscores/{world}/{category}/{vocation}.json", highscores)
+    app.router.add_get("/v2/latestnews.json", latest_news)
+    app.router.add_get(r"/v2/news/{id:\d+}.json", news)
+    app.router.add_get("/community/", community)
+    app.router.add_get("/guild", guildstats)
+    app.router.add_get("/fake/characters.json", characters)
+    app.router.add_get("/fake/level_ups.json", level_ups)
+    app.router.add_get("/{world}/", bosses)
+    return app
+
+
+async def start_server(fake: FakeTibia, host: str = "127.0.0.1", port: int = 8080, **kwargs) -> web.AppRunner:
+    """Starts serving the fake data in the current event loop.
+
+    Additional keyword arguments are passed to `create_app`.
+
+    :return: The server's runner, to clean it up when done.
+    """
+    runner = web.AppRunner(create_app(fake, **kwargs))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves synthetic Tibia data for load testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--worlds", type=int, default=50, help="Number of worlds.")
+    parser.add_argument("--players", type=int, default=1000, help="Characters online in each world.")
+    parser.add_argument("--population", type=float, default=2.0,
+                        help="Characters in each world, relative to the players online.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every response is delayed by.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum random seconds added to the latency.")
+    parser.add_argument("--tick", type=float, default=60, help="Seconds between logins, logouts, level ups and deaths.")
+    parser.add_argument("--churn", type=float, default=0.05,
+                        help="Fraction of online characters logging out every tick, replaced by others logging in.")
+    parser.add_argument("--level-rate", type=float, default=0.02,
+                        help="Chance of an online character gaining a level every tick.")
+    parser.add_argument("--death-rate", type=float, default=0.005,
+                        help="Chance of an online character dying every tick.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("Generating worlds...")
+    fake = FakeTibia(args.worlds, args.players, population=args.population, churn=args.churn,
+                     level_rate=args.level_rate, death_rate=args.death_rate, tick=args.tick, seed=args.seed)
+    print(f"\t{len(fake.worlds)} worlds, {len(fake.characters)} characters, {len(fake.guilds)} guilds")
+    loop = asyncio.get_event_loop()
+    runner = loop.run_until_complete(start_server(fake, args.host, args.port, latency=args.latency,
+                                                  jitter=args.jitter))
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(runner.cleanup())
+
+
+if __name__ == "__main__":
+    main()
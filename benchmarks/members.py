@@ -0,0 +1,135 @@
+"""Microbenchmark of the member indexes kept by NabBot.
+
+Measures indexing every member when starting up, and bringing the indexes up to date after a reconnection, with and
+without members joining, leaving and changing their nickname while disconnected. Rebuilding the indexes of every guild
+is included for comparison, as done before the indexes were synced.
+
+Run from NabBot's root folder:
+    python -m benchmarks.members
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GUILDS = 2000
+MEMBERS = 250
+# Fraction of members of each guild that left, joined and changed their nickname while disconnected
+CHURN = 0.02
+
+
+class FakeMember:
+    __slots__ = ("id", "name", "display_name", "guild")
+
+    def __init__(self, member_id: int, name: str, display_name: str, guild: "FakeGuild"):
+        self.id = member_id
+        self.name = name
+        self.display_name = display_name
+        self.guild = guild
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.members = []
+
+
+class FakeConnection:
+    def __init__(self, guilds):
+        self.guilds = guilds
+
+
+def create_guilds(rng: random.Random):
+    guilds = []
+    for guild_id in range(GUILDS):
+        guild = FakeGuild(guild_id)
+        for member_id in rng.sample(range(1, GUILDS * MEMBERS), MEMBERS):
+            name = f"User{member_id}"
+            nick = f"Nick{rng.randint(1, 10 ** 6)}" if rng.random() < 0.3 else name
+            guild.members.append(FakeMember(member_id, name, nick, guild))
+        guilds.append(guild)
+    return guilds
+
+
+def apply_churn(guilds, rng: random.Random, first_id: int) -> int:
+    """Simulates members joining, leaving and changing their nickname, keeping the member count.
+
+    :return: The next unused member id."""
+    changes = int(MEMBERS * CHURN)
+    member_id = first_id
+    for guild in guilds:
+        for i in rng.sample(range(len(guild.members)), changes):
+            member_id += 1
+            guild.members[i] = FakeMember(member_id, f"User{member_id}", f"User{member_id}", guild)
+        for member in rng.sample(guild.members, changes):
+            member.display_name = f"Nick{rng.randint(1, 10 ** 6)}"
+    return member_id + 1
+
+
+def check(bot, guilds):
+    """Checks that the indexes match the guilds' current members and names."""
+    expected = {}
+    for guild in guilds:
+        for member in guild.members:
+            names = {member.name.casefold(), member.display_name.casefold()}
+            expected[(guild.id, member.id)] = names
+    indexed = {(guild_id, member_id): set(names) for guild_id, members in bot.guild_members.items()
+               for member_id, names in members.items()}
+    assert expected == indexed, "The member indexes don't match the guilds"
+
+
+def rebuild(bot):
+    """Indexes every guild again."""
+    for guild in bot.guilds:
+        bot._remove_guild_members(guild.id)
+        bot._add_guild_members(guild)
+
+
+def measure(label: str, function, bot):
+    start = time.perf_counter()
+    function(bot)
+    print(f"{label:>28} | {(time.perf_counter() - start) * 1000:9.2f} ms")
+
+
+def main():
+    # The databases are opened relative to the working folder when NabBot's modules are imported
+    work_path = tempfile.mkdtemp(prefix="nabbot-benchmark-")
+    os.makedirs(os.path.join(work_path, "data"))
+    os.chdir(work_path)
+    sys.path.insert(0, ROOT_PATH)
+    try:
+        run()
+    finally:
+        os.chdir(ROOT_PATH)
+        shutil.rmtree(work_path, ignore_errors=True)
+
+
+def run():
+    from nabbot import NabBot
+
+    rng = random.Random(0)
+    guilds = create_guilds(rng)
+    # The bot is not started, only the attributes used by the member indexes are set
+    bot = NabBot.__new__(NabBot)
+    bot._connection = FakeConnection(guilds)
+    bot.members = {}
+    bot.guild_members = {}
+    bot.member_names = {}
+
+    print(f"{GUILDS} guilds, {MEMBERS} members each, {CHURN:.0%} churn")
+    measure("startup", NabBot.sync_members, bot)
+    measure("reconnect, no changes", NabBot.sync_members, bot)
+    measure("rebuild, no changes", rebuild, bot)
+    next_id = apply_churn(guilds, rng, GUILDS * MEMBERS)
+    measure("reconnect, with churn", NabBot.sync_members, bot)
+    check(bot, guilds)
+    apply_churn(guilds, rng, next_id)
+    measure("rebuild, with churn", rebuild, bot)
+    check(bot, guilds)
+
+
+if __name__ == "__main__":
+    main()
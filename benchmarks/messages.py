@@ -0,0 +1,80 @@
+"""Microbenchmark of the announcement message path.
+
+Measures selecting a message with weighed_choice and formatting it, as done when announcing level ups and deaths.
+The previous linear implementation of weighed_choice is included for comparison.
+
+Run from NabBot's root folder:
+    python -m benchmarks.messages
+"""
+import random
+import timeit
+
+from utils.messages import weighed_choice, level_messages, death_messages_monster, death_messages_player, \
+    format_message, last_messages
+
+VOCATIONS = ["Elite Knight", "Royal Paladin", "Master Sorcerer", "Elder Druid", "None"]
+KILLERS = ["dragon lord", "demon", "rat", "Bubble", "hydra"]
+LEVEL_INFO = {'name': "Galarzaa Fidera", 'he_she': "he", 'his_her': "his", 'him_her': "him"}
+
+
+def linear_choice(choices, level: int, vocation: str = None, killer: str = None, levels_lost: int = 0) -> str:
+    """The previous weighed_choice, checking every message on every call."""
+    weight_range = 0
+    _messages = []
+    for message in choices:
+        match = True
+        try:
+            if message[2] and vocation not in message[2]:
+                match = False
+            if message[3] and level not in message[3]:
+                match = False
+            if message[4] and killer not in message[4]:
+                match = False
+            if message[5] and levels_lost not in message[5]:
+                match = False
+        except IndexError:
+            pass
+        if match:
+            weight_range = weight_range + (message[0] if not message[1] in last_messages else message[0] / 10)
+            _messages.append(message)
+    range_choice = random.randint(0, weight_range)
+    range_pos = 0
+    for message in _messages:
+        if range_pos <= range_choice < range_pos + (message[0] if not message[1] in last_messages else message[0] / 10):
+            last_messages.append(message[1])
+            return message[1]
+        range_pos = range_pos + (message[0] if not message[1] in last_messages else message[0] / 10)
+    return _messages[0][1]
+
+
+def announce_level(choice):
+    level = random.randint(8, 600)
+    message = choice(level_messages, vocation=random.choice(VOCATIONS), level=level)
+    return format_message(message, level=level, **LEVEL_INFO)
+
+
+def announce_death(choice):
+    level = random.randint(8, 600)
+    killer = random.choice(KILLERS)
+    messages = death_messages_player if killer[0].isupper() else death_messages_monster
+    message = choice(messages, vocation=random.choice(VOCATIONS), level=level, killer=killer,
+                     levels_lost=random.randint(0, 3))
+    return format_message(message, level=level, killer=killer, killer_article="a ", **LEVEL_INFO)
+
+
+def main():
+    number = 20000
+    for name, function in [("level up", announce_level), ("death", announce_death)]:
+        for label, choice in [("linear", linear_choice), ("compiled", weighed_choice)]:
+            random.seed(0)
+            seconds = timeit.timeit(lambda: function(choice), number=number)
+            print(f"{name:>8} | {label:>8} | {seconds / number * 1e6:7.2f} µs per announcement")
+    for label, choice in [("linear", linear_choice), ("compiled", weighed_choice)]:
+        random.seed(0)
+        seconds = timeit.timeit(lambda: choice(level_messages, vocation=random.choice(VOCATIONS),
+                                               level=random.randint(8, 600)), number=number)
+        print(f"{'choice':>8} | {label:>8} | {seconds / number * 1e6:7.2f} µs per weighed_choice")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,476 @@
+"""End to end benchmark of the tracker, using the fake Tibia server and a simulated Discord layer.
+
+The tracking tasks run for a fixed time: online list scans, death checks, level up and death announcements and watched
+lists. Data is fetched from benchmarks.fake_tibia, started in a separate process so it doesn't affect the results.
+Discord is replaced by a simulated bot, with thousands of servers and channels that take a fixed time to respond.
+
+Reports world scans per second, death checks, the time from a level up or death to its announcement being sent, time
+spent on the database and the network, event loop lag and memory. The bot runs in a temporary folder, with its own
+database, so existing data is not modified.
+
+Scan intervals are shortened to produce a meaningful load in a few minutes. Results can be saved and compared between
+commits, as long as the same parameters are used.
+
+Run from NabBot's root folder:
+    python -m benchmarks.tracker --duration 120 --output before.json
+    python -m benchmarks.tracker --duration 120 --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import aiohttp
+import discord
+import psutil
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_SERVER_ID = 100000
+FIRST_USER_ID = 1000000
+
+try:
+    _all_tasks = asyncio.all_tasks
+except AttributeError:
+    _all_tasks = asyncio.Task.all_tasks
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class FakeResponse:
+    """Response used to raise Discord's HTTP exceptions."""
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, channel: "FakeChannel", content: Optional[str], embed: Optional[discord.Embed]):
+        self.id = message_id
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+
+    async def edit(self, *, content: str = None, embed: discord.Embed = None):
+        await self.channel.bot.respond()
+        self.content = content
+        self.embed = embed
+        self.channel.bot.recorder.edits += 1
+
+
+class FakeChannel:
+    def __init__(self, bot: "FakeBot", channel_id: int, name: str, guild: "FakeGuild"):
+        self.bot = bot
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.messages: Dict[int, FakeMessage] = {}
+
+    async def send(self, content: str = None, *, embed: discord.Embed = None) -> FakeMessage:
+        await self.bot.respond()
+        message = FakeMessage(self.bot.next_id(), self, content, embed)
+        self.messages[message.id] = message
+        self.bot.recorder.message_sent(message)
+        return message
+
+    async def get_message(self, message_id: int) -> FakeMessage:
+        await self.bot.respond()
+        try:
+            return self.messages[message_id]
+        except KeyError:
+            raise discord.NotFound(FakeResponse(404, "Not Found"), "Unknown Message")
+
+    async def edit(self, *, name: str = None):
+        await self.bot.respond()
+        if name is not None:
+            self.name = name
+        self.bot.recorder.edits += 1
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, name: str):
+        self.id = guild_id
+        self.name = name
+        self.members: Set[int] = set()
+        self.channels: Dict[int, FakeChannel] = {}
+
+    def get_member(self, user_id: int) -> Optional[int]:
+        return user_id if user_id in self.members else None
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.channels.get(channel_id)
+
+
+class FakeBot:
+    """Replaces NabBot and Discord, with the attributes and methods used by the tracker."""
+    def __init__(self, loop: asyncio.AbstractEventLoop, monitor, recorder: "Recorder", latency: float):
+        self.loop = loop
+        self.monitor = monitor
+        self.recorder = recorder
+        self.latency = latency
+        self.tracked_worlds: Dict[int, str] = {}
+        self.tracked_worlds_list: List[str] = []
+        self.announce_targets: Dict[str, List[Tuple[int, Optional[int], int]]] = {}
+        self.guilds: Dict[int, FakeGuild] = {}
+        self.channels: Dict[int, FakeChannel] = {}
+        self.cogs = []
+        self.closed = False
+        self._last_id = 0
+
+    def next_id(self) -> int:
+        self._last_id += 1
+        return self._last_id
+
+    async def respond(self):
+        """Simulates the time taken by Discord to respond to a request."""
+        await asyncio.sleep(self.latency)
+
+    async def wait_until_ready(self):
+        return
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+    def dispatch(self, event: str, *args, **kwargs):
+        for cog in self.cogs:
+            listener = getattr(cog, "on_" + event, None)
+            if listener is not None:
+                self.loop.create_task(listener(*args, **kwargs))
+
+    def get_guild(self, guild_id: int) -> Optional[FakeGuild]:
+        return self.guilds.get(guild_id)
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.channels.get(channel_id)
+
+    def get_channel_or_top(self, guild: FakeGuild, channel_id: int) -> Optional[FakeChannel]:
+        return guild.get_channel(channel_id)
+
+    def add_channel(self, guild: FakeGuild, name: str) -> FakeChannel:
+        channel = FakeChannel(self, self.next_id(), name, guild)
+        guild.channels[channel.id] = channel
+        self.channels[channel.id] = channel
+        return channel
+
+
+class Recorder:
+    """Records when announcements are made and when they reach a channel."""
+    def __init__(self, levelup_emoji: str):
+        self.levelup_emoji = levelup_emoji
+        # Announcements made, key:value = message:(type, name, level, time of the death)
+        self.announcements: Dict[str, Tuple[str, str, int, Optional[float]]] = {}
+        # Announcements that reached a channel, as tuples of type, name, level, time of the death and time sent
+        self.deliveries: List[Tuple[str, str, int, Optional[float], float]] = []
+        self.messages = 0
+        self.edits = 0
+
+    def announcement_made(self, char, level: int, message: str):
+        if message.startswith(self.levelup_emoji):
+            self.announcements[message] = ("level", char.name, level, None)
+        else:
+            death_time = next((d.time.timestamp() for d in char.deaths if d.level == level), None)
+            self.announcements[message] = ("death", char.name, level, death_time)
+
+    def message_sent(self, message: FakeMessage):
+        self.messages += 1
+        if message.content is None:
+            return
+        now = time.time()
+        for line in message.content.split("\n"):
+            announcement = self.announcements.get(line)
+            if announcement is not None:
+                self.deliveries.append(announcement + (now,))
+
+    def get_latencies(self, level_ups: Dict[Tuple[str, int], float]) -> Dict[str, List[float]]:
+        """Gets the time between each level up or death and its announcement being sent, in seconds."""
+        latencies = {"level": [], "death": []}
+        for kind, name, level, death_time, sent in self.deliveries:
+            event_time = level_ups.get((name, level)) if kind == "level" else death_time
+            if event_time is not None:
+                latencies[kind].append(sent - event_time)
+        return latencies
+
+
+def get_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_PATH, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, check=True)
+        return result.stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_fake_server(args) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", "benchmarks.fake_tibia", "--port", str(args.port),
+                             "--worlds", str(args.worlds), "--players", str(args.players),
+                             "--population", str(args.population), "--latency", str(args.latency),
+                             "--jitter", str(args.jitter), "--tick", str(args.tick), "--churn", str(args.churn),
+                             "--level-rate", str(args.level_rate), "--death-rate", str(args.death_rate),
+                             "--seed", str(args.seed)], cwd=ROOT_PATH)
+
+
+async def fetch_json(url: str) -> Dict:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as resp:
+            return await resp.json()
+
+
+async def wait_for_server(server: subprocess.Popen, url: str, timeout: float = 300) -> Dict:
+    """Waits until the fake server is ready, returning the generated characters."""
+    start = time.time()
+    while time.time() - start < timeout:
+        if server.poll() is not None:
+            raise SystemExit("The fake server stopped unexpectedly.")
+        try:
+            return await fetch_json(f"{url}/fake/characters.json")
+        except aiohttp.ClientError:
+            await asyncio.sleep(0.5)
+    raise SystemExit("The fake server didn't start in time.")
+
+
+def populate(bot: FakeBot, data: Dict, args, rng: random.Random):
+    """Registers characters, servers and watched lists in the database and the simulated Discord layer."""
+    from utils.database import userDatabase
+
+    worlds = sorted({c["world"] for c in data["characters"]})
+    by_world: Dict[str, List[Dict]] = {w: [] for w in worlds}
+    for char in data["characters"]:
+        by_world[char["world"]].append(char)
+    guilds_by_world: Dict[str, List[str]] = {w: [] for w in worlds}
+    for guild in data["guilds"]:
+        guilds_by_world[guild["world"]].append(guild["name"])
+
+    properties = []
+    watched = []
+    servers_by_world: Dict[str, List[FakeGuild]] = {w: [] for w in worlds}
+    for i in range(args.servers):
+        world = worlds[i % len(worlds)]
+        guild = FakeGuild(FIRST_SERVER_ID + i, f"Server {i}")
+        bot.guilds[guild.id] = guild
+        servers_by_world[world].append(guild)
+        levels_channel = bot.add_channel(guild, "levels")
+        watched_channel = bot.add_channel(guild, "watched-list")
+        bot.tracked_worlds[guild.id] = world
+        bot.announce_targets.setdefault(world, []).append((guild.id, levels_channel.id, args.announce_level))
+        properties.extend([(guild.id, "world", world), (guild.id, "levels_channel", levels_channel.id),
+                           (guild.id, "watched_channel", watched_channel.id)])
+        for char in rng.sample(by_world[world], min(args.watched, len(by_world[world]))):
+            watched.append((char["name"], False, guild.id))
+        for name in rng.sample(guilds_by_world[world], min(args.watched_guilds, len(guilds_by_world[world]))):
+            watched.append((name, True, guild.id))
+    bot.tracked_worlds_list.extend(sorted(set(bot.tracked_worlds.values())))
+
+    # Registered characters are spread evenly between worlds, each user owns two characters of the same world
+    chars = []
+    per_world = args.characters // len(worlds)
+    user_id = FIRST_USER_ID
+    for world in worlds:
+        for i, char in enumerate(rng.sample(by_world[world], min(per_world, len(by_world[world])))):
+            if i % 2 == 0:
+                user_id += 1
+                for guild in rng.sample(servers_by_world[world], min(args.servers_per_user,
+                                                                     len(servers_by_world[world]))):
+                    guild.members.add(user_id)
+            chars.append((user_id, char["name"], char["level"], char["vocation"], char["world"], char["guild"]))
+
+    with userDatabase as conn:
+        conn.executemany("INSERT INTO chars(user_id, name, level, vocation, world, guild) VALUES(?,?,?,?,?,?)", chars)
+        conn.executemany("INSERT INTO server_properties(server_id, name, value) VALUES(?,?,?)", properties)
+        conn.executemany("INSERT INTO watched_list(name, is_guild, server_id) VALUES(?,?,?)", watched)
+    return len(chars)
+
+
+async def sample_memory(samples: List[int]):
+    process = psutil.Process()
+    while True:
+        samples.append(process.memory_info().rss)
+        await asyncio.sleep(0.5)
+
+
+def run(args) -> Dict:
+    server = start_fake_server(args)
+    work_path = tempfile.mkdtemp(prefix="nabbot-benchmark-")
+    try:
+        # The databases and logs are opened relative to the working folder when NabBot's modules are imported
+        os.makedirs(os.path.join(work_path, "data"))
+        os.chdir(work_path)
+        sys.path.insert(0, ROOT_PATH)
+        from utils.config import config
+        from utils import metrics
+        from utils.database import init_database
+        from utils.monitor import LoopMonitor, phase_seconds, phase_counts
+        from utils.tibia import populate_worlds
+        from cogs.tracking import Tracking
+
+        url = f"http://127.0.0.1:{args.port}"
+        config.tibiadata_url = config.tibia_url = config.guildstats_url = config.tibiabosses_url = url
+        config.online_scan_interval = args.scan_interval
+        config.death_scan_interval = args.death_interval
+        config.announce_merge_delay = args.merge_delay
+        config.announce_threshold = args.announce_level
+
+        loop = asyncio.get_event_loop()
+        print("Waiting for the fake server...")
+        data = loop.run_until_complete(wait_for_server(server, url))
+        init_database()
+        loop.run_until_complete(populate_worlds())
+
+        recorder = Recorder(config.levelup_emoji)
+        monitor = LoopMonitor(loop, block_threshold=config.loop_block_threshold, summary_interval=0)
+        bot = FakeBot(loop, monitor, recorder, args.discord_latency)
+        registered = populate(bot, data, args, random.Random(args.seed))
+        del data
+        print(f"\t{args.servers} servers, {registered} registered characters")
+
+        tracking = Tracking(bot)
+        tracking.scan_highscores_task.cancel()
+        send_announcement = tracking.send_announcement
+
+        async def record_announcement(char, level: int, message: str):
+            recorder.announcement_made(char, level, message)
+            await send_announcement(char, level, message)
+        tracking.send_announcement = record_announcement
+        bot.cogs.append(tracking)
+
+        memory: List[int] = []
+        background = [loop.create_task(monitor.run()), loop.create_task(sample_memory(memory))]
+        db_start, db_operations_start = phase_seconds.get("db", 0.0), phase_counts.get("db", 0)
+        network_start = phase_seconds.get("network", 0.0)
+        cpu_start = time.process_time()
+        print(f"Running for {args.duration} seconds...")
+        start = time.perf_counter()
+        loop.run_until_complete(asyncio.sleep(args.duration))
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+
+        bot.closed = True
+        # The monitor and memory sampler are stopped first, so the shutdown isn't measured
+        for task in background:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*background, return_exceptions=True))
+        # Then the tasks started by the tracking cog
+        pending = [t for t in _all_tasks(loop) if not t.done()]
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        level_ups = loop.run_until_complete(fetch_json(f"{url}/fake/level_ups.json"))["level_ups"]
+        latencies = recorder.get_latencies({(name, level): t for name, level, t in level_ups})
+
+        scan_count = sum(v[-2] for v in metrics.world_scan_duration.values.values())
+        scan_time = sum(v[-1] for v in metrics.world_scan_duration.values.values())
+        lag_average, lag_p95, lag_max = monitor.get_lag_stats()
+        results = {
+            "duration": elapsed,
+            "cpu_seconds": cpu,
+            "world_scans": scan_count,
+            "world_scans_per_second": scan_count / elapsed,
+            "world_scan_average": scan_time / scan_count if scan_count else 0.0,
+            "death_checks": sum(metrics.death_checks.values.values()),
+            "level_announcements": metrics.announcements.values.get((("type", "level"),), 0),
+            "death_announcements": metrics.announcements.values.get((("type", "death"),), 0),
+            "messages_sent": recorder.messages,
+            "messages_edited": recorder.edits,
+            "level_latency_p50": percentile(latencies["level"], 0.5),
+            "level_latency_p95": percentile(latencies["level"], 0.95),
+            "level_latency_max": max(latencies["level"], default=0.0),
+            "death_latency_p50": percentile(latencies["death"], 0.5),
+            "death_latency_p95": percentile(latencies["death"], 0.95),
+            "death_latency_max": max(latencies["death"], default=0.0),
+            "db_seconds": phase_seconds.get("db", 0.0) - db_start,
+            "db_operations": phase_counts.get("db", 0) - db_operations_start,
+            "network_seconds": phase_seconds.get("network", 0.0) - network_start,
+            "http_requests": sum(metrics.http_requests.values.values()),
+            "loop_lag_average": lag_average,
+            "loop_lag_p95": lag_p95,
+            "loop_lag_max": lag_max,
+            "loop_blocks": monitor.block_count,
+            "task_errors": sum(t.errors for t in monitor.get_task_list()),
+            "memory_start_mb": memory[0] / 1024 ** 2 if memory else 0.0,
+            "memory_end_mb": memory[-1] / 1024 ** 2 if memory else 0.0,
+            "memory_peak_mb": max(memory, default=0) / 1024 ** 2,
+        }
+        return results
+    finally:
+        os.chdir(ROOT_PATH)
+        server.terminate()
+        server.wait()
+        shutil.rmtree(work_path, ignore_errors=True)
+
+
+def print_results(results: Dict, previous: Dict = None):
+    for key, value in results.items():
+        line = f"{key:>26} | {value:12.4f}" if isinstance(value, float) else f"{key:>26} | {value:12}"
+        if previous is not None and key in previous:
+            old = previous[key]
+            change = f"{(value - old) / old * 100:+7.1f}%" if old else ""
+            line += f" | {old:12.4f} | {change}" if isinstance(old, float) else f" | {old:12} | {change}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the tracker against a fake Tibia server.")
+    parser.add_argument("--duration", type=float, default=120, help="Seconds to run the tracker for.")
+    parser.add_argument("--port", type=int, default=8181, help="Port used by the fake server.")
+    parser.add_argument("--seed", type=int, default=0)
+    group = parser.add_argument_group("fake server")
+    group.add_argument("--worlds", type=int, default=50)
+    group.add_argument("--players", type=int, default=1000, help="Characters online in each world.")
+    group.add_argument("--population", type=float, default=2.0,
+                       help="Characters in each world, relative to the players online.")
+    group.add_argument("--latency", type=float, default=0.05, help="Seconds every response is delayed by.")
+    group.add_argument("--jitter", type=float, default=0.05, help="Maximum random seconds added to the latency.")
+    group.add_argument("--tick", type=float, default=10, help="Seconds between logins, logouts, level ups and deaths.")
+    group.add_argument("--churn", type=float, default=0.05)
+    group.add_argument("--level-rate", type=float, default=0.02)
+    group.add_argument("--death-rate", type=float, default=0.002)
+    group = parser.add_argument_group("discord")
+    group.add_argument("--servers", type=int, default=2000, help="Discord servers, spread evenly between worlds.")
+    group.add_argument("--characters", type=int, default=20000, help="Registered characters.")
+    group.add_argument("--servers-per-user", type=int, default=2,
+                       help="Servers each owner of registered characters is in.")
+    group.add_argument("--watched", type=int, default=20, help="Characters in each server's watched list.")
+    group.add_argument("--watched-guilds", type=int, default=2, help="Guilds in each server's watched list.")
+    group.add_argument("--discord-latency", type=float, default=0.05,
+                       help="Seconds taken by Discord to respond to a request.")
+    group = parser.add_argument_group("tracker")
+    group.add_argument("--scan-interval", type=float, default=10, help="Minimum seconds between scans of a world.")
+    group.add_argument("--death-interval", type=float, default=0.1, help="Seconds between death checks.")
+    group.add_argument("--merge-delay", type=float, default=2, help="Seconds announcements are merged for.")
+    group.add_argument("--announce-level", type=int, default=30, help="Minimum level announced.")
+    parser.add_argument("--output", help="Saves the results as JSON to this file.")
+    parser.add_argument("--compare", help="Compares the results to ones previously saved with --output.")
+    args = parser.parse_args()
+
+    parameters = {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        if saved["parameters"] != parameters:
+            print("Warning: the compared results were obtained with different parameters.")
+        previous = saved["results"]
+        print(f"Comparing to commit {saved.get('commit')}")
+
+    commit = get_commit()
+    results = run(args)
+    print(f"\nCommit {commit}")
+    print_results(results, previous)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"commit": commit, "parameters": parameters, "results": results}, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,13 @@
 import asyncio
 import datetime as dt
+import heapq
 import platform
 import random
 import re
 import time
 from collections import Counter
 from contextlib import closing
-from typing import Union, Dict, Optional, List
+from typing import Union, Dict, Optional, List, Tuple
 
 import discord
 import psutil
@@ -24,11 +25,18 @@ from utils.tibia import get_voc_abb, get_voc_emoji
 EVENT_NAME_LIMIT = 50
 EVENT_DESCRIPTION_LIMIT = 400
 MAX_EVENTS = 3
+# Maximum number of private messages sent at the same time when notifying event subscribers
+NOTIFY_CONCURRENCY = 5
+# Seconds before an event's start each announcement is made, key:value = new status:seconds
+EVENT_ANNOUNCEMENTS = {3: 60 * 30, 2: 60 * 15, 1: 60 * 5, 0: 0}
 
 
 class General:
     def __init__(self, bot: NabBot):
         self.bot = bot
+        # Heap of pending event announcements, each item is a tuple of due time, event id and new status
+        self.event_schedule: List[Tuple[float, int, int]] = []
+        self.event_schedule_changed = asyncio.Event()
         self.events_announce_task = self.bot.loop.create_task(self.events_announce())
         self.game_update_task = self.bot.loop.create_task(self.game_update())
 
@@ -53,78 +61,120 @@ class General:
                      "League of Dota", "my cards right", "out your death in my head"]
         await self.bot.wait_until_ready()
         while not self.bot.is_closed():
-            if random.randint(0, 9) >= 7:
-                await self.bot.change_presence(activity=discord.Game(name=f"in {len(self.bot.guilds)} servers"))
-            else:
-                await self.bot.change_presence(activity=discord.Game(name=random.choice(game_list)))
+            with self.bot.monitor.iteration("game_update"):
+                if random.randint(0, 9) >= 7:
+                    await self.bot.change_presence(activity=discord.Game(name=f"in {len(self.bot.guilds)} servers"))
+                else:
+                    await self.bot.change_presence(activity=discord.Game(name=random.choice(game_list)))
             await asyncio.sleep(60*20)  # Change game every 20 minutes
 
     async def events_announce(self):
+        """Announces when an event is close to starting.
+
+        Upcoming announcements are kept in a heap ordered by due time, the task sleeps until the next one is due or
+        until the schedule is modified by an event command."""
         await self.bot.wait_until_ready()
+        self.load_event_schedule()
         while not self.bot.is_closed():
-            """Announces when an event is close to starting."""
-            first_announce = 60 * 30
-            second_announce = 60 * 15
-            third_announce = 60 * 5
-            c = userDatabase.cursor()
             try:
-                # Current time
-                date = time.time()
-                c.execute("SELECT creator, start, name, id, server, status "
-                          "FROM events "
-                          "WHERE start >= ? AND active = 1 AND status != 0 "
-                          "ORDER by start ASC", (date,))
-                events = c.fetchall()
-                if not events:
-                    await asyncio.sleep(20)
-                    continue
-                for event in events:
-                    await asyncio.sleep(0.1)
-                    if date + first_announce + 60 > event["start"] > date + first_announce and event["status"] > 3:
-                        new_status = 3
-                    elif date + second_announce + 60 > event["start"] > date + second_announce and event["status"] > 2:
-                        new_status = 2
-                    elif date + third_announce + 60 > event["start"] > date + third_announce and event["status"] > 1:
-                        new_status = 1
-                    elif date + 60 > event["start"] > date and event["status"] > 0:
-                        new_status = 0
-                    else:
-                        continue
-                    guild = self.bot.get_guild(event["server"])
-                    if guild is None:
-                        continue
-                    author = self.bot.get_member(event["creator"], guild)
-                    if author is None:
-                        continue
-                    event["author"] = author.display_name
-                    time_diff = dt.timedelta(seconds=event["start"] - date)
-                    days, hours, minutes = time_diff.days, time_diff.seconds // 3600, (time_diff.seconds // 60) % 60
-                    if days:
-                        event["start"] = 'in {0} days, {1} hours and {2} minutes'.format(days, hours, minutes)
-                    elif hours:
-                        event["start"] = 'in {0} hours and {1} minutes'.format(hours, minutes)
-                    elif minutes > 1:
-                        event["start"] = 'in {0} minutes'.format(minutes)
-                    else:
-                        event["start"] = 'now'
-                    message = "**{name}** (by **@{author}**,*ID:{id}*) - Is starting {start}!".format(**event)
-                    c.execute("UPDATE events SET status = ? WHERE id = ?", (new_status, event["id"],))
-                    announce_channel_id = get_server_property(guild.id, "events_channel", is_int=True, default=0)
-                    if announce_channel_id == 0:
-                        continue
-                    announce_channel = self.bot.get_channel_or_top(guild, announce_channel_id)
-                    if announce_channel is not None:
-                        await announce_channel.send(message)
-                    await self.notify_subscribers(event["id"], message)
+                self.event_schedule_changed.clear()
+                with self.bot.monitor.iteration("events_announce"):
+                    while self.event_schedule and self.event_schedule[0][0] <= time.time():
+                        _, event_id, new_status = heapq.heappop(self.event_schedule)
+                        await self.announce_event(event_id, new_status)
+                timeout = self.event_schedule[0][0] - time.time() if self.event_schedule else None
+                try:
+                    await asyncio.wait_for(self.event_schedule_changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
             except asyncio.CancelledError:
                 break
             except Exception:
                 log.exception("Task: events_announce")
-                continue
-            finally:
-                userDatabase.commit()
-                c.close()
-            await asyncio.sleep(20)
+                await asyncio.sleep(20)
+
+    def load_event_schedule(self):
+        """Loads the pending announcements of all upcoming events."""
+        with closing(userDatabase.cursor()) as c:
+            c.execute("SELECT id, start, status FROM events WHERE start >= ? AND active = 1 AND status != 0",
+                      (time.time(),))
+            events = c.fetchall()
+        self.event_schedule = []
+        for event in events:
+            self.event_schedule.extend(self.get_event_announcements(event))
+        heapq.heapify(self.event_schedule)
+        self.event_schedule_changed.set()
+
+    def schedule_event(self, event_id: int):
+        """Updates the pending announcements of an event after it was created, edited or removed.
+
+        :param event_id: The id of the event.
+        """
+        with closing(userDatabase.cursor()) as c:
+            c.execute("SELECT id, start, status FROM events WHERE id = ? AND active = 1", (event_id,))
+            event = c.fetchone()
+        self.event_schedule = [e for e in self.event_schedule if e[1] != event_id]
+        if event is not None:
+            self.event_schedule.extend(self.get_event_announcements(event))
+        heapq.heapify(self.event_schedule)
+        self.event_schedule_changed.set()
+
+    @staticmethod
+    def get_event_announcements(event) -> List[Tuple[float, int, int]]:
+        """Gets the announcements an event still has to make.
+
+        Announcements that were due more than a minute ago are skipped, like when the bot was offline.
+
+        :param event: A row of the events table, containing its id, start and status.
+        :return: A list of tuples containing the due time, the event's id and the status it changes to.
+        """
+        now = time.time()
+        announcements = []
+        for new_status, seconds_before in EVENT_ANNOUNCEMENTS.items():
+            due = event["start"] - seconds_before
+            if event["status"] > new_status and due > now - 60:
+                announcements.append((due, event["id"], new_status))
+        return announcements
+
+    async def announce_event(self, event_id: int, new_status: int):
+        """Announces that an event is starting soon in the server's events channel and to its subscribers.
+
+        :param event_id: The id of the event.
+        :param new_status: The status the event changes to.
+        """
+        with closing(userDatabase.cursor()) as c:
+            c.execute("SELECT creator, start, name, id, server, status FROM events WHERE id = ? AND active = 1",
+                      (event_id,))
+            event = c.fetchone()
+        if event is None or event["status"] <= new_status:
+            return
+        guild = self.bot.get_guild(event["server"])
+        if guild is None:
+            return
+        author = self.bot.get_member(event["creator"], guild)
+        if author is None:
+            return
+        event["author"] = author.display_name
+        time_diff = dt.timedelta(seconds=max(round(event["start"] - time.time()), 0))
+        days, hours, minutes = time_diff.days, time_diff.seconds // 3600, (time_diff.seconds // 60) % 60
+        if days:
+            event["start"] = 'in {0} days, {1} hours and {2} minutes'.format(days, hours, minutes)
+        elif hours:
+            event["start"] = 'in {0} hours and {1} minutes'.format(hours, minutes)
+        elif minutes > 1:
+            event["start"] = 'in {0} minutes'.format(minutes)
+        else:
+            event["start"] = 'now'
+        message = "**{name}** (by **@{author}**,*ID:{id}*) - Is starting {start}!".format(**event)
+        with userDatabase as conn:
+            conn.execute("UPDATE events SET status = ? WHERE id = ?", (new_status, event["id"],))
+        announce_channel_id = get_server_property(guild.id, "events_channel", is_int=True, default=0)
+        if announce_channel_id == 0:
+            return
+        announce_channel = self.bot.get_channel_or_top(guild, announce_channel_id)
+        if announce_channel is not None:
+            await announce_channel.send(message)
+        await self.notify_subscribers(event["id"], message, failures_only=True)
 
     # Commands
     @commands.command()
@@ -170,14 +220,14 @@ class General:
             result = c.fetchone()
             if result is not None:
                 char_count = result["count"]
-            c.execute("SELECT COUNT(*) as count FROM char_deaths")
+            c.execute("SELECT SUM(count) as count FROM death_stats_killers")
             result = c.fetchone()
             if result is not None:
-                deaths_count = result["count"]
-            c.execute("SELECT COUNT(*) as count FROM char_levelups")
+                deaths_count = result["count"] or 0
+            c.execute("SELECT SUM(count) as count FROM levelup_stats")
             result = c.fetchone()
             if result is not None:
-                levels_count = result["count"]
+                levels_count = result["count"] or 0
 
         used_ram = psutil.Process().memory_full_info().uss / 1024 ** 2
         total_ram = psutil.virtual_memory().total / 1024 ** 2
@@ -443,6 +493,7 @@ class General:
                       (creator, ctx.guild.id, start, name, event_description))
             event_id = c.lastrowid
             userDatabase.commit()
+        self.schedule_event(event_id)
 
         await ctx.send(f"{ctx.tick()} Event created successfully.\n\t**{name}** in *{starts_in.original}*.\n"
                        f"*To edit this event use ID {event_id}*")
@@ -769,6 +820,7 @@ class General:
 
         with userDatabase as conn:
             conn.execute("UPDATE events SET start = ? WHERE id = ?", (now + starts_in.seconds, event_id,))
+        self.schedule_event(event_id)
 
         if event["creator"] == ctx.author.id:
             await ctx.send(f"{ctx.tick()}Your event's start time was changed successfully to **{starts_in.original}**.")
@@ -1026,6 +1078,7 @@ class General:
                       (ctx.author.id, ctx.guild.id, start_time, name, description))
             event_id = c.lastrowid
             userDatabase.commit()
+        self.schedule_event(event_id)
         await ctx.send(f"{ctx.tick()} Event registered successfully.\n\t**{name}** in *{starts_in.original}*.\n"
                        f"*To edit this event use ID {event_id}*")
 
@@ -1095,6 +1148,7 @@ class General:
 
         with userDatabase as conn:
             conn.execute("UPDATE events SET active = 0 WHERE id = ?", (event_id,))
+        self.schedule_event(event_id)
         if event["creator"] == ctx.author.id:
             await ctx.send(f"{ctx.tick()} Your event was deleted successfully.")
         else:
@@ -1403,22 +1457,74 @@ class General:
 
         await ctx.send(embed=embed)
 
-    async def notify_subscribers(self, event_id: int, content, *, embed: discord.Embed=None, skip_creator=False):
-        """Sends a message to all users subscribed to an event"""
+    async def notify_subscribers(self, event_id: int, content, *, embed: discord.Embed=None, skip_creator=False,
+                                 failures_only=False):
+        """Sends a message to all users subscribed to an event
+
+        Messages are sent in the background, so the caller isn't held up by events with many subscribers.
+        Once done, the event's creator is told how many subscribers were reached.
+        With failures_only, used for the periodic reminders, the creator is only told if some couldn't be reached."""
         with closing(userDatabase.cursor()) as c:
-            c.execute("SELECT * FROM events WHERE id = ?", (event_id,))
-            creator = c.fetchone()["creator"]
-            c.execute("SELECT * FROM event_subscribers WHERE event_id = ?", (event_id,))
+            c.execute("SELECT creator, name FROM events WHERE id = ?", (event_id,))
+            event = c.fetchone()
+            c.execute("SELECT user_id FROM event_subscribers WHERE event_id = ?", (event_id,))
             subscribers = c.fetchall()
-        if not subscribers:
+        if not subscribers or event is None:
             return
+        members = []
         for subscriber in subscribers:
-            if subscriber == creator and skip_creator:
+            if subscriber["user_id"] == event["creator"] and skip_creator:
                 continue
             member = self.bot.get_member(subscriber["user_id"])
-            if member is None:
-                continue
-            await member.send(content, embed=embed)
+            if member is not None:
+                members.append(member)
+        if not members:
+            return
+        self.bot.loop.create_task(self.send_notifications(event, members, content, embed, failures_only))
+
+    async def send_notifications(self, event: Dict[str, Union[int, str]], members: List[discord.Member], content,
+                                 embed: discord.Embed=None, failures_only=False):
+        """Sends a private message to a list of members, with a limited number of messages in flight.
+
+        Rate limits are handled by discord.py, the limit just keeps a popular event from flooding the queue.
+        Once done, the event's creator is told how many messages were sent, couldn't be sent or failed.
+
+        :param event: The event the notification is about, containing its creator and name.
+        :param members: The members to notify.
+        :param content: The message's content.
+        :param embed: The message's embed, if any.
+        :param failures_only: Whether to only tell the creator about the results if some members couldn't be notified.
+        """
+        semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+        stats = Counter()
+
+        async def send(member: discord.Member):
+            async with semaphore:
+                try:
+                    await member.send(content, embed=embed)
+                    stats["sent"] += 1
+                except discord.Forbidden:
+                    stats["forbidden"] += 1
+                except discord.HTTPException:
+                    stats["failed"] += 1
+
+        await asyncio.gather(*[send(m) for m in members])
+        log.info(f"Event {event['name']!r} notifications: {stats['sent']} sent, {stats['forbidden']} forbidden, "
+                 f"{stats['failed']} failed")
+        if failures_only and not stats["forbidden"] and not stats["failed"]:
+            return
+        creator = self.bot.get_member(event["creator"])
+        if creator is None:
+            return
+        message = f"Notified **{stats['sent']}** of {len(members)} subscribers of **{event['name']}**."
+        if stats["forbidden"]:
+            message += f"\n{stats['forbidden']} don't allow private messages."
+        if stats["failed"]:
+            message += f"\n{stats['failed']} couldn't be reached."
+        try:
+            await creator.send(message)
+        except discord.HTTPException:
+            pass
 
     def get_event(self, ctx: NabCtx, event_id: int) -> Optional[Dict[str, Union[int, str]]]:
         # If this is used on a PM, show events for all shared servers
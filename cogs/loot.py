@@ -15,9 +15,10 @@ from nabbot import NabBot
 from utils import checks
 from utils.config import config
 from utils.context import NabCtx
-from utils.database import tibiaDatabase, dict_factory
-from utils.general import log, FIELD_VALUE_LIMIT
-from utils.messages import split_message
+from utils.database import tibiaDatabase, dict_factory, TimedConnection
+from utils.general import log
+from utils.messages import add_split_fields
+from utils.monitor import Phase
 from utils.tibiawiki import get_item
 
 LOOTDB = "data/loot.db"
@@ -56,7 +57,7 @@ MIN_WIDTH = 34   # or height smaller than this are not considered.
 Pixel = Tuple[int, ...]
 
 if os.path.isfile(LOOTDB):
-    lootDatabase = sqlite3.connect(LOOTDB)
+    lootDatabase = sqlite3.connect(LOOTDB, factory=TimedConnection)
     lootDatabase.row_factory = dict_factory
 else:
     log.error("Could not find loot.db")
@@ -107,9 +108,10 @@ class Loot:
             return
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(attachment.url) as resp:
-                    loot_image = await resp.read()
+            with Phase("network"):
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(attachment.url) as resp:
+                        loot_image = await resp.read()
         except aiohttp.ClientError:
             log.exception("loot: Couldn't parse image")
             await ctx.send("I failed to load your image. Please try again.")
@@ -182,11 +184,7 @@ class Loot:
             else:
                 name = f"{group} - {group_value:,} gold"
             # Split into multiple fields if they exceed field max length
-            split_group = split_message(value, FIELD_VALUE_LIMIT)
-            for subgroup in split_group:
-                if subgroup != split_group[0]:
-                    name = "\u200F"
-                embed.add_field(name=name, value=subgroup, inline=False)
+            add_split_fields(embed, name, value, inline=False)
 
         if unknown:
             long_message += f"\n**There were {unknown['count']} unknown items.**\n"
@@ -231,9 +229,10 @@ class Loot:
             return
 
         try:
-            with aiohttp.ClientSession() as session:
-                async with session.get(attachment.url) as resp:
-                    original_image = await resp.read()
+            with Phase("network"):
+                with aiohttp.ClientSession() as session:
+                    async with session.get(attachment.url) as resp:
+                        original_image = await resp.read()
             frame_image = Image.open(io.BytesIO(bytearray(original_image))).convert("RGBA")
         except Exception:
             await ctx.send("Either that wasn't an image or I failed to load it, please try again.")
@@ -286,9 +285,10 @@ class Loot:
             return
 
         try:
-            with aiohttp.ClientSession() as session:
-                async with session.get(attachment.url) as resp:
-                    original_image = await resp.read()
+            with Phase("network"):
+                with aiohttp.ClientSession() as session:
+                    async with session.get(attachment.url) as resp:
+                        original_image = await resp.read()
             frame_image = Image.open(io.BytesIO(bytearray(original_image))).convert("RGBA")
         except Exception:
             await ctx.send("Either that wasn't an image or I failed to load it, please try again.")
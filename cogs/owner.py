@@ -1,3 +1,4 @@
+import asyncio
 import inspect
 import platform
 import sqlite3
@@ -16,9 +17,15 @@ from utils.database import get_server_property
 from utils.context import NabCtx
 from utils.general import *
 from utils.messages import *
+from utils.monitor import ProfileSession
 from utils.tibia import *
 from utils.tibiawiki import *
 
+# Maximum time to wait for profiled command invocations, in seconds
+PROFILE_TIMEOUT = 600
+# Maximum time a task can be profiled for, in seconds
+PROFILE_MAX_DURATION = 600
+
 req_pattern = re.compile(r"([\w]+)([><=]+)([\d.]+),([><=]+)([\d.]+)")
 dpy_commit = re.compile(r"a(\d+)\+g([\w]+)")
 
@@ -77,6 +84,27 @@ class Owner:
             pass
         await ctx.send("Message sent to "+join_list(["@"+a.name for a in guild_admins], ", ", " and "))
 
+    @commands.command(aliases=["latency"])
+    @checks.is_owner()
+    async def commandstats(self, ctx: NabCtx):
+        """Shows the latency of every command used since the bot started.
+
+        For each command, the number of invocations and the 50th, 95th and 99th percentiles and maximum of their
+        latency are shown, slowest first.
+        The percentage of time spent fetching from Tibia.com and TibiaData, querying the database, sending messages and
+        everything else is shown too.
+
+        Time spent waiting for replies or reactions is not counted."""
+        if not self.bot.command_metrics.commands:
+            await ctx.send("No commands have been used yet.")
+            return
+        table = self.bot.command_metrics.get_table()
+        if len(table) > 1990:
+            fp = io.BytesIO(table.encode('utf-8'))
+            await ctx.send('Too many commands to display here', file=discord.File(fp, 'commandstats.txt'))
+        else:
+            await ctx.send(f"```\n{table}```")
+
     # noinspection PyBroadException
     @commands.command(name="eval")
     @checks.is_owner()
@@ -135,6 +163,52 @@ class Owner:
                 self._last_result = ret
                 await ctx.send(f'```py\n{value}{ret}\n```')
 
+    @commands.command(aliases=["monitor"])
+    @checks.is_owner()
+    async def health(self, ctx: NabCtx):
+        """Shows the event loop's lag and the status of background tasks.
+
+        The lag is how late the event loop runs scheduled code, covering the last 10 minutes.
+        Blocks are the times the loop was stuck longer than the configured threshold.
+
+        Announcements waiting to be sent are shown, with the channels with the most pending announcements.
+
+        For each background task, the number of iterations, their average and maximum durations, errors and the time of
+        the last successful iteration are shown."""
+        monitor = self.bot.monitor
+        average, p95, maximum = monitor.get_lag_stats()
+        monitor_start = dt.datetime.utcfromtimestamp(monitor.start_time)
+        embed = discord.Embed(title="Health", description=f"Monitoring for {parse_uptime(monitor_start)}")
+        embed.add_field(name="Event loop", inline=False,
+                        value=f"**Lag:** avg {average*1000:.1f}ms, p95 {p95*1000:.1f}ms, max {maximum*1000:.1f}ms\n"
+                              f"**Blocks over {monitor.block_threshold}s:** {monitor.block_count}")
+        tracking = self.bot.get_cog("Tracking")
+        if tracking is not None:
+            backlog = tracking.get_announcement_backlog()
+            value = f"**Pending:** {sum(backlog.values()):,} in {len(backlog):,} channels"
+            for channel_id, count in sorted(backlog.items(), key=lambda x: x[1], reverse=True)[:5]:
+                channel = self.bot.get_channel(channel_id)
+                name = f"#{channel.name} ({channel.guild.name})" if channel is not None else channel_id
+                value += f"\n{name}: {count:,}"
+            embed.add_field(name="Announcements", value=value, inline=False)
+        for task in monitor.get_task_list():
+            if task.last_success:
+                last_success = parse_uptime(dt.datetime.utcfromtimestamp(task.last_success)) + " ago"
+            else:
+                last_success = "Never"
+            value = f"**Iterations:** {task.iterations:,}\n" \
+                    f"**Duration:** avg {task.average_time*1000:.0f}ms, max {task.max_time*1000:.0f}ms\n" \
+                    f"**Errors:** {task.errors:,}\n" \
+                    f"**Last success:** {last_success}"
+            if task.last_error:
+                value += f"\n**Last error:** `{task.last_error[:100]}`"
+            embed.add_field(name=task.name, value=value)
+        if monitor.blocks:
+            blocks = [f"{dt.datetime.utcfromtimestamp(date):%H:%M:%S} - {duration*1000:.0f}ms - {location}"
+                      for date, duration, location in reversed(monitor.blocks)]
+            add_split_fields(embed, "Recent blocks", "\n".join(blocks), inline=False, total_limit=1500)
+        await ctx.send(embed=embed)
+
     @commands.command()
     @checks.is_owner()
     async def leave(self, ctx: NabCtx, *, server: str):
@@ -354,6 +428,75 @@ class Owner:
         await resp.edit(content=f'Pong! That took {1000*diff.total_seconds():.1f}ms.\n'
                                 f'Socket latency is {1000*self.bot.latency:.1f}ms')
 
+    @checks.is_owner()
+    @commands.group(invoke_without_command=True, case_insensitive=True)
+    async def profile(self, ctx: NabCtx):
+        """Profiles a command or a background task.
+
+        The functions that took the most time are sent as a file."""
+        await ctx.send(f"Use `{ctx.clean_prefix}profile command <count> <command>` or "
+                       f"`{ctx.clean_prefix}profile task <seconds> <task>`.")
+
+    @checks.is_owner()
+    @profile.command(name="command", usage="<count> <command>")
+    async def profile_command(self, ctx: NabCtx, count: int, *, command: str):
+        """Profiles the next invocations of a command.
+
+        The results are sent once the command has been used the specified number of times, or after 10 minutes.
+        Code from other tasks running while the command waits is included in the results too."""
+        target = self.bot.get_command(command)
+        if target is None:
+            await ctx.send(f"{ctx.tick(False)} There's no command named `{command}`.")
+            return
+        if not 1 <= count <= 100:
+            await ctx.send(f"{ctx.tick(False)} The number of invocations must be between 1 and 100.")
+            return
+        await self.run_profile(ctx, ProfileSession("command", target.qualified_name, count=count), PROFILE_TIMEOUT)
+
+    @checks.is_owner()
+    @profile.command(name="task", usage="<seconds> <task>")
+    async def profile_task(self, ctx: NabCtx, seconds: int, task: str):
+        """Profiles a background task for a number of seconds.
+
+        Only the task's iterations are profiled, including code from other tasks running while the task waits.
+        The tasks available are listed in the health command."""
+        if task not in self.bot.monitor.tasks:
+            tasks = join_list([f"`{t}`" for t in sorted(self.bot.monitor.tasks)], ", ", " and ")
+            await ctx.send(f"{ctx.tick(False)} There's no task named `{task}`. Available tasks: {tasks}")
+            return
+        if not 1 <= seconds <= PROFILE_MAX_DURATION:
+            await ctx.send(f"{ctx.tick(False)} The duration must be between 1 and {PROFILE_MAX_DURATION} seconds.")
+            return
+        await self.run_profile(ctx, ProfileSession("task", task), seconds)
+
+    async def run_profile(self, ctx: NabCtx, session: ProfileSession, timeout: float):
+        """Runs a profiling session and sends its report.
+
+        :param ctx: The context of the command that started the session.
+        :param session: The session to run.
+        :param timeout: The maximum time the session can last."""
+        monitor = self.bot.monitor
+        current = monitor.profile_session
+        if current is not None:
+            await ctx.send(f"{ctx.tick(False)} I'm already profiling {current.kind} `{current.name}`.")
+            return
+        monitor.profile_session = session
+        if session.remaining:
+            await ctx.send(f"Profiling the next {session.remaining} invocations of `{session.name}`...")
+        else:
+            await ctx.send(f"Profiling `{session.name}` for {timeout} seconds...")
+        try:
+            await asyncio.wait_for(session.finished.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            session.finish()
+            monitor.profile_session = None
+        report = await ctx.execute_async(session.get_report)
+        fp = io.BytesIO(report.encode('utf-8'))
+        await ctx.send(f"{ctx.author.mention} Profiled {session.runs} runs of {session.kind} `{session.name}`.",
+                       file=discord.File(fp, f"profile_{session.name.replace(' ', '_')}.txt"))
+
     @checks.is_owner()
     @commands.command(name="reload")
     async def reload_cog(self, ctx: NabCtx, *, cog):
@@ -1,6 +1,5 @@
-import asyncio
 from contextlib import closing
-from typing import List
+from typing import List, Dict, Set
 
 import discord
 from discord.ext import commands
@@ -14,11 +13,17 @@ from utils.general import log, get_user_avatar
 from utils.pages import CannotPaginate, Pages
 from utils.tibia import get_guild, NetworkError
 
+# Maximum number of member ids looked up in a single query
+MEMBERS_PER_QUERY = 500
+
 
 class Roles:
     """Commands related to role management."""
     def __init__(self, bot: NabBot):
         self.bot = bot
+        # Autorole rules of each server, key:value = server_id:{tibia_guild:{role_id}}
+        self.autoroles: Dict[int, Dict[str, Set[int]]] = {}
+        self.load_autoroles()
 
     async def __error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
@@ -35,64 +40,88 @@ class Roles:
 
         userDatabase.execute("DELETE FROM joinable_roles WHERE role_id = ?", (role.id,))
         userDatabase.execute("DELETE FROM auto_roles WHERE role_id = ?", (role.id,))
+        self.load_autoroles(role.guild.id)
 
     async def on_character_change(self, user_id: int):
         try:
             with closing(userDatabase.cursor()) as c:
                 guilds_raw = c.execute("SELECT guild FROM chars WHERE user_id = ?", (user_id,)).fetchall()
-                rules_raw = c.execute("SELECT * FROM auto_roles ORDER BY server_id").fetchall()
             # Flatten list of guilds
             guilds = set(g['guild'] for g in guilds_raw)
 
-            # Flatten rules
-            rules = {}
-            for rule in rules_raw:
-                server_id = rule["server_id"]
-                if server_id not in rules:
-                    rules[rule["server_id"]] = []
-                rules[server_id].append((rule["role_id"], rule["guild"]))
-            for server, rules in rules.items():
-                guild: discord.Guild = self.bot.get_guild(server)
+            # Only servers shared with the user that have rules are checked
+            for server_id in self.bot.members.get(user_id, set()) & self.autoroles.keys():
+                guild: discord.Guild = self.bot.get_guild(server_id)
                 if guild is None:
                     continue
                 member: discord.Member = guild.get_member(user_id)
                 if member is None:
                     continue
-
-                all_roles = set()
-                to_add = set()
-                for role_id, tibia_guild in rules:
-                    role: discord.Role = discord.utils.get(guild.roles, id=role_id)
-                    if role is None:
-                        continue
-                    all_roles.add(role)
-                    if (tibia_guild == "*" and guilds) or tibia_guild in guilds:
-                        to_add.add(role)
-                to_remove = all_roles-to_add
-                try:
-                    before_roles = set(member.roles)
-                    await member.remove_roles(*to_remove, reason="Automatic roles")
-                    await member.add_roles(*to_add, reason="Automatic roles")
-                    # A small delay is needed so member.roles is updated with the added possible added roles.
-                    await asyncio.sleep(0.15)
-                    after_roles = set(member.roles)
-
-                    new_roles = after_roles-before_roles
-                    removed_roles = before_roles-after_roles
-                    if new_roles or removed_roles:
-                        embed = discord.Embed(colour=discord.Colour.dark_blue(), title="Autorole changes")
-                        embed.set_author(name="{0.name}#{0.discriminator} (ID: {0.id})".format(member),
-                                         icon_url=get_user_avatar(member))
-                        if new_roles:
-                            embed.add_field(name="Added roles", value=", ".join(r.mention for r in new_roles))
-                        if removed_roles:
-                            embed.add_field(name="Removed roles", value=", ".join(r.mention for r in removed_roles))
-                        await self.bot.send_log_message(guild, embed=embed)
-                except discord.HTTPException:
-                    pass
+                await self.apply_autoroles(member, guilds)
         except Exception:
             log.exception("Event: character_change")
 
+    def load_autoroles(self, server_id: int = None):
+        """Loads the autorole rules from the database.
+
+        :param server_id: If specified, only the rules of this server are reloaded.
+        """
+        with closing(userDatabase.cursor()) as c:
+            if server_id is None:
+                c.execute("SELECT server_id, role_id, guild FROM auto_roles")
+                self.autoroles.clear()
+            else:
+                c.execute("SELECT server_id, role_id, guild FROM auto_roles WHERE server_id = ?", (server_id,))
+                self.autoroles.pop(server_id, None)
+            for rule in c.fetchall():
+                self.autoroles.setdefault(rule["server_id"], {}).setdefault(rule["guild"], set()).add(rule["role_id"])
+
+    async def apply_autoroles(self, member: discord.Member, tibia_guilds: Set[str]) -> bool:
+        """Gives and removes a member's automatic roles according to the guilds of their characters.
+
+        The roles to change are calculated locally, so members whose roles are already right cause no API calls.
+
+        :param member: The member to update.
+        :param tibia_guilds: The guilds the member's characters are in.
+        :return: Whether the member's roles were changed or not.
+        """
+        rules = self.autoroles.get(member.guild.id)
+        if not rules:
+            return False
+        managed_ids = set()
+        wanted_ids = set()
+        for tibia_guild, role_ids in rules.items():
+            managed_ids |= role_ids
+            if (tibia_guild == "*" and tibia_guilds) or tibia_guild in tibia_guilds:
+                wanted_ids |= role_ids
+        current_ids = {r.id for r in member.roles}
+        add_ids = wanted_ids - current_ids
+        remove_ids = (managed_ids - wanted_ids) & current_ids
+        if not add_ids and not remove_ids:
+            return False
+
+        roles = {r.id: r for r in member.guild.roles}
+        new_roles = [roles[role_id] for role_id in add_ids if role_id in roles]
+        removed_roles = [roles[role_id] for role_id in remove_ids if role_id in roles]
+        try:
+            if removed_roles:
+                await member.remove_roles(*removed_roles, reason="Automatic roles")
+            if new_roles:
+                await member.add_roles(*new_roles, reason="Automatic roles")
+        except discord.HTTPException:
+            return False
+        if new_roles or removed_roles:
+            embed = discord.Embed(colour=discord.Colour.dark_blue(), title="Autorole changes")
+            embed.set_author(name="{0.name}#{0.discriminator} (ID: {0.id})".format(member),
+                             icon_url=get_user_avatar(member))
+            if new_roles:
+                embed.add_field(name="Added roles", value=", ".join(r.mention for r in new_roles))
+            if removed_roles:
+                embed.add_field(name="Removed roles", value=", ".join(r.mention for r in removed_roles))
+            await self.bot.send_log_message(member.guild, embed=embed)
+            return True
+        return False
+
     @checks.has_guild_permissions(manage_roles=True)
     @commands.guild_only()
     @commands.group(case_insensitive=True)
@@ -154,6 +183,7 @@ class Roles:
 
         userDatabase.execute("INSERT INTO auto_roles(server_id, role_id, guild) VALUES(?,?, ?)", (ctx.guild.id, role.id,
                                                                                                   name))
+        self.load_autoroles(ctx.guild.id)
         await ctx.send(f"{ctx.tick()} Autorole rule created.")
 
     @checks.has_guild_permissions(manage_roles=True)
@@ -196,27 +226,73 @@ class Roles:
         """Triggers a refresh on all members.
 
         This will apply existing rules to all members.
-        Note that guild changes from members that haven't been online won't be detected.
+        The member list of every guild with a rule is fetched once and the guild of registered characters is updated.
         Deleted rules won't have any effect.
 
         This command can only be used once per server every hour.
         """
-        msg = await ctx.send("This will make me check the guilds of all registered characters to apply existing rules."
-                             "\nNote that character with outdated information won't be updated until they are online "
-                             "again or checked using `whois`\nAre you sure you want this?.")
+        msg = await ctx.send("This will make me check the members of every guild with autorole rules and update the "
+                             "roles of all members.\nAre you sure you want this?.")
         confirm = await ctx.react_confirm(msg, timeout=60, delete_after=True)
         if not confirm:
             ctx.command.reset_cooldown(ctx)
             return
-        msg: discord.Message = await ctx.send("Dispatching events...")
-        for member in ctx.guild.members:
-            self.bot.dispatch("character_change", member.id)
+        msg: discord.Message = await ctx.send("Fetching guilds...")
+        members = {m.id: m for m in ctx.guild.members}
+
+        # Fetch every guild referenced by the rules only once
+        tibia_guilds = [g for g in self.autoroles.get(ctx.guild.id, {}) if g != "*"]
+        guild_members = {}
+        fetched_guilds = set()
+        for name in tibia_guilds:
+            try:
+                tibia_guild = await get_guild(name)
+            except NetworkError:
+                continue
+            if tibia_guild is None:
+                continue
+            fetched_guilds.add(tibia_guild.name)
+            for guild_member in tibia_guild.members:
+                guild_members[guild_member["name"].lower()] = tibia_guild.name
+
+        # Reconcile the guild of the server's registered characters in a single transaction
+        # Members are looked up in chunks, to stay below SQLite's limit of parameters per query
+        member_ids = list(members)
+        chars = []
+        with closing(userDatabase.cursor()) as c:
+            for i in range(0, len(member_ids), MEMBERS_PER_QUERY):
+                chunk = member_ids[i:i + MEMBERS_PER_QUERY]
+                placeholders = ", ".join("?" * len(chunk))
+                c.execute(f"SELECT id, name, guild, user_id FROM chars WHERE user_id IN ({placeholders})", chunk)
+                chars.extend(c.fetchall())
+        updates = []
+        user_guilds = {}
+        for char in chars:
+            guild = char["guild"]
+            if char["name"].lower() in guild_members:
+                guild = guild_members[char["name"].lower()]
+            elif guild in fetched_guilds:
+                # The character is no longer in that guild, and we don't know its new one
+                guild = None
+            if guild != char["guild"]:
+                updates.append((guild, char["id"]))
+            user_guilds.setdefault(char["user_id"], set()).add(guild)
+        if updates:
+            with userDatabase as conn:
+                conn.executemany("UPDATE chars SET guild = ? WHERE id = ?", updates)
+
+        # Recalculate the roles of every member in one pass
+        changed = 0
+        for member in members.values():
+            if await self.apply_autoroles(member, user_guilds.get(member.id, set())):
+                changed += 1
+
+        content = f"{ctx.tick()} Refresh done. Checked {len(fetched_guilds)} of {len(tibia_guilds)} guilds, " \
+                  f"updated {len(updates)} characters and changed the roles of {changed} members."
         try:
-            await msg.edit(content=f"{ctx.tick()} Refresh done, roles will be updated shortly.")
+            await msg.edit(content=content)
         except discord.HTTPException:
-            await ctx.send(f"{ctx.tick()} Refresh done, roles will be updated shortly.")
-            pass
-
+            await ctx.send(content)
 
     @checks.has_guild_permissions(manage_roles=True)
     @commands.guild_only()
@@ -243,6 +319,7 @@ class Roles:
         await ctx.send(f"{ctx.tick()} Auto role rule removed. "
                        f"Note that the role won't be removed from current members.")
         userDatabase.execute("DELETE FROM auto_roles WHERE role_id = ? AND guild LIKE ?", (group.id, guild))
+        self.load_autoroles(ctx.guild.id)
 
     @commands.guild_only()
     @commands.group(invoke_without_command=True, case_insensitive=True)
@@ -242,6 +242,7 @@ class Settings:
             return
 
         set_server_property(ctx.guild.id, "levels_channel", new_value)
+        self.bot.reload_announce_targets()
         if new_value is 0:
             await ctx.send(f"{ctx.tick(True)} The level & deaths channel has been disabled.")
         else:
@@ -264,6 +265,7 @@ class Settings:
             return await ctx.send(f"{ctx.tick(False)} Level can't be lower than 1.")
 
         set_server_property(ctx.guild.id, "announce_level", level)
+        self.bot.reload_announce_targets()
         await ctx.send(f"{ctx.tick()} Minimum announce level has been set to `{level}`.")
 
     @checks.is_admin()
@@ -348,6 +350,7 @@ class Settings:
             prefixes.append(prefix)
             await ctx.send(f"{ctx.tick(True)} The prefix `{prefix}` was added.")
         set_server_property(ctx.guild.id, "prefixes", sorted(prefixes, reverse=True), serialize=True)
+        self.bot.reload_prefixes(ctx.guild.id)
 
     @checks.is_admin()
     @settings.command(name="welcome")
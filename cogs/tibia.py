@@ -1,10 +1,12 @@
 import asyncio
 import calendar
 import datetime as dt
+import itertools
 import random
 import re
 import time
 import urllib.parse
+from contextlib import closing
 from operator import attrgetter
 from typing import Optional
 
@@ -15,11 +17,11 @@ from nabbot import NabBot
 from utils import checks
 from utils.config import config
 from utils.context import NabCtx
-from utils.database import get_server_property, userDatabase
+from utils.database import get_server_property, userDatabase, STATS_PERIOD, iter_by_date, named_placeholders
 from utils.general import get_time_diff, join_list, get_brasilia_time_zone, global_online_list, get_local_timezone, log, \
     is_numeric, get_user_avatar
 from utils.messages import html_to_markdown, get_first_image, split_message
-from utils.pages import Pages, CannotPaginate, VocationPages
+from utils.pages import Pages, CannotPaginate, VocationPages, LazyPages
 from utils.tibia import NetworkError, get_character, tibia_logo, get_share_range, get_voc_emoji, get_voc_abb, get_guild, \
     url_house, get_stats, get_map_area, get_tibia_time_zone, get_world, tibia_worlds, get_world_bosses, get_recent_news, \
     get_news_article, Character, url_guild, highscore_format, get_character_url, url_character, get_house, \
@@ -128,96 +130,82 @@ class Tibia:
                 await ctx.send("This server is not tracking any tibia worlds.")
                 return
 
-        c = userDatabase.cursor()
-        entries = []
         author = None
         author_icon = discord.Embed.Empty
-        count = 0
         now = time.time()
         show_links = not ctx.long
         per_page = 20 if ctx.long else 5
-        try:
-            if name is None:
-                title = "Latest deaths"
-                c.execute("SELECT char_deaths.level, date, name, user_id, byplayer, killer, world, vocation "
-                          "FROM char_deaths, chars "
-                          "WHERE char_id = id AND char_deaths.level > ? "
-                          "ORDER BY date DESC", (config.announce_threshold,))
-                while True:
-                    row = c.fetchone()
-                    if row is None:
-                        break
+        if name is None:
+            title = "Latest deaths"
+            worlds, params = named_placeholders("world", user_worlds)
+
+            def get_entries():
+                for row in iter_by_date("SELECT char_deaths.rowid, char_deaths.level, date, name, user_id, byplayer, "
+                                        "killer, world, vocation FROM char_deaths, chars "
+                                        f"WHERE char_id = id AND char_deaths.level > :level AND world IN ({worlds}) "
+                                        "AND (date < :before OR date = :before AND char_deaths.rowid < :before_rowid) "
+                                        "ORDER BY date DESC, char_deaths.rowid DESC LIMIT :limit",
+                                        dict(params, level=config.announce_threshold)):
                     user = self.bot.get_member(row["user_id"], user_guilds)
                     if user is None:
                         continue
-                    if row["world"] not in user_worlds:
-                        continue
-                    count += 1
                     row["time"] = get_time_diff(dt.timedelta(seconds=now - row["date"]))
                     row["user"] = user.display_name
                     row["emoji"] = get_voc_emoji(row["vocation"])
-                    entries.append("{emoji} {name} (**@{user}**) - At level **{level}** by {killer} - *{time} ago*"
-                                   .format(**row))
-                    if count >= 100:
-                        break
-            else:
-                try:
-                    char = await get_character(name)
-                    if char is None:
-                        await ctx.send("That character doesn't exist.")
-                        return
-                except NetworkError:
-                    await ctx.send("Sorry, I had trouble checking that character, try it again.")
+                    yield "{emoji} {name} (**@{user}**) - At level **{level}** by {killer} - *{time} ago*".format(**row)
+        else:
+            try:
+                char = await get_character(name)
+                if char is None:
+                    await ctx.send("That character doesn't exist.")
                     return
-                deaths = char.deaths
-                last_time = now
-                name = char.name
-                voc_emoji = get_voc_emoji(char.vocation)
-                title = "{1} {0} latest deaths:".format(name, voc_emoji)
-                if ctx.guild is not None and char.owner:
-                    owner: discord.Member = ctx.guild.get_member(char.owner)
-                    if owner is not None:
-                        author = owner.display_name
-                        author_icon = owner.avatar_url
-                for death in deaths:
-                    last_time = death.time.timestamp()
-                    death_time = get_time_diff(dt.datetime.now(tz=dt.timezone.utc) - death.time)
-                    if death.by_player and show_links:
-                        killer = f"[{death.killer}]({Character.get_url(death.killer)})"
-                    elif death.by_player:
-                        killer = f"**{death.killer}**"
-                    else:
-                        killer = f"{death.killer}"
-                    entries.append("At level **{0.level}** by {name} - *{time} ago*".format(death, time=death_time,
-                                                                                            name=killer))
-                    count += 1
+            except NetworkError:
+                await ctx.send("Sorry, I had trouble checking that character, try it again.")
+                return
+            deaths = char.deaths
+            last_time = now
+            name = char.name
+            voc_emoji = get_voc_emoji(char.vocation)
+            title = "{1} {0} latest deaths:".format(name, voc_emoji)
+            if ctx.guild is not None and char.owner:
+                owner: discord.Member = ctx.guild.get_member(char.owner)
+                if owner is not None:
+                    author = owner.display_name
+                    author_icon = owner.avatar_url
+            entries = []
+            for death in deaths:
+                last_time = death.time.timestamp()
+                death_time = get_time_diff(dt.datetime.now(tz=dt.timezone.utc) - death.time)
+                if death.by_player and show_links:
+                    killer = f"[{death.killer}]({Character.get_url(death.killer)})"
+                elif death.by_player:
+                    killer = f"**{death.killer}**"
+                else:
+                    killer = f"{death.killer}"
+                entries.append("At level **{0.level}** by {name} - *{time} ago*".format(death, time=death_time,
+                                                                                        name=killer))
 
+            with closing(userDatabase.cursor()) as c:
                 c.execute("SELECT id, name FROM chars WHERE name LIKE ?", (name,))
                 result = c.fetchone()
-                if result is not None and not ctx.is_lite:
-                    id = result["id"]
-                    c.execute("SELECT char_deaths.level, date, byplayer, killer "
-                              "FROM char_deaths "
-                              "WHERE char_id = ? AND date < ? "
-                              "ORDER BY date DESC",
-                              (id, last_time))
-                    while True:
-                        row = c.fetchone()
-                        if row is None:
-                            break
-                        count += 1
-                        row["time"] = get_time_diff(dt.timedelta(seconds=now - row["date"]))
-                        entries.append("At level **{level}** by {killer} - *{time} ago*".format(**row))
-                        if count >= 100:
-                            break
-
-            if count == 0:
-                await ctx.send("There are no registered deaths.")
-                return
-        finally:
-            c.close()
 
-        pages = Pages(ctx, entries=entries, per_page=per_page)
+            def get_entries():
+                yield from entries
+                if result is None or ctx.is_lite:
+                    return
+                # Older deaths that are no longer shown in the character's page
+                for row in iter_by_date("SELECT rowid, level, date, byplayer, killer FROM char_deaths "
+                                        "WHERE char_id = :id AND date < :last_time "
+                                        "AND (date < :before OR date = :before AND rowid < :before_rowid) "
+                                        "ORDER BY date DESC, rowid DESC LIMIT :limit",
+                                        {"id": result["id"], "last_time": last_time}):
+                    row["time"] = get_time_diff(dt.timedelta(seconds=now - row["date"]))
+                    yield "At level **{level}** by {killer} - *{time} ago*".format(**row)
+
+        pages = LazyPages(ctx, source=itertools.islice(get_entries(), 100), per_page=per_page)
+        if not pages.entries:
+            await ctx.send("There are no registered deaths.")
+            return
         pages.embed.title = title
         pages.embed.set_author(name=author, icon_url=author_icon)
         try:
@@ -234,9 +222,6 @@ class Tibia:
             await ctx.send("Sorry, I need `Embed Links` permission for this command.")
             return
 
-        c = userDatabase.cursor()
-        count = 0
-        entries = []
         now = time.time()
         per_page = 20 if ctx.long else 5
 
@@ -244,32 +229,26 @@ class Tibia:
             name_with_article = "an " + name
         else:
             name_with_article = "a " + name
-        try:
-            c.execute("SELECT char_deaths.level, date, name, user_id, byplayer, killer, vocation "
-                      "FROM char_deaths, chars "
-                      "WHERE char_id = id AND (killer LIKE ? OR killer LIKE ?) "
-                      "ORDER BY date DESC", (name, name_with_article))
-            while True:
-                row = c.fetchone()
-                if row is None:
-                    break
+
+        def get_entries():
+            for row in iter_by_date("SELECT char_deaths.rowid, char_deaths.level, date, name, user_id, byplayer, "
+                                    "killer, vocation FROM char_deaths, chars "
+                                    "WHERE char_id = id AND (killer LIKE :name OR killer LIKE :name_with_article) "
+                                    "AND (date < :before OR date = :before AND char_deaths.rowid < :before_rowid) "
+                                    "ORDER BY date DESC, char_deaths.rowid DESC LIMIT :limit",
+                                    {"name": name, "name_with_article": name_with_article}):
                 user = self.bot.get_member(row["user_id"], ctx.guild)
                 if user is None:
                     continue
-                count += 1
                 row["time"] = get_time_diff(dt.timedelta(seconds=now - row["date"]))
                 row["user"] = user.display_name
                 row["emoji"] = get_voc_emoji(row["vocation"])
-                entries.append("{emoji} {name} (**@{user}**) - At level **{level}** - *{time} ago*".format(**row))
-                if count >= 100:
-                    break
-            if count == 0:
-                await ctx.send("There are no registered deaths by that killer.")
-                return
-        finally:
-            c.close()
+                yield "{emoji} {name} (**@{user}**) - At level **{level}** - *{time} ago*".format(**row)
 
-        pages = Pages(ctx, entries=entries, per_page=per_page)
+        pages = LazyPages(ctx, source=itertools.islice(get_entries(), 100), per_page=per_page)
+        if not pages.entries:
+            await ctx.send("There are no registered deaths by that killer.")
+            return
         pages.embed.title = f"{name.title()} latest kills"
 
         try:
@@ -301,39 +280,28 @@ class Tibia:
             await ctx.send("I don't see any users with that name.")
             return
 
-        c = userDatabase.cursor()
-        count = 0
-        entries = []
         now = time.time()
         per_page = 20 if ctx.long else 5
 
-        try:
-            c.execute("SELECT name, world, char_deaths.level, killer, byplayer, date, vocation "
-                      "FROM chars, char_deaths "
-                      "WHERE char_id = id AND user_id = ? "
-                      "ORDER BY date DESC", (user.id,))
-            while True:
-                row = c.fetchone()
-                if row is None:
-                    break
-                if row["world"] not in user_worlds:
-                    continue
-                count += 1
+        worlds, params = named_placeholders("world", user_worlds)
+
+        def get_entries():
+            for row in iter_by_date("SELECT char_deaths.rowid, name, world, char_deaths.level, killer, byplayer, date, "
+                                    "vocation FROM chars, char_deaths "
+                                    f"WHERE char_id = id AND user_id = :user_id AND world IN ({worlds}) "
+                                    "AND (date < :before OR date = :before AND char_deaths.rowid < :before_rowid) "
+                                    "ORDER BY date DESC, char_deaths.rowid DESC LIMIT :limit",
+                                    dict(params, user_id=user.id)):
                 row["time"] = get_time_diff(dt.timedelta(seconds=now - row["date"]))
                 row["emoji"] = get_voc_emoji(row["vocation"])
-                entries.append("{emoji} {name} - At level **{level}** by {killer} - *{time} ago*".format(**row))
-
-                if count >= 100:
-                    break
-            if count == 0:
-                await ctx.send("There are not registered deaths by this user.")
-                return
-        finally:
-            c.close()
+                yield "{emoji} {name} - At level **{level}** by {killer} - *{time} ago*".format(**row)
 
+        pages = LazyPages(ctx, source=itertools.islice(get_entries(), 100), per_page=per_page)
+        if not pages.entries:
+            await ctx.send("There are not registered deaths by this user.")
+            return
         title = "{0} latest kills".format(user.display_name)
         icon_url = user.avatar_url
-        pages = Pages(ctx, entries=entries, per_page=per_page)
         pages.embed.set_author(name=title, icon_url=icon_url)
         try:
             await pages.paginate()
@@ -376,13 +344,15 @@ class Tibia:
             description_suffix = ""
             embed.set_footer(text=f"For a shorter period, try {ctx.clean_prefix}{ctx.command.qualified_name} week or "
                                   f"{ctx.clean_prefix}{ctx.command.qualified_name} month")
+        # Statistics are read from the daily rollups, so periods start at the beginning of a day
+        start_day = int(start_date // STATS_PERIOD)
         try:
-            c.execute("SELECT COUNT() AS total FROM char_deaths WHERE date >= ?", (start_date,))
-            total = c.fetchone()["total"]
+            c.execute("SELECT SUM(count) AS total FROM death_stats_killers WHERE day >= ?", (start_day,))
+            total = c.fetchone()["total"] or 0
             embed.description = f"There are {total:,} deaths registered{description_suffix}."
-            c.execute("SELECT COUNT() as count, chars.name, chars.user_id FROM char_deaths, chars "
-                      f"WHERE id = char_id AND world IN ({placeholders}) AND date >= {start_date} "
-                      "GROUP BY char_id ORDER BY count DESC LIMIT 3", tuple(user_worlds))
+            c.execute("SELECT SUM(count) as count, chars.name, chars.user_id FROM death_stats_chars, chars "
+                      f"WHERE id = char_id AND death_stats_chars.world IN ({placeholders}) AND day >= ? "
+                      "GROUP BY char_id ORDER BY count DESC LIMIT 3", tuple(user_worlds) + (start_day,))
             content = ""
             count = 0
             while True:
@@ -399,9 +369,9 @@ class Tibia:
             if count > 0:
                 embed.add_field(name="Most deaths per character", value=content, inline=False)
 
-            c.execute("SELECT COUNT() as count, chars.user_id FROM char_deaths, chars "
-                      f"WHERE id = char_id AND world IN ({placeholders}) AND date >= {start_date} "
-                      "GROUP BY user_id ORDER BY count DESC", tuple(user_worlds))
+            c.execute("SELECT SUM(count) as count, chars.user_id FROM death_stats_chars, chars "
+                      f"WHERE id = char_id AND death_stats_chars.world IN ({placeholders}) AND day >= ? "
+                      "GROUP BY user_id ORDER BY count DESC", tuple(user_worlds) + (start_day,))
             content = ""
             count = 0
             while True:
@@ -418,9 +388,9 @@ class Tibia:
             if count > 0:
                 embed.add_field(name="Most deaths per user", value=content, inline=False)
 
-            c.execute("SELECT COUNT() as count, killer FROM char_deaths, chars "
-                      f"WHERE id = char_id and world IN ({placeholders}) AND date >= {start_date} "
-                      "GROUP BY killer ORDER BY count DESC LIMIT 3", tuple(user_worlds))
+            c.execute("SELECT SUM(count) as count, killer FROM death_stats_killers "
+                      f"WHERE world IN ({placeholders}) AND day >= ? "
+                      "GROUP BY killer ORDER BY count DESC LIMIT 3", tuple(user_worlds) + (start_day,))
             total_per_killer = c.fetchall()
             content = ""
             for row in total_per_killer:
@@ -740,73 +710,60 @@ class Tibia:
                 await ctx.send("This server is not tracking any tibia worlds.")
                 return
 
-        c = userDatabase.cursor()
-        entries = []
         author = None
         author_icon = discord.Embed.Empty
-        count = 0
         now = time.time()
         per_page = 20 if ctx.long else 5
         await ctx.channel.trigger_typing()
-        try:
-            if name is None:
-                title = "Latest level ups"
-                c.execute("SELECT char_levelups.level, date, name, user_id, world, vocation "
-                          "FROM char_levelups, chars "
-                          "WHERE char_id = id AND char_levelups.level >= ? "
-                          "ORDER BY date DESC", (config.announce_threshold, ))
-                while True:
-                    row = c.fetchone()
-                    if row is None:
-                        break
+        if name is None:
+            title = "Latest level ups"
+            worlds, params = named_placeholders("world", user_worlds)
+
+            def get_entries():
+                for row in iter_by_date("SELECT char_levelups.rowid, char_levelups.level, date, name, user_id, world, "
+                                        "vocation FROM char_levelups, chars "
+                                        f"WHERE char_id = id AND char_levelups.level >= :level AND world IN ({worlds}) "
+                                        "AND (date < :before OR date = :before "
+                                        "AND char_levelups.rowid < :before_rowid) "
+                                        "ORDER BY date DESC, char_levelups.rowid DESC LIMIT :limit",
+                                        dict(params, level=config.announce_threshold)):
                     user = self.bot.get_member(row["user_id"], user_guilds)
                     if user is None:
                         continue
-                    if row["world"] not in user_worlds:
-                        continue
-                    count += 1
                     row["time"] = get_time_diff(dt.timedelta(seconds=now - row["date"]))
                     row["user"] = user.display_name
                     row["emoji"] = get_voc_emoji(row["vocation"])
-                    entries.append("{emoji} {name} - Level **{level}** - (**@{user}**) - *{time} ago*".format(**row))
-                    if count >= 100:
-                        break
-            else:
+                    yield "{emoji} {name} - Level **{level}** - (**@{user}**) - *{time} ago*".format(**row)
+        else:
+            with closing(userDatabase.cursor()) as c:
                 c.execute("SELECT id, name, user_id, vocation FROM chars WHERE name LIKE ?", (name,))
                 result = c.fetchone()
-                if result is None:
-                    await ctx.send("I don't have a character with that name registered.")
-                    return
-                # If user doesn't share a server with the owner, don't display it
-                owner = self.bot.get_member(result["user_id"], user_guilds)
-                if owner is None:
-                    await ctx.send("I don't have a character with that name registered.")
-                    return
-                author = owner.display_name
-                author_icon = owner.avatar_url
-                name = result["name"]
-                emoji = get_voc_emoji(result["vocation"])
-                title = f"{emoji} {name} latest level ups"
-                c.execute("SELECT char_levelups.level, date FROM char_levelups, chars "
-                          "WHERE id = char_id AND name LIKE ? "
-                          "ORDER BY date DESC", (name,))
-                while True:
-                    row = c.fetchone()
-                    if row is None:
-                        break
-                    count += 1
+            if result is None:
+                await ctx.send("I don't have a character with that name registered.")
+                return
+            # If user doesn't share a server with the owner, don't display it
+            owner = self.bot.get_member(result["user_id"], user_guilds)
+            if owner is None:
+                await ctx.send("I don't have a character with that name registered.")
+                return
+            author = owner.display_name
+            author_icon = owner.avatar_url
+            name = result["name"]
+            emoji = get_voc_emoji(result["vocation"])
+            title = f"{emoji} {name} latest level ups"
+
+            def get_entries():
+                for row in iter_by_date("SELECT rowid, level, date FROM char_levelups "
+                                        "WHERE char_id = :id "
+                                        "AND (date < :before OR date = :before AND rowid < :before_rowid) "
+                                        "ORDER BY date DESC, rowid DESC LIMIT :limit", {"id": result["id"]}):
                     row["time"] = get_time_diff(dt.timedelta(seconds=now-row["date"]))
-                    entries.append("Level **{level}** - *{time} ago*".format(**row))
-                    if count >= 100:
-                        break
-        finally:
-            c.close()
+                    yield "Level **{level}** - *{time} ago*".format(**row)
 
-        if count == 0:
+        pages = LazyPages(ctx, source=itertools.islice(get_entries(), 100), per_page=per_page)
+        if not pages.entries:
             await ctx.send("There are no registered levels.")
             return
-
-        pages = Pages(ctx, entries=entries, per_page=per_page)
         pages.embed.title = title
         pages.embed.set_author(name=author, icon_url=author_icon)
         try:
@@ -838,37 +795,27 @@ class Tibia:
             await ctx.send("I don't see any users with that name.")
             return
 
-        c = userDatabase.cursor()
-        count = 0
-        entries = []
         now = time.time()
         per_page = 20 if ctx.long else 5
 
-        try:
-            c.execute("SELECT name, world, char_levelups.level, date, vocation "
-                      "FROM chars, char_levelups "
-                      "WHERE char_id = id AND user_id = ? "
-                      "ORDER BY date DESC", (user.id,))
-            while True:
-                row = c.fetchone()
-                if row is None:
-                    break
-                if row["world"] not in user_worlds:
-                    continue
-                count += 1
+        worlds, params = named_placeholders("world", user_worlds)
+
+        def get_entries():
+            for row in iter_by_date("SELECT char_levelups.rowid, name, world, char_levelups.level, date, vocation "
+                                    "FROM chars, char_levelups "
+                                    f"WHERE char_id = id AND user_id = :user_id AND world IN ({worlds}) "
+                                    "AND (date < :before OR date = :before AND char_levelups.rowid < :before_rowid) "
+                                    "ORDER BY date DESC, char_levelups.rowid DESC LIMIT :limit",
+                                    dict(params, user_id=user.id)):
                 row["time"] = get_time_diff(dt.timedelta(seconds=now - row["date"]))
                 row["emoji"] = get_voc_emoji(row["vocation"])
-                entries.append("{emoji} {name} - Level **{level}** - *{time} ago*".format(**row))
-                if count >= 100:
-                    break
-            if count == 0:
-                await ctx.send("There are not registered level ups by this user.")
-                return
-        finally:
-            c.close()
+                yield "{emoji} {name} - Level **{level}** - *{time} ago*".format(**row)
 
+        pages = LazyPages(ctx, source=itertools.islice(get_entries(), 100), per_page=per_page)
+        if not pages.entries:
+            await ctx.send("There are not registered level ups by this user.")
+            return
         title = f"{user.display_name} latest level ups"
-        pages = Pages(ctx, entries=entries, per_page=per_page)
         pages.embed.set_author(name=title, icon_url=get_user_avatar(user))
         try:
             await pages.paginate()
@@ -1287,94 +1234,87 @@ class Tibia:
                 await ctx.send("This server is not tracking any tibia worlds.")
                 return
 
-        c = userDatabase.cursor()
-        entries = []
         author = None
         author_icon = discord.Embed.Empty
-        count = 0
         now = time.time()
         per_page = 20 if ctx.long else 5
         await ctx.channel.trigger_typing()
-        try:
-            if name is None:
-                title = "Timeline"
-                c.execute("SELECT name, user_id, world, char_deaths.level as level, killer, 'death' AS `type`, date, "
-                          "vocation "
-                          "FROM char_deaths, chars WHERE char_id = id AND char_deaths.level >= ? "
-                          "UNION "
-                          "SELECT name, user_id, world, char_levelups.level as level, null, 'levelup' AS `type`, date, "
-                          "vocation "
-                          "FROM char_levelups, chars WHERE char_id = id AND char_levelups.level >= ? "
-                          "ORDER BY date DESC", (config.announce_threshold, config.announce_threshold))
-                while True:
-                    row = c.fetchone()
-                    if row is None:
-                        break
+        if name is None:
+            title = "Timeline"
+            worlds, params = named_placeholders("world", user_worlds)
+
+            def get_entries():
+                # Rowids are made unique across both tables, even for deaths and odd for level ups
+                for row in iter_by_date("SELECT char_deaths.rowid * 2 AS rowid, name, user_id, world, "
+                                        "char_deaths.level as level, killer, 'death' AS `type`, date, vocation "
+                                        "FROM char_deaths, chars "
+                                        f"WHERE char_id = id AND char_deaths.level >= :level AND world IN ({worlds}) "
+                                        "AND (date < :before OR date = :before "
+                                        "AND char_deaths.rowid * 2 < :before_rowid) "
+                                        "UNION ALL "
+                                        "SELECT char_levelups.rowid * 2 + 1 AS rowid, name, user_id, world, "
+                                        "char_levelups.level as level, null, 'levelup' AS `type`, date, vocation "
+                                        "FROM char_levelups, chars "
+                                        f"WHERE char_id = id AND char_levelups.level >= :level AND world IN ({worlds}) "
+                                        "AND (date < :before OR date = :before "
+                                        "AND char_levelups.rowid * 2 + 1 < :before_rowid) "
+                                        "ORDER BY date DESC, rowid DESC LIMIT :limit",
+                                        dict(params, level=config.announce_threshold)):
                     user = self.bot.get_member(row["user_id"], user_servers)
                     if user is None:
                         continue
-                    if row["world"] not in user_worlds:
-                        continue
-                    count += 1
                     row["time"] = get_time_diff(dt.timedelta(seconds=now - row["date"]))
                     row["user"] = user.display_name
                     row["voc_emoji"] = get_voc_emoji(row["vocation"])
                     if row["type"] == "death":
                         row["emoji"] = config.death_emoji
-                        entries.append("{emoji}{voc_emoji} {name} (**@{user}**) - At level **{level}** by {killer} - "
-                                       "*{time} ago*".format(**row))
+                        yield "{emoji}{voc_emoji} {name} (**@{user}**) - At level **{level}** by {killer} - " \
+                              "*{time} ago*".format(**row)
                     else:
                         row["emoji"] = config.levelup_emoji
-                        entries.append("{emoji}{voc_emoji} {name} (**@{user}**) - Level **{level}** - *{time} ago*"
-                                       .format(**row))
-                    if count >= 200:
-                        break
-            else:
+                        yield "{emoji}{voc_emoji} {name} (**@{user}**) - Level **{level}** - *{time} ago*"\
+                            .format(**row)
+        else:
+            with closing(userDatabase.cursor()) as c:
                 c.execute("SELECT id, name, user_id, vocation FROM chars WHERE name LIKE ?", (name,))
                 result = c.fetchone()
-                if result is None:
-                    await ctx.send("I don't have a character with that name registered.")
-                    return
-                # If user doesn't share a server with the owner, don't display it
-                owner = self.bot.get_member(result["user_id"], user_servers)
-                if owner is None:
-                    await ctx.send("I don't have a character with that name registered.")
-                    return
-                author = owner.display_name
-                author_icon = owner.avatar_url
-                name = result["name"]
-                emoji = get_voc_emoji(result["vocation"])
-                title = f"{emoji} {name} timeline"
-                c.execute("SELECT level, killer, 'death' AS `type`, date "
-                          "FROM char_deaths WHERE char_id = ? AND level >= ? "
-                          "UNION "
-                          "SELECT level, null, 'levelup' AS `type`, date "
-                          "FROM char_levelups WHERE char_id = ? AND level >= ? "
-                          "ORDER BY date DESC", (result["id"], config.announce_threshold, result["id"], config.announce_threshold))
-                while True:
-                    row = c.fetchone()
-                    if row is None:
-                        break
-                    count += 1
+            if result is None:
+                await ctx.send("I don't have a character with that name registered.")
+                return
+            # If user doesn't share a server with the owner, don't display it
+            owner = self.bot.get_member(result["user_id"], user_servers)
+            if owner is None:
+                await ctx.send("I don't have a character with that name registered.")
+                return
+            author = owner.display_name
+            author_icon = owner.avatar_url
+            name = result["name"]
+            emoji = get_voc_emoji(result["vocation"])
+            title = f"{emoji} {name} timeline"
+
+            def get_entries():
+                # Rowids are made unique across both tables, even for deaths and odd for level ups
+                for row in iter_by_date("SELECT rowid * 2 AS rowid, level, killer, 'death' AS `type`, date "
+                                        "FROM char_deaths WHERE char_id = :id AND level >= :level "
+                                        "AND (date < :before OR date = :before AND rowid * 2 < :before_rowid) "
+                                        "UNION ALL "
+                                        "SELECT rowid * 2 + 1 AS rowid, level, null, 'levelup' AS `type`, date "
+                                        "FROM char_levelups WHERE char_id = :id AND level >= :level "
+                                        "AND (date < :before OR date = :before AND rowid * 2 + 1 < :before_rowid) "
+                                        "ORDER BY date DESC, rowid DESC LIMIT :limit",
+                                        {"id": result["id"], "level": config.announce_threshold}):
                     row["time"] = get_time_diff(dt.timedelta(seconds=now - row["date"]))
                     if row["type"] == "death":
                         row["emoji"] = config.death_emoji
-                        entries.append("{emoji} At level **{level}** by {killer} - *{time} ago*"
-                                       .format(**row)
-                                       )
+                        yield "{emoji} At level **{level}** by {killer} - *{time} ago*".format(**row)
                     else:
                         row["emoji"] = config.levelup_emoji
-                        entries.append("{emoji} Level **{level}** - *{time} ago*".format(**row))
-                    if count >= 200:
-                        break
-        finally:
-            c.close()
+                        yield "{emoji} Level **{level}** - *{time} ago*".format(**row)
 
-        if count == 0:
+        pages = LazyPages(ctx, source=itertools.islice(get_entries(), 200), per_page=per_page)
+        if not pages.entries:
             await ctx.send("There are no registered events.")
             return
-
-        pages = Pages(ctx, entries=entries, per_page=per_page)
         pages.embed.title = title
         pages.embed.set_author(name=author, icon_url=author_icon)
         try:
@@ -1410,48 +1350,46 @@ class Tibia:
             await ctx.send("I don't see any users with that name.")
             return
 
-        c = userDatabase.cursor()
-        entries = []
-        count = 0
         now = time.time()
         per_page = 20 if ctx.long else 5
 
         await ctx.channel.trigger_typing()
-        try:
-            title = f"{user.display_name} timeline"
-            c.execute("SELECT name, user_id, world, char_deaths.level AS level, killer, 'death' AS `type`, date, vocation "
-                      "FROM char_deaths, chars WHERE char_id = id AND char_deaths.level >= ? AND user_id = ? "
-                      "UNION "
-                      "SELECT name, user_id, world, char_levelups.level as level, null, 'levelup' AS `type`, date, vocation "
-                      "FROM char_levelups, chars WHERE char_id = id AND char_levelups.level >= ? AND user_id = ? "
-                      "ORDER BY date DESC", (config.announce_threshold, user.id, config.announce_threshold, user.id))
-            while True:
-                row = c.fetchone()
-                if row is None:
-                    break
-                if row["world"] not in user_worlds:
-                    continue
-                count += 1
+        title = f"{user.display_name} timeline"
+
+        worlds, params = named_placeholders("world", user_worlds)
+
+        def get_entries():
+            # Rowids are made unique across both tables, even for deaths and odd for level ups
+            for row in iter_by_date("SELECT char_deaths.rowid * 2 AS rowid, name, user_id, world, "
+                                    "char_deaths.level AS level, killer, 'death' AS `type`, date, vocation "
+                                    "FROM char_deaths, chars "
+                                    "WHERE char_id = id AND char_deaths.level >= :level AND user_id = :user_id "
+                                    f"AND world IN ({worlds}) "
+                                    "AND (date < :before OR date = :before AND char_deaths.rowid * 2 < :before_rowid) "
+                                    "UNION ALL "
+                                    "SELECT char_levelups.rowid * 2 + 1 AS rowid, name, user_id, world, "
+                                    "char_levelups.level as level, null, 'levelup' AS `type`, date, vocation "
+                                    "FROM char_levelups, chars "
+                                    "WHERE char_id = id AND char_levelups.level >= :level AND user_id = :user_id "
+                                    f"AND world IN ({worlds}) "
+                                    "AND (date < :before OR date = :before "
+                                    "AND char_levelups.rowid * 2 + 1 < :before_rowid) "
+                                    "ORDER BY date DESC, rowid DESC LIMIT :limit",
+                                    dict(params, level=config.announce_threshold, user_id=user.id)):
                 row["time"] = get_time_diff(dt.timedelta(seconds=now - row["date"]))
                 row["voc_emoji"] = get_voc_emoji(row["vocation"])
                 if row["type"] == "death":
                     row["emoji"] = config.death_emoji
-                    entries.append("{emoji}{voc_emoji} {name} - At level **{level}** by {killer} - *{time} ago*"
-                                   .format(**row)
-                                   )
+                    yield "{emoji}{voc_emoji} {name} - At level **{level}** by {killer} - *{time} ago*".format(**row)
                 else:
                     row["emoji"] = config.levelup_emoji
-                    entries.append("{emoji}{voc_emoji} {name} - Level **{level}** - *{time} ago*".format(**row))
-                if count >= 200:
-                    break
-        finally:
-            c.close()
+                    yield "{emoji}{voc_emoji} {name} - Level **{level}** - *{time} ago*".format(**row)
 
-        if count == 0:
+        pages = LazyPages(ctx, source=itertools.islice(get_entries(), 200), per_page=per_page)
+        if not pages.entries:
             await ctx.send("There are no registered events.")
             return
         author_icon = user.avatar_url
-        pages = Pages(ctx, entries=entries, per_page=per_page)
         pages.embed.set_author(name=title, icon_url=author_icon)
         try:
             await pages.paginate()
@@ -1913,52 +1851,9 @@ class Tibia:
         await self.bot.wait_until_ready()
         while not self.bot.is_closed():
             try:
-                recent_news = await get_recent_news()
-                if recent_news is None:
-                    await asyncio.sleep(30)
-                    continue
-                last_article = recent_news[0]["id"]
-                try:
-                    with open("data/last_article.txt", 'r') as f:
-                        last_id = int(f.read())
-                except (ValueError, FileNotFoundError):
-                    log.info("scan_news: No last article id saved")
-                    last_id = 0
-                if last_id == 0:
-                    with open("data/last_article.txt", 'w+') as f:
-                        f.write(str(last_article))
-                    await asyncio.sleep(60 * 60 * 2)
-                    continue
-                new_articles = []
-                for article in recent_news:
-                    if int(article["id"]) == last_id:
-                        break
-                    # Do not post articles older than a week (in case bot was offline)
-                    if (dt.date.today() - article["date"]).days > 7:
-                        break
-                    fetched_article = await get_news_article(int(article["id"]))
-                    if fetched_article is not None:
-                        new_articles.insert(0, fetched_article)
-                with open("data/last_article.txt", 'w+') as f:
-                    f.write(str(last_article))
-                if len(new_articles) == 0:
-                    await asyncio.sleep(60 * 60 * 2)
-                    continue
-                for article in new_articles:
-                    log.info("Announcing new article: {id} - {title}".format(**article))
-                    for guild in self.bot.guilds:
-                        news_channel_id = get_server_property(guild.id, "news_channel", is_int=True, default=0)
-                        if news_channel_id == 0:
-                            continue
-                        channel = self.bot.get_channel_or_top(guild, news_channel_id)
-                        try:
-                            await channel.send("New article posted on Tibia.com",
-                                               embed=self.get_article_embed(article, 1000))
-                        except discord.Forbidden:
-                            log.warning("scan_news: Missing permissions.")
-                        except discord.HTTPException:
-                            log.warning("scan_news: Malformed message.")
-                await asyncio.sleep(60 * 60 * 2)
+                with self.bot.monitor.iteration("scan_news"):
+                    delay = await self.check_news()
+                await asyncio.sleep(delay)
             except NetworkError:
                 await asyncio.sleep(30)
                 continue
@@ -1968,6 +1863,52 @@ class Tibia:
             except Exception:
                 log.exception("Task: scan_news")
 
+    async def check_news(self) -> int:
+        """Checks for new articles and announces them.
+
+        :return: The seconds to wait before checking again."""
+        recent_news = await get_recent_news()
+        if recent_news is None:
+            return 30
+        last_article = recent_news[0]["id"]
+        try:
+            with open("data/last_article.txt", 'r') as f:
+                last_id = int(f.read())
+        except (ValueError, FileNotFoundError):
+            log.info("scan_news: No last article id saved")
+            last_id = 0
+        if last_id == 0:
+            with open("data/last_article.txt", 'w+') as f:
+                f.write(str(last_article))
+            return 60 * 60 * 2
+        new_articles = []
+        for article in recent_news:
+            if int(article["id"]) == last_id:
+                break
+            # Do not post articles older than a week (in case bot was offline)
+            if (dt.date.today() - article["date"]).days > 7:
+                break
+            fetched_article = await get_news_article(int(article["id"]))
+            if fetched_article is not None:
+                new_articles.insert(0, fetched_article)
+        with open("data/last_article.txt", 'w+') as f:
+            f.write(str(last_article))
+        for article in new_articles:
+            log.info("Announcing new article: {id} - {title}".format(**article))
+            for guild in self.bot.guilds:
+                news_channel_id = get_server_property(guild.id, "news_channel", is_int=True, default=0)
+                if news_channel_id == 0:
+                    continue
+                channel = self.bot.get_channel_or_top(guild, news_channel_id)
+                try:
+                    await channel.send("New article posted on Tibia.com",
+                                       embed=self.get_article_embed(article, 1000))
+                except discord.Forbidden:
+                    log.warning("scan_news: Missing permissions.")
+                except discord.HTTPException:
+                    log.warning("scan_news: Malformed message.")
+        return 60 * 60 * 2
+
     def __unload(self):
         print("cogs.tibia: Cancelling pending tasks...")
         self.news_announcements_task.cancel()
@@ -12,7 +12,7 @@ from utils.config import config
 from utils.context import NabCtx
 from utils.database import tibiaDatabase
 from utils.general import join_list, FIELD_VALUE_LIMIT, average_color
-from utils.messages import split_message
+from utils.messages import split_message, add_split_fields
 from utils.pages import Pages, CannotPaginate
 from utils.tibia import get_map_area
 from utils.tibiawiki import get_item, get_monster, get_spell, get_achievement, get_npc, WIKI_ICON, get_article_url, \
@@ -903,13 +903,7 @@ class TibiaWiki:
                 if long and count > long_limit:
                     value += "\n*...And {0} others*".format(len(npc['selling']) - long_limit)
                     break
-            split_selling = split_message(value, FIELD_VALUE_LIMIT)
-            for value in split_selling:
-                if value == split_selling[0]:
-                    name = "Selling"
-                else:
-                    name = "\u200F"
-                embed.add_field(name=name, value=value)
+            add_split_fields(embed, "Selling", value)
         if npc["buying"]:
             count = 0
             value = ""
@@ -924,13 +918,7 @@ class TibiaWiki:
                 if long and count > long_limit:
                     value += "\n*...And {0} others*".format(len(npc['buying']) - long_limit)
                     break
-            split_buying = split_message(value, FIELD_VALUE_LIMIT)
-            for value in split_buying:
-                if value == split_buying[0]:
-                    name = "Buying"
-                else:
-                    name = "\u200F"
-                embed.add_field(name=name, value=value)
+            add_split_fields(embed, "Buying", value)
         if npc["destinations"]:
             count = 0
             value = ""
@@ -957,10 +945,7 @@ class TibiaWiki:
                         too_long = True
                         skip[voc] = True
             for voc, content in values.items():
-                fields = split_message(content, FIELD_VALUE_LIMIT)
-                for i, split_field in enumerate(fields):
-                    name = f"Teaches ({voc.title()}s)" if i == 0 else "\u200F"
-                    embed.add_field(name=name, value=split_field, inline=not len(fields) > 1)
+                add_split_fields(embed, f"Teaches ({voc.title()}s)", content, inline=len(content) <= FIELD_VALUE_LIMIT)
         if too_long:
             ask_channel = ctx.ask_channel_name
             if ask_channel:
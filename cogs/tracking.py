@@ -1,29 +1,32 @@
 import asyncio
 import datetime as dt
-import pickle
 import re
 import time
 import urllib.parse
 from contextlib import closing
-from typing import List
+from typing import List, Dict
 
 import discord
 from discord.ext import commands
 
 from nabbot import NabBot
-from utils import checks
+from utils import checks, metrics
 from utils.config import config
 from utils.context import NabCtx
-from utils.database import userDatabase, get_server_property, set_server_property
-from utils.general import global_online_list, log, join_list, is_numeric, FIELD_VALUE_LIMIT, EMBED_LIMIT, \
-    get_user_avatar
+from utils.database import userDatabase, get_server_property, set_server_property, add_death_stats, \
+    add_levelup_stats
+from utils.general import global_online_list, log, join_list, is_numeric, EMBED_LIMIT, \
+    get_user_avatar, CONTENT_LIMIT
 from utils.messages import weighed_choice, death_messages_player, death_messages_monster, format_message, \
-    level_messages, split_message
+    level_messages, add_split_fields
 from utils.pages import Pages, CannotPaginate, VocationPages
 from utils.tibia import get_highscores, ERROR_NETWORK, tibia_worlds, get_world, get_character, get_voc_emoji, get_guild, \
     get_voc_abb, get_character_url, url_guild, \
     get_tibia_time_zone, NetworkError, Death, Character, HIGHSCORE_CATEGORIES, get_voc_abb_and_emoji, get_share_range, \
-    World
+    World, load_online_list_files, save_online_list_file, touch_online_list_file
+
+# Number of pending announcements in a single channel before a warning is logged
+ANNOUNCE_BACKLOG_WARNING = 20
 
 
 class Tracking:
@@ -35,6 +38,16 @@ class Tracking:
         self.scan_online_chars_task = bot.loop.create_task(self.scan_online_chars())
         self.scan_highscores_task = bot.loop.create_task(self.scan_highscores())
         self.world_times = {}
+        # Last snapshot write of each world's online list, key:value = world:future
+        self.online_list_saves: Dict[str, asyncio.Future] = {}
+        # Cached watched list entries per server
+        self.watched_entries: Dict[int, List[Dict]] = {}
+        # Hash of the last watched list posted, key:value = message_id:hash
+        # Entries are discarded when their message is deleted, so it's posted again on the next scan
+        self.watched_hashes: Dict[int, int] = {}
+        # Pending announcements per channel, key:value = channel_id:messages
+        self.announce_queues: Dict[int, List[str]] = {}
+        metrics.announcement_queue.function = lambda: sum(len(q) for q in self.announce_queues.values())
 
     async def scan_deaths(self):
         #################################################
@@ -48,12 +61,13 @@ class Tracking:
                 if len(global_online_list) == 0:
                     await asyncio.sleep(0.5)
                     continue
-                # Pop last char in queue, reinsert it at the beginning
-                current_char = global_online_list.pop()
-                global_online_list.insert(0, current_char)
+                with self.bot.monitor.iteration("scan_deaths"):
+                    # Pop last char in queue, reinsert it at the beginning
+                    current_char = global_online_list.pop()
+                    global_online_list.insert(0, current_char)
 
-                # Check for new death
-                await self.check_death(current_char.name)
+                    # Check for new death
+                    await self.check_death(current_char.name)
             except asyncio.CancelledError:
                 # Task was cancelled, so this is fine
                 break
@@ -77,47 +91,50 @@ class Tracking:
                     log.debug()
                     await asyncio.sleep(0.1)
                 try:
-                    for category in HIGHSCORE_CATEGORIES:
-                        # Check the last scan time, highscores are updated every server save
-                        with closing(userDatabase.cursor()) as c:
-                            c.execute("SELECT last_scan FROM highscores_times WHERE world = ? and category = ?",
-                                      (world, category,))
-                            result = c.fetchone()
-                        if result:
-                            last_scan = result["last_scan"]
-                            last_scan_date = dt.datetime.utcfromtimestamp(last_scan).replace(tzinfo=dt.timezone.utc)
-                            now = dt.datetime.now(dt.timezone.utc)
-                            # Current day's server save, could be in the past or the future, an extra hour is added
-                            # as margin
-                            today_ss = dt.datetime.now(dt.timezone.utc).replace(hour=11 - get_tibia_time_zone())
-                            if not now > today_ss > last_scan_date:
-                                continue
-                        highscore_data = []
-                        for pagenum in range(1, 13):
-                            # Special cases (ek/rp mls)
-                            if category == "magic_ek":
-                                scores = await get_highscores(world, "magic", pagenum, 1)
-                            elif category == "magic_rp":
-                                scores = await get_highscores(world, "magic", pagenum, 2)
-                            else:
-                                scores = await get_highscores(world, category, pagenum)
-                            if scores == ERROR_NETWORK:
-                                continue
-                            for entry in scores:
-                                highscore_data.append(
-                                    (entry["rank"], category, world, entry["name"], entry["vocation"], entry["value"]))
-                            await asyncio.sleep(config.highscores_page_delay)
-                        with userDatabase as conn:
-                            # Delete old records
-                            conn.execute("DELETE FROM highscores WHERE category = ? AND world = ?", (category, world,))
-                            # Add current entries
-                            conn.executemany("INSERT INTO highscores(rank, category, world, name, vocation, value) "
-                                             "VALUES (?, ?, ?, ?, ?, ?)", highscore_data)
-                            # These two executes are equal to an UPDATE OR INSERT
-                            conn.execute("UPDATE highscores_times SET last_scan = ? WHERE world = ? AND category = ?",
-                                         (time.time(), world, category))
-                            conn.execute("INSERT INTO highscores_times(world, last_scan, category) SELECT ?,?,? WHERE "
-                                         "(SELECT Changes() = 0)", (world, time.time(), category))
+                    with self.bot.monitor.iteration("scan_highscores"):
+                        for category in HIGHSCORE_CATEGORIES:
+                            # Check the last scan time, highscores are updated every server save
+                            with closing(userDatabase.cursor()) as c:
+                                c.execute("SELECT last_scan FROM highscores_times WHERE world = ? and category = ?",
+                                          (world, category,))
+                                result = c.fetchone()
+                            if result:
+                                last_scan = result["last_scan"]
+                                last_scan_date = dt.datetime.utcfromtimestamp(last_scan).replace(tzinfo=dt.timezone.utc)
+                                now = dt.datetime.now(dt.timezone.utc)
+                                # Current day's server save, could be in the past or the future, an extra hour is added
+                                # as margin
+                                today_ss = dt.datetime.now(dt.timezone.utc).replace(hour=11 - get_tibia_time_zone())
+                                if not now > today_ss > last_scan_date:
+                                    continue
+                            highscore_data = []
+                            for pagenum in range(1, 13):
+                                # Special cases (ek/rp mls)
+                                if category == "magic_ek":
+                                    scores = await get_highscores(world, "magic", pagenum, 1)
+                                elif category == "magic_rp":
+                                    scores = await get_highscores(world, "magic", pagenum, 2)
+                                else:
+                                    scores = await get_highscores(world, category, pagenum)
+                                if scores == ERROR_NETWORK:
+                                    continue
+                                for entry in scores:
+                                    highscore_data.append((entry["rank"], category, world, entry["name"],
+                                                           entry["vocation"], entry["value"]))
+                                await asyncio.sleep(config.highscores_page_delay)
+                            with userDatabase as conn:
+                                # Delete old records
+                                conn.execute("DELETE FROM highscores WHERE category = ? AND world = ?",
+                                             (category, world,))
+                                # Add current entries
+                                conn.executemany("INSERT INTO highscores(rank, category, world, name, vocation, value) "
+                                                 "VALUES (?, ?, ?, ?, ?, ?)", highscore_data)
+                                # These two executes are equal to an UPDATE OR INSERT
+                                conn.execute("UPDATE highscores_times SET last_scan = ? "
+                                             "WHERE world = ? AND category = ?", (time.time(), world, category))
+                                conn.execute("INSERT INTO highscores_times(world, last_scan, category) "
+                                             "SELECT ?,?,? WHERE (SELECT Changes() = 0)",
+                                             (world, time.time(), category))
                 except asyncio.CancelledError:
                     # Task was cancelled, so this is fine
                     break
@@ -132,20 +149,11 @@ class Tracking:
         # Do not touch anything, enter at your own risk #
         #################################################
         await self.bot.wait_until_ready()
-        try:
-            with open("data/online_list.dat", "rb") as f:
-                saved_list, timestamp = pickle.load(f)
-                if (time.time() - timestamp) < config.online_list_expiration:
-                    global_online_list.clear()
-                    global_online_list.extend(saved_list)
-                    log.info("Loaded cached online list")
-                else:
-                    log.info("Cached online list is too old, discarding")
-        except FileNotFoundError:
-            pass
-        except (ValueError, pickle.PickleError):
-            log.info("Couldn't read cached online list.")
-            pass
+        saved_list = await self.bot.loop.run_in_executor(None, load_online_list_files, config.online_list_expiration)
+        if saved_list:
+            global_online_list.clear()
+            global_online_list.extend(saved_list)
+            log.info("Loaded cached online list")
         while not self.bot.is_closed():
             # Open connection to users.db
             c = userDatabase.cursor()
@@ -162,88 +170,107 @@ class Tracking:
                     await asyncio.sleep(0.2)
                     continue
 
-                # Get online list for this server
-                try:
-                    world = await get_world(current_world)
-                    if world is None:
-                        await asyncio.sleep(0.1)
-                        continue
-                except NetworkError:
-                    await asyncio.sleep(0.1)
-                    continue
-                current_world_online = world.players_online
-                if len(current_world_online) == 0:
-                    await asyncio.sleep(0.1)
-                    continue
-                self.world_times[world.name] = time.time()
-                self.bot.dispatch("world_scanned", world)
-                # Save the online list in file
-                with open("data/online_list.dat", "wb") as f:
-                    pickle.dump((global_online_list, time.time()), f, protocol=pickle.HIGHEST_PROTOCOL)
-                # Remove chars that are no longer online from the global_online_list
-                offline_list = []
-                for char in global_online_list:
-                    if char.world not in tibia_worlds:
-                        # Remove chars from worlds that no longer exist
-                        offline_list.append(char)
-                    elif char.world == current_world:
-                        offline = True
-                        for server_char in current_world_online:
-                            if server_char.name == char.name:
-                                offline = False
-                                break
-                        if offline:
-                            offline_list.append(char)
-                for offline_char in offline_list:
-                    global_online_list.remove(offline_char)
-                    # Check for deaths and level ups when removing from online list
+                with self.bot.monitor.iteration("scan_online_chars"):
+                    scan_start = time.perf_counter()
+                    # Get online list for this server
                     try:
-                        name = offline_char.name
-                        offline_char = await get_character(name, bot=self.bot)
+                        world = await get_world(current_world)
+                        if world is None:
+                            await asyncio.sleep(0.1)
+                            continue
                     except NetworkError:
-                        log.error(f"scan_online_chars: Could not fetch {name}, NetWorkError")
+                        await asyncio.sleep(0.1)
+                        continue
+                    current_world_online = world.players_online
+                    if len(current_world_online) == 0:
+                        await asyncio.sleep(0.1)
                         continue
-                    if offline_char is not None:
-                        c.execute("SELECT name, level, id FROM chars WHERE name LIKE ?", (offline_char.name,))
+                    self.world_times[world.name] = time.time()
+                    self.bot.dispatch("world_scanned", world)
+                    metrics.worlds_scanned.inc(world=world.name)
+                    previous_online = {char.name for char in global_online_list if char.world == world.name}
+                    # Remove chars that are no longer online from the global_online_list
+                    offline_list = []
+                    for char in global_online_list:
+                        if char.world not in tibia_worlds:
+                            # Remove chars from worlds that no longer exist
+                            offline_list.append(char)
+                        elif char.world == current_world:
+                            offline = True
+                            for server_char in current_world_online:
+                                if server_char.name == char.name:
+                                    offline = False
+                                    break
+                            if offline:
+                                offline_list.append(char)
+                    for offline_char in offline_list:
+                        global_online_list.remove(offline_char)
+                        # Check for deaths and level ups when removing from online list
+                        try:
+                            name = offline_char.name
+                            offline_char = await get_character(name, bot=self.bot)
+                        except NetworkError:
+                            log.error(f"scan_online_chars: Could not fetch {name}, NetWorkError")
+                            continue
+                        if offline_char is not None:
+                            c.execute("SELECT name, level, id FROM chars WHERE name LIKE ?", (offline_char.name,))
+                            result = c.fetchone()
+                            if result:
+                                c.execute("UPDATE chars SET level = ? WHERE name LIKE ?",
+                                          (offline_char.level, offline_char.name))
+                                if offline_char.level > result["level"] > 0:
+                                    # Saving level up date in database
+                                    date = time.time()
+                                    c.execute(
+                                        "INSERT INTO char_levelups (char_id,level,date) VALUES(?,?,?)",
+                                        (result["id"], offline_char.level, date,)
+                                    )
+                                    add_levelup_stats(c, offline_char.world, result["id"], date)
+                                    # Announce the level up
+                                    await self.announce_level(offline_char.level, char=offline_char)
+                            await self.check_death(offline_char.name)
+                    # Add new online chars and announce level differences
+                    for server_char in current_world_online:
+                        c.execute("SELECT name, level, id, user_id FROM chars WHERE name LIKE ?",
+                                  (server_char.name,))
                         result = c.fetchone()
+                        # If its a stalked character
                         if result:
-                            c.execute("UPDATE chars SET level = ? WHERE name LIKE ?",
-                                      (offline_char.level, offline_char.name))
-                            if offline_char.level > result["level"] > 0:
+                            # We update their last level in the db
+                            c.execute(
+                                "UPDATE chars SET level = ? WHERE name LIKE ?",
+                                (server_char.level, server_char.name)
+                            )
+                            if server_char not in global_online_list:
+                                # If the character wasn't in the globalOnlineList we add them
+                                # (We insert them at the beginning of the list to avoid messing with the death checks
+                                # order)
+                                global_online_list.insert(0, server_char)
+                                await self.check_death(server_char.name)
+                            # Else we check for levelup
+                            elif server_char.level > result["level"] > 0:
                                 # Saving level up date in database
+                                date = time.time()
                                 c.execute(
                                     "INSERT INTO char_levelups (char_id,level,date) VALUES(?,?,?)",
-                                    (result["id"], offline_char.level, time.time(),)
+                                    (result["id"], server_char.level, date,)
                                 )
+                                add_levelup_stats(c, server_char.world, result["id"], date)
                                 # Announce the level up
-                                await self.announce_level(offline_char.level, char=offline_char)
-                        await self.check_death(offline_char.name)
-                # Add new online chars and announce level differences
-                for server_char in current_world_online:
-                    c.execute("SELECT name, level, id, user_id FROM chars WHERE name LIKE ?",
-                              (server_char.name,))
-                    result = c.fetchone()
-                    # If its a stalked character
-                    if result:
-                        # We update their last level in the db
-                        c.execute(
-                            "UPDATE chars SET level = ? WHERE name LIKE ?",
-                            (server_char.level, server_char.name)
-                        )
-                        if server_char not in global_online_list:
-                            # If the character wasn't in the globalOnlineList we add them
-                            # (We insert them at the beginning of the list to avoid messing with the death checks order)
-                            global_online_list.insert(0, server_char)
-                            await self.check_death(server_char.name)
-                        # Else we check for levelup
-                        elif server_char.level > result["level"] > 0:
-                            # Saving level up date in database
-                            c.execute(
-                                "INSERT INTO char_levelups (char_id,level,date) VALUES(?,?,?)",
-                                (result["id"], server_char.level, time.time(),)
-                            )
-                            # Announce the level up
-                            await self.announce_level(server_char.level, char_name=server_char.name)
+                                await self.announce_level(server_char.level, char_name=server_char.name)
+                    # Save this world's online list in file, only if someone logged in or out
+                    # Otherwise, the file is only marked as up to date, so it doesn't expire
+                    # Writes of the same world are done one at a time, so an older list never replaces a newer one
+                    previous_save = self.online_list_saves.get(world.name)
+                    if previous_save is not None and not previous_save.done():
+                        await previous_save
+                    world_online = [char for char in global_online_list if char.world == world.name]
+                    if {char.name for char in world_online} != previous_online:
+                        save = self.bot.loop.run_in_executor(None, save_online_list_file, world.name, world_online)
+                    else:
+                        save = self.bot.loop.run_in_executor(None, touch_online_list_file, world.name)
+                    self.online_list_saves[world.name] = save
+                    metrics.world_scan_duration.observe(time.perf_counter() - scan_start, world=world.name)
             except asyncio.CancelledError:
                 # Task was cancelled, so this is fine
                 break
@@ -257,58 +284,61 @@ class Tracking:
     async def on_world_scanned(self, scanned_world: World):
         # Watched List checking
         # Iterate through servers with tracked world to find one that matches the current world
+        watched_servers = []
         for server, world in self.bot.tracked_worlds.items():
             if world != scanned_world.name:
-                await asyncio.sleep(0.01)
                 continue
             if self.bot.get_guild(server) is None:
-                await asyncio.sleep(0.01)
                 continue
             watched_channel_id = get_server_property(server, "watched_channel", is_int=True)
             if watched_channel_id is None:
                 # This server doesn't have watch list enabled
-                await asyncio.sleep(0.1)
                 continue
             watched_channel: discord.TextChannel = self.bot.get_channel(watched_channel_id)
             if watched_channel is None:
                 # This server's watched channel is not available to the bot anymore.
-                await asyncio.sleep(0.1)
                 continue
             # Get watched list
-            entries = userDatabase.execute("SELECT * FROM watched_list WHERE server_id = ? "
-                                           "ORDER BY is_guild, name", (server,))
+            entries = self.get_watched_entries(server)
             if not entries:
-                await asyncio.sleep(0.1)
                 continue
+            watched_servers.append((server, watched_channel, entries))
+        if not watched_servers:
+            return
+
+        # Watched guilds are only fetched once per scan, even if they are watched in more than one server
+        guild_names = {e["name"].lower(): e["name"] for _, _, entries in watched_servers for e in entries
+                       if e["is_guild"]}
+        watched_guilds = {}
+        for key, name in guild_names.items():
+            try:
+                watched_guilds[key] = await get_guild(name)
+            except NetworkError:
+                continue
+        players_online = {char.name.lower(): char for char in scanned_world.players_online}
+
+        for server, watched_channel, entries in watched_servers:
             # Online watched characters
             currently_online = []
             # Watched guilds
             guild_online = dict()
             for watched in entries:
                 if watched["is_guild"]:
-                    try:
-                        guild = await get_guild(watched["name"])
-                    except NetworkError:
+                    key = watched["name"].lower()
+                    if key not in watched_guilds:
                         continue
+                    guild = watched_guilds[key]
                     # If the guild doesn't exist, add it as empty to show it was disbanded
                     if guild is None:
                         guild_online[watched["name"]] = None
-                        continue
                     # If there's at least one member online, add guild to list
-                    if len(guild.online):
+                    elif len(guild.online):
                         guild_online[guild.name] = guild.online
+                    continue
                 # If it is a character, check if he's in the online list
-                for online_char in scanned_world.players_online:
-                    if online_char.name == watched["name"]:
-                        # Add to online list
-                        currently_online.append(online_char)
-            watched_message_id = get_server_property(server, "watched_message", is_int=True)
-            # We try to get the watched message, if the bot can't find it, we just create a new one
-            # This may be because the old message was deleted or this is the first time the list is checked
-            try:
-                watched_message = await watched_channel.get_message(watched_message_id)
-            except discord.HTTPException:
-                watched_message = None
+                online_char = players_online.get(watched["name"].lower())
+                if online_char is not None:
+                    currently_online.append(online_char)
             items = [f"\t{x.name} - Level {x.level} {get_voc_emoji(x.vocation)}" for x in currently_online]
             online_count = len(items)
             if len(items) > 0 or len(guild_online.keys()) > 0:
@@ -326,30 +356,62 @@ class Tracking:
             else:
                 description = "There are no watched characters online."
                 content = ""
+            # If nothing changed since the last update, there's no need to touch the message
+            content_hash = hash((description, content, watched_channel.id))
+            watched_message_id = get_server_property(server, "watched_message", is_int=True)
+            if watched_message_id is not None and self.watched_hashes.get(watched_message_id) == content_hash:
+                metrics.cache_requests.inc(cache="watched_message", result="hit")
+                continue
+            metrics.cache_requests.inc(cache="watched_message", result="miss")
+            self.watched_hashes.pop(watched_message_id, None)
+            # We try to get the watched message, if the bot can't find it, we just create a new one
+            # This may be because the old message was deleted or this is the first time the list is checked
+            try:
+                watched_message = await watched_channel.get_message(watched_message_id)
+            except discord.HTTPException:
+                watched_message = None
             # Send new watched message or edit last one
             embed = discord.Embed(description=description)
             embed.set_footer(text="Last updated")
             embed.timestamp = dt.datetime.utcnow()
             if content:
-                if len(content) >= EMBED_LIMIT - 50:
-                    content = split_message(content, EMBED_LIMIT - 50)[0]
-                    content += "\n*And more...*"
-                fields = split_message(content, FIELD_VALUE_LIMIT)
-                for s, split_field in enumerate(fields):
-                    name = "Watched List" if s == 0 else "\u200F"
-                    embed.add_field(name=name, value=split_field, inline=False)
+                add_split_fields(embed, "Watched List", content, inline=False,
+                                 total_limit=EMBED_LIMIT - 50 - len(description))
             try:
                 if watched_message is None:
-                    new_watched_message = await watched_channel.send(embed=embed)
-                    set_server_property(server, "watched_message", new_watched_message.id)
+                    watched_message = await watched_channel.send(embed=embed)
+                    set_server_property(server, "watched_message", watched_message.id)
                 else:
                     await watched_message.edit(embed=embed)
                 await watched_channel.edit(name=f"{watched_channel.name.split('·', 1)[0]}·{online_count}")
+                self.watched_hashes[watched_message.id] = content_hash
             except discord.HTTPException:
                 pass
 
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        # A deleted watched list message is posted again on the next scan
+        self.watched_hashes.pop(payload.message_id, None)
+
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        for message_id in payload.message_ids:
+            self.watched_hashes.pop(message_id, None)
+
+    def get_watched_entries(self, guild_id: int) -> List[Dict]:
+        """Returns the watched list entries of a server.
+
+        Entries are cached, they are only read from the database again after the server's watched list changes."""
+        entries = self.watched_entries.get(guild_id)
+        metrics.cache_requests.inc(cache="watched_entries", result="miss" if entries is None else "hit")
+        if entries is None:
+            with closing(userDatabase.cursor()) as c:
+                c.execute("SELECT * FROM watched_list WHERE server_id = ? ORDER BY is_guild, name", (guild_id,))
+                entries = c.fetchall()
+            self.watched_entries[guild_id] = entries
+        return entries
+
     async def check_death(self, character):
         """Checks if the player has new deaths"""
+        metrics.death_checks.inc()
         try:
             char = await get_character(character, bot=self.bot)
             if char is None:
@@ -383,6 +445,7 @@ class Tracking:
             with userDatabase as con:
                 con.execute("INSERT INTO char_deaths(char_id, level, killer, byplayer, date) VALUES(?,?,?,?,?)",
                             (char_id, death.level, death.killer, death.by_player, death.time.timestamp()))
+                add_death_stats(con, char.world, char_id, death.killer, death.time.timestamp())
             if time.time() - death.time.timestamp() >= (30 * 60):
                 log.info("Death detected, too old to announce: {0}({1.level}) | {1.killer}".format(character, death))
             else:
@@ -402,6 +465,7 @@ class Tracking:
                 return
 
         log.info("Announcing death: {0.name}({1.level}) | {1.killer}".format(char, death))
+        metrics.announcements.inc(type="death")
 
         # Find killer article (a/an)
         killer_article = ""
@@ -427,29 +491,12 @@ class Tracking:
         else:
             message = weighed_choice(death_messages_monster, vocation=char.vocation, level=death.level,
                                      levels_lost=levels_lost, killer=death.killer)
-        # Format message with death information
+        # Format message with death information and extra stylization
         death_info = {'name': char.name, 'level': death.level, 'killer': death.killer, 'killer_article': killer_article,
                       'he_she': char.he_she.lower(), 'his_her': char.his_her.lower(), 'him_her': char.him_her.lower()}
-        message = message.format(**death_info)
-        # Format extra stylization
-        message = f"{config.pvpdeath_emoji if death.by_player else config.death_emoji} {format_message(message)}"
-
-        for guild_id, tracked_world in self.bot.tracked_worlds.items():
-            guild = self.bot.get_guild(guild_id)
-            if guild is None:
-                continue
-            min_level = get_server_property(guild_id, "announce_level", is_int=True, default=config.announce_threshold)
-            if death.level < min_level:
-                continue
-            if char.world == tracked_world and guild.get_member(char.owner) is not None:
-                try:
-                    channel = self.bot.get_channel_or_top(guild,
-                                                          get_server_property(guild.id, "levels_channel", is_int=True))
-                    await channel.send(message[:1].upper() + message[1:])
-                except discord.Forbidden:
-                    log.warning("announce_death: Missing permissions.")
-                except discord.HTTPException:
-                    log.warning("announce_death: Malformed message.")
+        message = format_message(message, **death_info)
+        message = f"{config.pvpdeath_emoji if death.by_player else config.death_emoji} {message}"
+        await self.send_announcement(char, death.level, message[:1].upper() + message[1:])
 
     async def announce_level(self, level, char_name: str = None, char: Character = None):
         """Announces a level up on corresponding servers
@@ -473,32 +520,92 @@ class Tracking:
                 return
 
         log.info("Announcing level up: {0} ({1})".format(char.name, level))
+        metrics.announcements.inc(type="level")
 
         # Select a message
         message = weighed_choice(level_messages, vocation=char.vocation, level=level)
         level_info = {'name': char.name, 'level': level, 'he_she': char.he_she.lower(), 'his_her': char.his_her.lower(),
                       'him_her': char.him_her.lower()}
-        # Format message with level information
-        message = message.format(**level_info)
-        # Format extra stylization
-        message = f"{config.levelup_emoji} {format_message(message)}"
-
-        for server_id, tracked_world in self.bot.tracked_worlds.items():
-            server = self.bot.get_guild(server_id)
-            if server is None:
+        # Format message with level information and extra stylization
+        message = f"{config.levelup_emoji} {format_message(message, **level_info)}"
+        await self.send_announcement(char, char.level, message)
+
+    async def send_announcement(self, char: Character, level: int, message: str):
+        """Sends an announcement to every server tracking the character's world where its owner is.
+
+        Messages are queued per channel, so a slow or rate limited channel doesn't delay the rest.
+
+        :param char: The character the announcement is about.
+        :param level: The level checked against each server's minimum announce level.
+        :param message: The message to send.
+        """
+        for guild_id, channel_id, min_level in self.bot.announce_targets.get(char.world, []):
+            # Announcements are disabled in this server
+            if channel_id == 0:
+                continue
+            if level < min_level:
                 continue
-            min_level = get_server_property(server_id, "announce_level", is_int=True, default=config.announce_threshold)
-            if char.level < min_level:
+            guild = self.bot.get_guild(guild_id)
+            if guild is None or guild.get_member(char.owner) is None:
                 continue
-            if char.world == tracked_world and server.get_member(char.owner) is not None:
+            channel = self.bot.get_channel_or_top(guild, channel_id)
+            if channel is not None:
+                self.queue_announcement(channel, message)
+
+    def queue_announcement(self, channel: discord.TextChannel, message: str):
+        """Adds an announcement to a channel's queue.
+
+        Announcements queued within `announce_merge_delay` seconds of each other are merged into a single message, to
+        avoid hitting rate limits during bursts (e.g. after server save). Order is always preserved.
+
+        :param channel: The channel where the announcement will be sent.
+        :param message: The announcement's content.
+        """
+        queue = self.announce_queues.get(channel.id)
+        if queue is None:
+            queue = self.announce_queues[channel.id] = []
+            self.bot.loop.create_task(self.flush_announcements(channel))
+        queue.append(message)
+        if len(queue) == ANNOUNCE_BACKLOG_WARNING:
+            log.warning(f"queue_announcement: {len(queue)} announcements pending in "
+                        f"#{channel.name} ({channel.guild.name}).")
+
+    async def flush_announcements(self, channel: discord.TextChannel):
+        """Sends the queued announcements of a channel until its queue is empty.
+
+        As many consecutive announcements as the message limit allows are joined together into each message.
+        The queue is always removed when this ends, even if cancelled, so a new one is started for later announcements."""
+        try:
+            await asyncio.sleep(config.announce_merge_delay)
+            queue = self.announce_queues[channel.id]
+            while queue:
+                content = queue.pop(0)
+                while queue and len(content) + len(queue[0]) + 1 <= CONTENT_LIMIT:
+                    content += "\n" + queue.pop(0)
                 try:
-                    channel = self.bot.get_channel_or_top(server,
-                                                          get_server_property(server.id, "levels_channel", is_int=True))
-                    await channel.send(message)
+                    await channel.send(content)
+                    metrics.announcement_messages.inc()
                 except discord.Forbidden:
-                    log.warning("announce_level: Missing permissions.")
+                    log.warning(f"flush_announcements: Missing permissions in #{channel.name} ({channel.guild.name}).")
                 except discord.HTTPException:
-                    log.warning("announce_level: Malformed message.")
+                    log.warning("flush_announcements: Malformed message.")
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.exception(f"flush_announcements: Couldn't send announcements in #{channel.name} "
+                                  f"({channel.guild.name}).")
+                # Give some time for new announcements to be merged into the next message
+                if queue:
+                    await asyncio.sleep(config.announce_merge_delay)
+        finally:
+            self.announce_queues.pop(channel.id, None)
+
+    def get_announcement_backlog(self) -> Dict[int, int]:
+        """Returns the number of pending announcements in every channel with a queue.
+
+        :return: A dictionary where the key is the channel's id and the value the number of pending announcements.
+        """
+        return {channel_id: len(queue) for channel_id, queue in self.announce_queues.items()}
 
     # Commands
     @commands.command()
@@ -1118,6 +1225,8 @@ class Tracking:
                                "**It is important to not allow anyone to write in here**\n"
                                "*This message can be deleted now.*")
             set_server_property(ctx.guild.id, "watched_channel", channel.id)
+            # The list is posted in the new channel on the next scan
+            self.watched_hashes.pop(get_server_property(ctx.guild.id, "watched_message", is_int=True), None)
 
     @checks.is_mod()
     @checks.is_tracking_world()
@@ -1177,6 +1286,7 @@ class Tracking:
             c.execute("INSERT INTO watched_list(name, server_id, is_guild, reason, author, added) "
                       "VALUES(?, ?, 0, ?, ?, ?)",
                       (char.name, ctx.guild.id, reason, ctx.author.id, time.time()))
+            self.watched_entries.pop(ctx.guild.id, None)
             await ctx.send("Character added to the watched list.")
         finally:
             userDatabase.commit()
@@ -1237,6 +1347,7 @@ class Tracking:
 
             c.execute("INSERT INTO watched_list(name, server_id, is_guild, reason, author, added)"
                       "VALUES(?, ?, 1, ?, ?, ?)", (guild.name, ctx.guild.id, reason, ctx.author.id, time.time()))
+            self.watched_entries.pop(ctx.guild.id, None)
             await ctx.send("Guild added to the watched list.")
         finally:
             userDatabase.commit()
@@ -1391,6 +1502,7 @@ class Tracking:
 
             c.execute("DELETE FROM watched_list WHERE server_id = ? AND name LIKE ? AND is_guild = 0",
                       (ctx.guild.id, name,))
+            self.watched_entries.pop(ctx.guild.id, None)
             await ctx.send("Character removed from the watched list.")
         finally:
             userDatabase.commit()
@@ -1429,6 +1541,7 @@ class Tracking:
 
             c.execute("DELETE FROM watched_list WHERE server_id = ? AND name LIKE ? AND is_guild = 1",
                       (ctx.guild.id, name,))
+            self.watched_entries.pop(ctx.guild.id, None)
             await ctx.send("Guild removed from the watched list.")
         finally:
             userDatabase.commit()
@@ -2,17 +2,19 @@ import datetime as dt
 import re
 import sys
 import traceback
-from typing import Union, List, Optional, Dict
+from typing import Union, List, Optional, Dict, Tuple, Set, Iterator
 
 import discord
+from aiohttp import web
 from discord.ext import commands
 
-from utils import context
+from utils import context, metrics
 from utils.config import config
 from utils.database import init_database, userDatabase, get_server_property
 from utils.general import join_list, get_token, get_user_avatar, get_region_string
 from utils.general import log
 from utils.help_format import NabHelpFormat
+from utils.monitor import LoopMonitor, CommandMetrics, Phase
 from utils.tibia import populate_worlds, tibia_worlds, get_voc_abb_and_emoji
 
 initial_cogs = {"cogs.tracking", "cogs.owner", "cogs.mod", "cogs.admin", "cogs.tibia", "cogs.general", "cogs.loot",
@@ -20,14 +22,14 @@ initial_cogs = {"cogs.tracking", "cogs.owner", "cogs.mod", "cogs.admin", "cogs.t
 
 
 def _prefix_callable(bot, msg):
-    user_id = bot.user.id
-    base = [f'<@!{user_id}> ', f'<@{user_id}> ']
-    if msg.guild is None:
-        base.extend(config.command_prefix)
-    else:
-        base.extend(get_server_property(msg.guild.id, "prefixes", deserialize=True, default=config.command_prefix))
-    base = sorted(base, reverse=True)
-    return base
+    guild_id = msg.guild.id if msg.guild is not None else None
+    try:
+        prefixes = bot.prefixes[guild_id]
+        metrics.cache_requests.inc(cache="prefixes", result="hit")
+        return prefixes
+    except KeyError:
+        metrics.cache_requests.inc(cache="prefixes", result="miss")
+        return bot.reload_prefixes(guild_id)
 
 
 class NabBot(commands.Bot):
@@ -36,13 +38,39 @@ class NabBot(commands.Bot):
                          description="Discord bot with functions for the MMORPG Tibia.",
                          formatter=NabHelpFormat(), pm_help=True)
         self.remove_command("help")
-        self.members = {}
+        # Dictionary of the guilds each member shares with the bot, key:value = member_id:{guild_id}
+        self.members: Dict[int, Set[int]] = {}
+        # Dictionary of indexed members per guild, key:value = guild_id:{member_id:(names)}
+        self.guild_members: Dict[int, Dict[int, Tuple[str, ...]]] = {}
+        # Dictionary of members by casefolded name and nickname, key:value = name:{(guild_id, member_id)}
+        self.member_names: Dict[str, Set[Tuple[int, int]]] = {}
         self.start_time = dt.datetime.utcnow()
         # Dictionary of worlds tracked by nabbot, key:value = server_id:world
         # Dictionary is populated from database
         # A list version is created from the dictionary
         self.tracked_worlds = {}
         self.tracked_worlds_list = []
+        # Dictionary of servers where announcements are made for each world, key:value = world:targets
+        # Each target is a tuple of server_id, levels channel id and minimum announce level
+        self.announce_targets: Dict[str, List[Tuple[int, Optional[int], int]]] = {}
+        # Dictionary of sorted command prefixes for each server, key:value = server_id:prefixes
+        # Private messages use the None key. Entries are loaded on first use and refreshed when prefixes are modified
+        self.prefixes: Dict[Optional[int], Tuple[str, ...]] = {}
+        # Dictionary of text channels by name for each server, key:value = server_id:{name:channel}
+        # Entries are built on first use and discarded when the server's channels change
+        self.channel_names: Dict[int, Dict[str, discord.TextChannel]] = {}
+        # Event loop lag and background task statistics
+        self.monitor = LoopMonitor(self.loop, block_threshold=config.loop_block_threshold,
+                                   summary_interval=config.monitor_summary_interval)
+        self.monitor_task = self.loop.create_task(self.monitor.run())
+        # Latency of command invocations
+        self.command_metrics = CommandMetrics(slow_threshold=config.slow_command_threshold)
+        metrics.tracked_worlds.function = lambda: len(set(self.tracked_worlds_list))
+        metrics.event_loop_lag.function = lambda: self.monitor.lag_samples[-1] if self.monitor.lag_samples else 0.0
+        # Server exposing the metrics, cleaned up when closing
+        self.metrics_runner: Optional[web.AppRunner] = None
+        if config.metrics_port:
+            self.loop.create_task(self.start_metrics())
         self.__version__ = "1.4.0"
         self.__min_discord__ = 1480
 
@@ -61,17 +89,24 @@ class NabBot(commands.Bot):
             if user is not None:
                 await user.send("Restart complete")
 
-        # Populating members's guild list
-        self.members = {}
-        for guild in self.guilds:
-            for member in guild.members:
-                if member.id in self.members:
-                    self.members[member.id].append(guild.id)
-                else:
-                    self.members[member.id] = [guild.id]
+        # Populating members's guild list, on reconnects only changed guilds are indexed again
+        self.sync_members()
+        # Channel objects are replaced when reconnecting
+        self.channel_names.clear()
 
         log.info('Bot is online and ready')
 
+    async def start_metrics(self):
+        """Starts the server exposing the metrics."""
+        self.metrics_runner = await metrics.start_server(config.metrics_host, config.metrics_port)
+
+    async def close(self):
+        """Stops the metrics server before closing the connection."""
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+            self.metrics_runner = None
+        await super().close()
+
     async def on_message(self, message: discord.Message):
         """Called every time a message is sent on a visible channel."""
         # Ignore if message is from any bot
@@ -95,6 +130,31 @@ class NabBot(commands.Bot):
                     # Bot doesn't have permission to delete message
                     pass
 
+    async def invoke(self, ctx: context.NabCtx):
+        """Invokes the command given under the invocation context, recording its latency.
+
+        If the command is being profiled, the invocation is profiled too."""
+        if ctx.command is None:
+            return await super().invoke(ctx)
+        session = self.monitor.profile_session
+        if session is not None and not session.matches("command", ctx.command.qualified_name):
+            session = None
+        with self.command_metrics.invocation(ctx):
+            if session is not None:
+                session.start()
+            try:
+                await super().invoke(ctx)
+            finally:
+                if session is not None:
+                    session.stop()
+
+    async def wait_for(self, event, *, check=None, timeout=None):
+        """Waits for a WebSocket event to be dispatched.
+
+        The time spent waiting is not counted as part of the current command's latency."""
+        with Phase("input"):
+            return await super().wait_for(event, check=check, timeout=timeout)
+
     async def on_command_error(self, ctx: context.NabCtx, error):
         """Handles command errors"""
         if isinstance(error, commands.errors.CommandNotFound):
@@ -130,11 +190,7 @@ class NabBot(commands.Bot):
                   "To tweak NabBot settings, use `{3}settings` in your server."
         formatted_message = message.format(guild, config.ask_channel_name, config.log_channel_name, 
                                            config.command_prefix[0])
-        for member in guild.members:
-            if member.id in self.members:
-                self.members[member.id].append(guild.id)
-            else:
-                self.members[member.id] = [guild.id]
+        self._add_guild_members(guild)
         try:
             await guild.owner.send(formatted_message)
         except discord.Forbidden:
@@ -147,18 +203,15 @@ class NabBot(commands.Bot):
     async def on_guild_remove(self, guild: discord.Guild):
         """Called when the bot leaves a guild (server)."""
         log.info("Nab Bot left server: {0.name} (ID: {0.id})".format(guild))
-        for member in guild.members:
-            if member.id in self.members:
-                self.members[member.id].remove(guild.id)
+        self.prefixes.pop(guild.id, None)
+        self.channel_names.pop(guild.id, None)
+        self._remove_guild_members(guild.id)
 
     async def on_member_join(self, member: discord.Member):
         """ Called when a member joins a guild (server) the bot is in."""
         log.info("{0.display_name} (ID: {0.id}) joined {0.guild.name}".format(member))
         # Updating member list
-        if member.id in self.members:
-            self.members[member.id].append(member.guild.id)
-        else:
-            self.members[member.id] = [member.guild.id]
+        self._add_member(member)
 
         embed = discord.Embed(description="{0.mention} joined.".format(member), color=discord.Color.green())
         embed.set_author(name="{0.name}#{0.discriminator} (ID: {0.id})".format(member), icon_url=get_user_avatar(member))
@@ -214,7 +267,7 @@ class NabBot(commands.Bot):
     async def on_member_remove(self, member: discord.Member):
         """Called when a member leaves or is kicked from a guild."""
         now = dt.datetime.utcnow()
-        self.members[member.id].remove(member.guild.id)
+        self._remove_member(member.guild.id, member.id)
         bot_member: discord.Member = member.guild.me
 
         embed = discord.Embed(description="Left the server or was kicked", colour=discord.Colour(0xffff00))
@@ -287,6 +340,9 @@ class NabBot(commands.Bot):
 
     async def on_member_update(self, before: discord.Member, after: discord.Member):
         """Called every time a member is updated"""
+        if before.name != after.name or before.display_name != after.display_name:
+            self._remove_member(after.guild.id, after.id)
+            self._add_member(after)
         now = dt.datetime.utcnow()
         guild = after.guild
         bot_member = guild.me
@@ -407,6 +463,19 @@ class NabBot(commands.Bot):
                     break
             await self.send_log_message(after, embed=embed)
 
+    async def on_guild_channel_create(self, channel: discord.abc.GuildChannel):
+        """Called when a channel is created in a guild."""
+        self.channel_names.pop(channel.guild.id, None)
+
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        """Called when a channel is deleted in a guild."""
+        self.channel_names.pop(channel.guild.id, None)
+
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        """Called every time a channel in a guild is updated."""
+        if before.name != after.name or before.position != after.position:
+            self.channel_names.pop(after.guild.id, None)
+
     # ------------ Utility methods ------------
 
     def get_member(self, argument: Union[str, int], guild: Union[discord.Guild, List[discord.Guild]] = None) \
@@ -426,10 +495,13 @@ class NabBot(commands.Bot):
         else:
             user_id = int(match.group(1))
             if guild is None:
-                return discord.utils.get(self.get_all_members(), id=user_id)
-            if type(guild) is list and len(guild) > 0:
-                members = [m for ml in [g.members for g in guild] for m in ml]
-                return discord.utils.find(lambda m: m.id == user_id, members)
+                guild = [self.get_guild(gid) for gid in self.members.get(user_id, [])]
+            if type(guild) is list:
+                for _guild in guild:
+                    member = _guild.get_member(user_id) if _guild is not None else None
+                    if member is not None:
+                        return member
+                return None
             return guild.get_member(user_id)
 
     def get_member_named(self, name: str, guild: Union[discord.Guild, List[discord.Guild]] = None) -> discord.Member:
@@ -443,23 +515,115 @@ class NabBot(commands.Bot):
         :return: The member found or none
         """
         name = str(name)
-        members = self.get_all_members()
+        guild_ids = None
         if type(guild) is discord.Guild:
-            members = guild.members
+            guild_ids = {guild.id}
         if type(guild) is list and len(guild) > 0:
-            members = [m for ml in [g.members for g in guild] for m in ml]
+            guild_ids = {g.id for g in guild}
 
         if len(name) > 5 and name[-5] == '#':
             potential_discriminator = name[-4:]
-            result = discord.utils.get(members, name=name[:-5], discriminator=potential_discriminator)
-            if result is not None:
-                return result
-        return discord.utils.find(lambda m: m.display_name.lower() == name.lower() or m.name.lower == name.lower(),
-                                  members)
+            for member in self._find_members_named(name[:-5], guild_ids):
+                if member.name == name[:-5] and member.discriminator == potential_discriminator:
+                    return member
+        return next(self._find_members_named(name, guild_ids), None)
+
+    def _find_members_named(self, name: str, guild_ids: Set[int] = None) -> Iterator[discord.Member]:
+        """Yields members whose name or nickname match the name, ignoring case.
+
+        :param name: The name or nickname to look for.
+        :param guild_ids: If specified, only members of these guilds are returned.
+        """
+        key = name.casefold()
+        for guild_id, member_id in list(self.member_names.get(key, ())):
+            if guild_ids is not None and guild_id not in guild_ids:
+                continue
+            guild = self.get_guild(guild_id)
+            member = guild.get_member(member_id) if guild is not None else None
+            if member is not None and key in (member.display_name.casefold(), member.name.casefold()):
+                yield member
+
+    def sync_members(self):
+        """Brings the member indexes up to date with the guilds in cache.
+
+        Guilds that were left are dropped and new guilds are indexed. In guilds already indexed, only the members that
+        left, joined or changed their name or nickname while disconnected are updated."""
+        current_guilds = {guild.id: guild for guild in self.guilds}
+        for guild_id in set(self.guild_members) - set(current_guilds):
+            self._remove_guild_members(guild_id)
+        for guild_id, guild in current_guilds.items():
+            indexed = self.guild_members.get(guild_id)
+            if indexed is None:
+                self._add_guild_members(guild)
+                continue
+            for member_id in set(indexed) - {member.id for member in guild.members}:
+                self._remove_member(guild_id, member_id)
+            for member in guild.members:
+                name = member.name.casefold()
+                display_name = member.display_name.casefold()
+                names = (name,) if name == display_name else (name, display_name)
+                if indexed.get(member.id) != names:
+                    self._remove_member(guild_id, member.id)
+                    self._add_member(member)
+
+    def _add_guild_members(self, guild: discord.Guild):
+        """Adds all the members of a guild to the member indexes."""
+        # Inlined version of _add_member, as this runs for every member when starting up
+        guild_id = guild.id
+        indexed = self.guild_members.setdefault(guild_id, {})
+        members = self.members
+        member_names = self.member_names
+        for member in guild.members:
+            name = member.name.casefold()
+            display_name = member.display_name.casefold()
+            names = (name,) if name == display_name else (name, display_name)
+            try:
+                members[member.id].add(guild_id)
+            except KeyError:
+                members[member.id] = {guild_id}
+            indexed[member.id] = names
+            for name in names:
+                try:
+                    member_names[name].add((guild_id, member.id))
+                except KeyError:
+                    member_names[name] = {(guild_id, member.id)}
+
+    def _remove_guild_members(self, guild_id: int):
+        """Removes all the members of a guild from the member indexes."""
+        for member_id in list(self.guild_members.get(guild_id, ())):
+            self._remove_member(guild_id, member_id)
+        self.guild_members.pop(guild_id, None)
+
+    def _add_member(self, member: discord.Member):
+        """Adds a member to the member indexes, under their name and their nickname."""
+        guild_id = member.guild.id
+        name = member.name.casefold()
+        display_name = member.display_name.casefold()
+        names = (name,) if name == display_name else (name, display_name)
+        self.members.setdefault(member.id, set()).add(guild_id)
+        self.guild_members.setdefault(guild_id, {})[member.id] = names
+        for name in names:
+            self.member_names.setdefault(name, set()).add((guild_id, member.id))
+
+    def _remove_member(self, guild_id: int, member_id: int):
+        """Removes a member of a guild from the member indexes."""
+        guilds = self.members.get(member_id)
+        if guilds is not None:
+            guilds.discard(guild_id)
+            if not guilds:
+                del self.members[member_id]
+        names = self.guild_members.get(guild_id, {}).pop(member_id, ())
+        for name in names:
+            entries = self.member_names.get(name)
+            if entries is None:
+                continue
+            entries.discard((guild_id, member_id))
+            if not entries:
+                del self.member_names[name]
 
     def get_user_guilds(self, user_id: int) -> List[discord.Guild]:
         """Returns a list of the user's shared guilds with the bot"""
-        return [self.get_guild(gid) for gid in self.members[user_id]]
+        return [self.get_guild(gid) for gid in self.members.get(user_id, ())]
 
     def get_user_worlds(self, user_id: int, guild_list=None) -> List[str]:
         """Returns a list of all the tibia worlds the user is tracked in.
@@ -500,14 +664,19 @@ class NabBot(commands.Bot):
     def get_channel_by_name(self, name: str, guild: discord.Guild) -> discord.TextChannel:
         """Finds a channel by name on all the servers the bot is in.
 
-        If guild is specified, only channels in that guild will be searched"""
+        If guild is specified, only channels in that guild will be searched, using the server's channel name index."""
         if guild is None:
-            channel = discord.utils.find(lambda m: m.name == name and not type(m) == discord.ChannelType.voice,
+            channel = discord.utils.find(lambda m: m.name == name and isinstance(m, discord.TextChannel),
                                          self.get_all_channels())
-        else:
-            channel = discord.utils.find(lambda m: m.name == name and not type(m) == discord.ChannelType.voice,
-                                         guild.channels)
-        return channel
+            return channel
+        channels = self.channel_names.get(guild.id)
+        metrics.cache_requests.inc(cache="channel_names", result="miss" if channels is None else "hit")
+        if channels is None:
+            channels = {}
+            for channel in guild.text_channels:
+                channels.setdefault(channel.name, channel)
+            self.channel_names[guild.id] = channels
+        return channels.get(name)
 
     def get_guild_by_name(self, name: str) -> discord.Guild:
         """Returns a guild by its name"""
@@ -560,6 +729,54 @@ class NabBot(commands.Bot):
             self.tracked_worlds.update(tibia_servers_dict_temp)
         finally:
             c.close()
+        self.reload_announce_targets()
+
+    def reload_announce_targets(self):
+        """Refresh the servers where level ups and deaths are announced for each world
+
+        Like the world list, this is loaded on startup and refreshed only when a server's world, levels channel or
+        minimum announce level are modified."""
+        def to_int(value, default=None):
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return default
+
+        c = userDatabase.cursor()
+        properties = {}
+        try:
+            c.execute("SELECT server_id, name, value FROM server_properties "
+                      "WHERE name IN ('levels_channel', 'announce_level')")
+            for row in c.fetchall():
+                properties.setdefault(int(row["server_id"]), {})[row["name"]] = row["value"]
+        finally:
+            c.close()
+        announce_targets = {}
+        for server_id, world in self.tracked_worlds.items():
+            server_properties = properties.get(server_id, {})
+            channel_id = to_int(server_properties.get("levels_channel"))
+            min_level = to_int(server_properties.get("announce_level"), config.announce_threshold)
+            announce_targets.setdefault(world, []).append((server_id, channel_id, min_level))
+        self.announce_targets.clear()
+        self.announce_targets.update(announce_targets)
+
+    def reload_prefixes(self, guild_id: Optional[int]) -> Tuple[str, ...]:
+        """Refresh the cached command prefixes of a server
+
+        Prefixes are sorted in reverse, so longer prefixes are checked before shorter ones starting the same way.
+
+        :param guild_id: The id of the server, or None for private messages.
+        :return: The sorted prefixes, including mentions.
+        """
+        user_id = self.user.id
+        base = [f'<@!{user_id}> ', f'<@{user_id}> ']
+        if guild_id is None:
+            base.extend(config.command_prefix)
+        else:
+            base.extend(get_server_property(guild_id, "prefixes", deserialize=True, default=config.command_prefix))
+        prefixes = tuple(sorted(base, reverse=True))
+        self.prefixes[guild_id] = prefixes
+        return prefixes
 
 
 nabbot = None
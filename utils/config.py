@@ -23,9 +23,19 @@ KEYS = [
     "announce_threshold",
     "online_scan_interval",
     "death_scan_interval",
+    "announce_merge_delay",
     "highscores_delay",
     "highscores_page_delay",
     "network_retry_delay",
+    "loop_block_threshold",
+    "monitor_summary_interval",
+    "slow_command_threshold",
+    "metrics_host",
+    "metrics_port",
+    "tibiadata_url",
+    "tibia_url",
+    "guildstats_url",
+    "tibiabosses_url",
     "extra_cogs",
     "command_prefix",
     "online_emoji",
@@ -54,6 +64,8 @@ KEYS = [
     "elemental_emojis"
 ]
 
+URL_KEYS = ("tibiadata_url", "tibia_url", "guildstats_url", "tibiabosses_url")
+
 _DEFAULT_STATUS_EMOJIS = {
     "online": "💚",
     "dnd": "♥",
@@ -88,9 +100,19 @@ class Config:
         self.announce_threshold = 30
         self.online_scan_interval = 90
         self.death_scan_interval = 15
+        self.announce_merge_delay = 2
         self.highscores_delay = 45
         self.highscores_page_delay = 10
         self.network_retry_delay = 1
+        self.loop_block_threshold = 0.5
+        self.monitor_summary_interval = 900
+        self.slow_command_threshold = 5
+        self.metrics_host = "127.0.0.1"
+        self.metrics_port = 0
+        self.tibiadata_url = "https://api.tibiadata.com"
+        self.tibia_url = "https://secure.tibia.com"
+        self.guildstats_url = "http://guildstats.eu"
+        self.tibiabosses_url = "http://www.tibiabosses.com"
         self.online_emoji = "🔹"
         self.true_emoji = "✅"
         self.false_emoji = "❌"
@@ -148,6 +170,9 @@ class Config:
                         _config[key] = (_config[key],)
                     else:
                         _config[key] = tuple(_config[key])
+                # urls are joined with paths starting with a slash
+                if key in URL_KEYS:
+                    _config[key] = str(_config[key]).rstrip("/")
                 setattr(self, key, _config[key])
         for key in _config:
             if key not in KEYS:
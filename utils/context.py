@@ -8,6 +8,7 @@ from discord.ext import commands
 
 from utils.config import config
 from utils.database import get_server_property
+from utils.monitor import Phase
 
 _mention = re.compile(r'<@!?([0-9]{1,19})>')
 
@@ -267,6 +268,11 @@ class NabCtx(commands.Context):
                     pass
         return True
 
+    async def send(self, content=None, **kwargs) -> discord.Message:
+        """Sends a message to the destination, counting the time spent as part of the command's Discord time."""
+        with Phase("discord"):
+            return await super().send(content, **kwargs)
+
     def tick(self, value: bool = True, label: str = None) -> str:
         """Displays a checkmark or a cross depending on the value.
 
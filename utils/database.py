@@ -1,16 +1,63 @@
 import json
 import sqlite3
 from contextlib import closing
-from typing import Dict
+from typing import Dict, Iterator, Iterable, Tuple
+
+from utils.monitor import Phase
 
 # Databases filenames
 USERDB = "data/users.db"
 TIBIADB = "data/tibia_database.db"
 
-userDatabase = sqlite3.connect(USERDB)
-tibiaDatabase = sqlite3.connect(TIBIADB)
 
-DB_LASTVERSION = 22
+class TimedCursor(sqlite3.Cursor):
+    """A cursor that counts the time spent running queries and fetching rows as part of the current command."""
+    def execute(self, *args, **kwargs):
+        with Phase("db"):
+            return super().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        with Phase("db"):
+            return super().executemany(*args, **kwargs)
+
+    def executescript(self, *args, **kwargs):
+        with Phase("db"):
+            return super().executescript(*args, **kwargs)
+
+    def fetchone(self):
+        with Phase("db"):
+            return super().fetchone()
+
+    def fetchmany(self, *args, **kwargs):
+        with Phase("db"):
+            return super().fetchmany(*args, **kwargs)
+
+    def fetchall(self):
+        with Phase("db"):
+            return super().fetchall()
+
+
+class TimedConnection(sqlite3.Connection):
+    """A connection that uses :class:`TimedCursor` for all queries."""
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args, **kwargs):
+        return self.cursor().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self.cursor().executemany(*args, **kwargs)
+
+    def executescript(self, *args, **kwargs):
+        return self.cursor().executescript(*args, **kwargs)
+
+
+userDatabase = sqlite3.connect(USERDB, factory=TimedConnection)
+tibiaDatabase = sqlite3.connect(TIBIADB, factory=TimedConnection)
+
+DB_LASTVERSION = 24
+# Length of the periods statistics are aggregated by, in seconds
+STATS_PERIOD = 60 * 60 * 24
 
 
 def init_database():
@@ -251,6 +298,50 @@ def init_database():
                 guild TEXT NOT NULL
             );""")
             db_version += 1
+        if db_version == 22:
+            # Daily statistics of deaths and level ups per world
+            c.execute("""CREATE TABLE death_stats_chars(
+                world TEXT,
+                day INTEGER NOT NULL,
+                char_id INTEGER NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY(world, day, char_id)
+            );""")
+            c.execute("""CREATE TABLE death_stats_killers(
+                world TEXT,
+                day INTEGER NOT NULL,
+                killer TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY(world, day, killer)
+            );""")
+            c.execute("""CREATE TABLE levelup_stats(
+                world TEXT,
+                day INTEGER NOT NULL,
+                char_id INTEGER NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY(world, day, char_id)
+            );""")
+            c.execute("INSERT INTO death_stats_chars(world, day, char_id, count) "
+                      "SELECT world, CAST(date / ? AS INTEGER) AS day, char_id, COUNT() FROM char_deaths, chars "
+                      "WHERE chars.id = char_id GROUP BY world, day, char_id", (STATS_PERIOD,))
+            c.execute("INSERT INTO death_stats_killers(world, day, killer, count) "
+                      "SELECT world, CAST(date / ? AS INTEGER) AS day, killer, COUNT() FROM char_deaths, chars "
+                      "WHERE chars.id = char_id GROUP BY world, day, killer", (STATS_PERIOD,))
+            c.execute("INSERT INTO levelup_stats(world, day, char_id, count) "
+                      "SELECT world, CAST(date / ? AS INTEGER) AS day, char_id, COUNT() FROM char_levelups, chars "
+                      "WHERE chars.id = char_id GROUP BY world, day, char_id", (STATS_PERIOD,))
+            db_version += 1
+        if db_version == 23:
+            # Indexes for listing deaths and level ups by date
+            c.execute("CREATE INDEX char_deaths_date ON char_deaths(date)")
+            c.execute("CREATE INDEX char_deaths_char_date ON char_deaths(char_id, date)")
+            c.execute("CREATE INDEX char_levelups_date ON char_levelups(date)")
+            c.execute("CREATE INDEX char_levelups_char_date ON char_levelups(char_id, date)")
+            db_version += 1
+        if db_version == 24:
+            # Index for looking up the characters of users
+            c.execute("CREATE INDEX chars_user_id ON chars(user_id)")
+            db_version += 1
         print("Updated database to version {0}".format(db_version))
         c.execute("UPDATE db_info SET value = ? WHERE key LIKE 'version'", (db_version,))
     finally:
@@ -307,3 +398,76 @@ def set_server_property(guild_id: int, key: str, value, *, serialize=False) -> N
         if serialize:
             value = json.dumps(value)
         con.execute("INSERT INTO server_properties(name, server_id, value) VALUES(?,?,?)", (key, guild_id, value))
+
+
+def add_death_stats(con, world: str, char_id: int, killer: str, date: float) -> None:
+    """Adds a death to the daily death statistics
+
+    Must be called in the same transaction the death is saved in.
+
+    :param con: The connection or cursor used to save the death
+    :param world: The world of the character
+    :param char_id: The id of the character
+    :param killer: The name of the killer
+    :param date: The timestamp of the death
+    """
+    day = int(date // STATS_PERIOD)
+    con.execute("INSERT OR IGNORE INTO death_stats_chars(world, day, char_id) VALUES(?,?,?)", (world, day, char_id))
+    con.execute("UPDATE death_stats_chars SET count = count + 1 WHERE world = ? AND day = ? AND char_id = ?",
+                (world, day, char_id))
+    con.execute("INSERT OR IGNORE INTO death_stats_killers(world, day, killer) VALUES(?,?,?)", (world, day, killer))
+    con.execute("UPDATE death_stats_killers SET count = count + 1 WHERE world = ? AND day = ? AND killer = ?",
+                (world, day, killer))
+
+
+def add_levelup_stats(con, world: str, char_id: int, date: float) -> None:
+    """Adds a level up to the daily level up statistics
+
+    Must be called in the same transaction the level up is saved in.
+
+    :param con: The connection or cursor used to save the level up
+    :param world: The world of the character
+    :param char_id: The id of the character
+    :param date: The timestamp of the level up
+    """
+    day = int(date // STATS_PERIOD)
+    con.execute("INSERT OR IGNORE INTO levelup_stats(world, day, char_id) VALUES(?,?,?)", (world, day, char_id))
+    con.execute("UPDATE levelup_stats SET count = count + 1 WHERE world = ? AND day = ? AND char_id = ?",
+                (world, day, char_id))
+
+
+def iter_by_date(query: str, params: Dict, batch_size=25) -> Iterator[Dict]:
+    """Iterates the rows of a query from newest to oldest, fetching them in batches
+
+    Batches are fetched using the date and rowid of the last row seen as the key, so each one is a range scan on the
+    date index. The query must select `date` and `rowid`, include the condition
+    `(date < :before OR date = :before AND rowid < :before_rowid)`, be ordered by `date DESC, rowid DESC` and end with
+    `LIMIT :limit`.
+
+    :param query: The query to run
+    :param params: The query's named parameters, other than before, before_rowid and limit
+    :param batch_size: The number of rows fetched at a time
+    :return: An iterator of the resulting rows
+    """
+    before = float("inf")
+    before_rowid = float("inf")
+    while True:
+        with closing(userDatabase.cursor()) as c:
+            c.execute(query, dict(params, before=before, before_rowid=before_rowid, limit=batch_size))
+            rows = c.fetchall()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        before = rows[-1]["date"]
+        before_rowid = rows[-1]["rowid"]
+
+
+def named_placeholders(name: str, values: Iterable) -> Tuple[str, Dict]:
+    """Creates named parameters for a list of values, to use with IN in queries with named parameters
+
+    :param name: The prefix of the parameters' names
+    :param values: The values to bind
+    :return: The parameters' placeholders separated by commas, and a dictionary with their values
+    """
+    params = {f"{name}{i}": value for i, value in enumerate(values)}
+    return ", ".join(f":{key}" for key in params), params
@@ -1,11 +1,13 @@
+import atexit
 import datetime as dt
 import io
 import logging
 import os
+import queue
 import re
 import time
 from calendar import timegm
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 from typing import Optional, List, Union, Tuple
 
 import discord
@@ -21,12 +23,16 @@ global_online_list = []
 # Start logging
 # Create logs folder
 os.makedirs('logs/', exist_ok=True)
+# Handlers only receive records through queues, so the file and console writes happen in background threads
+# instead of blocking the event loop
 # discord.py log
 discord_log = logging.getLogger('discord')
 discord_log.setLevel(logging.INFO)
 handler = logging.FileHandler(filename='logs/discord.log', encoding='utf-8', mode='a')
 handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-discord_log.addHandler(handler)
+discord_log_queue = queue.Queue()
+discord_log.addHandler(QueueHandler(discord_log_queue))
+discord_log_listener = QueueListener(discord_log_queue, handler, respect_handler_level=True)
 # NabBot log
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
@@ -35,12 +41,18 @@ fileHandler = TimedRotatingFileHandler('logs/nabbot', when='midnight')
 fileHandler.suffix = "%Y_%m_%d.log"
 fileHandler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s: %(message)s'))
 fileHandler.setLevel(logging.INFO)
-log.addHandler(fileHandler)
 # Print output to console too (debug level)
 consoleHandler = logging.StreamHandler()
 consoleHandler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s: %(message)s'))
 consoleHandler.setLevel(logging.DEBUG)
-log.addHandler(consoleHandler)
+log_queue = queue.Queue()
+log.addHandler(QueueHandler(log_queue))
+log_listener = QueueListener(log_queue, fileHandler, consoleHandler, respect_handler_level=True)
+discord_log_listener.start()
+log_listener.start()
+# Pending records are written before exiting
+atexit.register(discord_log_listener.stop)
+atexit.register(log_listener.stop)
 
 CONTENT_LIMIT = 2000
 DESCRIPTION_LIMIT = 2048
@@ -1,14 +1,18 @@
+import bisect
 import random
 import re
+from collections import deque
+from typing import List, Iterable, Iterator
 
 import discord
 
 from utils.config import config
+from utils.general import FIELD_VALUE_LIMIT, FIELD_AMOUNT
 
 announce_threshold = config.announce_threshold
 
 # We save the last messages so they are not repeated so often
-last_messages = [""]*10
+last_messages = deque(maxlen=10)
 
 # Message list for announce_level
 # Parameters: {name}, {level} , {he_she}, {his_her}, {him_her}
@@ -210,68 +214,160 @@ death_messages_player = [
 ]
 
 
-def format_message(message) -> str:
-    """##handles stylization of messages, uppercasing \TEXT/, lowercasing /text\ and title casing /Text/"""
-    upper = r'\\(.+?)/'
-    upper = re.compile(upper, re.MULTILINE + re.S)
-    lower = r'/(.+?)\\'
-    lower = re.compile(lower, re.MULTILINE + re.S)
-    title = r'/(.+?)/'
-    title = re.compile(title, re.MULTILINE + re.S)
-    skipproper = r'\^(.+?)\^(.+?)([a-zA-Z])'
-    skipproper = re.compile(skipproper, re.MULTILINE + re.S)
-    message = re.sub(upper, lambda m: m.group(1).upper(), message)
-    message = re.sub(lower, lambda m: m.group(1).lower(), message)
-    message = re.sub(title, lambda m: m.group(1).title(), message)
-    message = re.sub(skipproper,
-                     lambda m: m.group(2) + m.group(3) if m.group(3).istitle() else m.group(1) + m.group(2) + m.group(
-                         3), message)
+# Stylization markers in message templates, applied in this order: \TEXT/ upper case, /text\ lower case,
+# /Text/ title case and ^skip^
+_UPPER, _LOWER, _TITLE, _SKIP_PROPER = range(4)
+_style_markers = [(_UPPER, re.compile(r'\\(.+?)/', re.MULTILINE + re.S)),
+                  (_LOWER, re.compile(r'/(.+?)\\', re.MULTILINE + re.S)),
+                  (_TITLE, re.compile(r'/(.+?)/', re.MULTILINE + re.S)),
+                  (_SKIP_PROPER, re.compile(r'\^(.+?)\^', re.MULTILINE + re.S))]
+_style_functions = {_UPPER: str.upper, _LOWER: str.lower, _TITLE: str.title}
+# ^Text^ is removed if the next letter after the following character is upper case, checked once the rest is styled
+_skip_proper = re.compile(r'\^(.+?)\^(.+?)([a-zA-Z])', re.MULTILINE + re.S)
+# Compiled message templates, key:value = template:[(style, text)]
+_compiled_templates = {}
+
+
+def _compile_template(message):
+    """Splits a message template into segments of text and the stylization marker surrounding them, if any."""
+    segments = [(None, message)]
+    for style, pattern in _style_markers:
+        new_segments = []
+        for segment_style, text in segments:
+            if segment_style is not None:
+                new_segments.append((segment_style, text))
+                continue
+            position = 0
+            for match in pattern.finditer(text):
+                if match.start() > position:
+                    new_segments.append((None, text[position:match.start()]))
+                new_segments.append((style, match.group(1)))
+                position = match.end()
+            if position < len(text):
+                new_segments.append((None, text[position:]))
+        segments = new_segments
+    return segments
+
+
+def format_message(message, **fields) -> str:
+    """##handles stylization of messages, uppercasing \TEXT/, lowercasing /text\ and title casing /Text/
+
+    Templates are split by their markers once and cached, the fields are replaced in each segment before styling it.
+    ^skip^ markers are evaluated last, against the styled message.
+
+    :param message: The message template.
+    :param fields: The values of the template's fields, if any.
+    :return: The formatted message.
+    """
+    segments = _compiled_templates.get(message)
+    if segments is None:
+        segments = _compiled_templates[message] = _compile_template(message)
+    parts = []
+    skip = False
+    for style, text in segments:
+        if fields:
+            text = text.format(**fields)
+        if style is None:
+            parts.append(text)
+        elif style == _SKIP_PROPER:
+            parts.append(f"^{text}^")
+            skip = True
+        else:
+            parts.append(_style_functions[style](text))
+    message = "".join(parts)
+    if skip:
+        message = _skip_proper.sub(lambda m: m.group(2) + m.group(3) if m.group(3).istitle()
+                                   else m.group(1) + m.group(2) + m.group(3), message)
     return message
 
 
+class MessageTable:
+    """A message list compiled for fast weighed choices.
+
+    Messages are grouped by vocation. Within each group, messages without further conditions have their weights
+    accumulated once, so they're picked with a binary search. Only messages with level, killer or levels lost
+    conditions are checked on every choice."""
+    def __init__(self, choices):
+        self.vocations = set()
+        for message in choices:
+            if len(message) > 2 and message[2]:
+                self.vocations.update(message[2])
+        # Buckets per vocation, vocations not in any filter use the None bucket
+        self.buckets = {vocation: self._compile(choices, vocation) for vocation in self.vocations}
+        self.buckets[None] = self._compile(choices, None)
+
+    @staticmethod
+    def _compile(choices, vocation):
+        static_messages = []
+        cumulative_weights = []
+        conditional = []
+        total = 0
+        for message in choices:
+            vocations, levels, killers, levels_lost = (list(message[2:6]) + [None] * 4)[:4]
+            if vocations and vocation not in vocations:
+                continue
+            if levels or killers or levels_lost:
+                conditional.append((message[0], message[1], MessageTable._condition(levels),
+                                    MessageTable._condition(killers), MessageTable._condition(levels_lost)))
+                continue
+            total += message[0]
+            static_messages.append(message[1])
+            cumulative_weights.append(total)
+        return static_messages, cumulative_weights, conditional
+
+    @staticmethod
+    def _condition(values):
+        """Converts a filter to a container with constant time lookups, or None if there's no filter."""
+        if not values:
+            return None
+        return values if isinstance(values, range) else frozenset(values)
+
+    def choose(self, level: int, vocation: str = None, killer: str = None, levels_lost: int = 0) -> str:
+        static_messages, cumulative_weights, conditional = self.buckets[vocation if vocation in self.vocations
+                                                                        else None]
+        matches = [(weight, message) for weight, message, levels, killers, lost in conditional
+                   if (levels is None or level in levels) and (killers is None or killer in killers)
+                   and (lost is None or levels_lost in lost)]
+        static_total = cumulative_weights[-1] if cumulative_weights else 0
+        total = static_total + sum(weight for weight, _ in matches)
+        if not total:
+            raise ValueError("No messages match the conditions.")
+        recent = set(last_messages)
+        # Recent messages are ten times less likely, candidates drawn with their full weight are rejected 9/10 times
+        while True:
+            position = random.random() * total
+            if position < static_total:
+                message = static_messages[bisect.bisect_right(cumulative_weights, position)]
+            else:
+                position -= static_total
+                for weight, message in matches:
+                    if position < weight:
+                        break
+                    position -= weight
+            if message not in recent or random.random() < 0.1:
+                last_messages.append(message)
+                return message
+
+
+# Compiled message tables, key:value = id(message list):MessageTable
+_message_tables = {}
+
+
 def weighed_choice(choices, level: int, vocation: str = None, killer: str = None, levels_lost: int = 0) -> str:
     """Makes weighed choices from message lists where [0] is a value representing the relative odds
-    of picking a message and [1] is the message string"""
-
-    # Find the max range by adding up the weigh of every message in the list
-    # and purge out messages that dont fulfil the conditions
-    weight_range = 0
-    _messages = []
-    for message in choices:
-        match = True
-        try:
-            if message[2] and vocation not in message[2]:
-                match = False
-            if message[3] and level not in message[3]:
-                match = False
-            if message[4] and killer not in message[4]:
-                match = False
-            if message[5] and levels_lost not in message[5]:
-                match = False
-        except IndexError:
-            pass
-        if match:
-            weight_range = weight_range + (message[0] if not message[1] in last_messages else message[0] / 10)
-            _messages.append(message)
-    # Choose a random number
-    range_choice = random.randint(0, weight_range)
-    # Iterate until we find the matching message
-    range_pos = 0
-    for message in _messages:
-        if range_pos <= range_choice < range_pos + (message[0] if not message[1] in last_messages else message[0] / 10):
-            last_messages.pop()
-            last_messages.insert(0, message[1])
-            return message[1]
-        range_pos = range_pos + (message[0] if not message[1] in last_messages else message[0] / 10)
-    # This shouldn't ever happen...
-    print("Error in weighed_choice!")
-    return _messages[0][1]
-
-
-def split_message(message: str, limit: int=2000):
+    of picking a message and [1] is the message string
+
+    Message lists are compiled once into a MessageTable, so choices don't need to check every message."""
+    table = _message_tables.get(id(choices))
+    if table is None:
+        table = _message_tables[id(choices)] = MessageTable(choices)
+    return table.choose(level, vocation, killer, levels_lost)
+
+
+def split_message(message: str, limit: int=2000) -> List[str]:
     """Splits a message into a list of messages if it exceeds limit.
 
-    Messages are only split at new lines.
+    Messages are only split at new lines, unless a single line exceeds the limit.
 
     Discord message limits:
         Normal message: 2000
@@ -280,19 +376,66 @@ def split_message(message: str, limit: int=2000):
         Embed field value: 1024"""
     if len(message) <= limit:
         return [message]
-    else:
-        lines = message.splitlines()
-        new_message = ""
-        message_list = []
-        for line in lines:
-            if len(new_message+line+"\n") <= limit:
-                new_message += line+"\n"
-            else:
-                message_list.append(new_message)
-                new_message = ""
-        if new_message:
-            message_list.append(new_message)
-        return message_list
+    return list(_split_lines(message.splitlines(), limit))
+
+
+def _split_lines(lines: Iterable[str], limit: int) -> Iterator[str]:
+    """Groups lines into strings no longer than limit, using the lengths of each line instead of concatenating."""
+    chunk = []
+    length = 0
+    for line in lines:
+        if len(line) > limit:
+            # Lines that can't fit on their own are cut
+            pieces = [line[i:i+limit] for i in range(0, len(line), limit)]
+            line = pieces.pop()
+            if chunk:
+                yield "\n".join(chunk)
+                chunk = []
+            yield from pieces
+        # The new line separator counts towards the length too
+        if chunk and length + 1 + len(line) > limit:
+            yield "\n".join(chunk)
+            chunk = []
+        length = length + 1 + len(line) if chunk else len(line)
+        chunk.append(line)
+    if chunk:
+        yield "\n".join(chunk)
+
+
+def add_split_fields(embed: discord.Embed, name: str, content: str, *, inline: bool = True,
+                     limit: int = FIELD_VALUE_LIMIT, total_limit: int = None, overflow: str = "*And more...*") -> int:
+    """Adds content to an embed, split into as many fields as needed.
+
+    Only the first field uses the name, the rest have a blank name.
+    If total_limit is set, lines that would exceed it are left out and overflow is added at the end instead.
+
+    :param embed: The embed to add the fields to.
+    :param name: The name of the first field.
+    :param content: The content to split into fields, separated by lines.
+    :param inline: Whether the fields are inline or not.
+    :param limit: The maximum length of each field.
+    :param total_limit: The maximum length of all fields together. The number of fields is also limited by FIELD_AMOUNT.
+    :param overflow: The line to add at the end if content was left out.
+    :return: The number of fields added.
+    """
+    lines = content.splitlines()
+    if total_limit is not None and len(content) > total_limit:
+        # Only keep as many lines as fit, leaving space for the overflow line
+        budget = total_limit - len(overflow) - 1
+        length = 0
+        for i, line in enumerate(lines):
+            length += len(line) + 1
+            if length > budget:
+                lines = lines[:i]
+                break
+        lines.append(overflow)
+    count = 0
+    for value in _split_lines(lines, limit):
+        if len(embed.fields) >= FIELD_AMOUNT:
+            break
+        embed.add_field(name=name if count == 0 else "\u200F", value=value, inline=inline)
+        count += 1
+    return count
 
 
 async def send_messageEx(bot, dest, message, embed=False):
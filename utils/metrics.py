@@ -0,0 +1,167 @@
+import bisect
+from typing import Dict, Tuple, Callable, Optional, List
+
+from aiohttp import web
+
+from utils.config import config
+from utils.general import log, global_online_list
+from utils.monitor import LATENCY_BUCKETS, phase_seconds, phase_counts
+
+# Registered metrics, in the order they are exposed
+metrics: List["Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metric:
+    """Base class for metrics exposed in Prometheus' text format.
+
+    Values are stored per combination of labels, sorted by name. Alternatively, a function can be set to get the values when they are
+    exposed, returning either a number or a dictionary of label combinations to numbers."""
+    type = "untyped"
+
+    def __init__(self, name: str, description: str, *, function: Callable = None):
+        self.name = name
+        self.description = description
+        self.function = function
+        self.values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        metrics.append(self)
+
+    def get_values(self) -> Dict[Tuple[Tuple[str, str], ...], float]:
+        if self.function is None:
+            return self.values
+        value = self.function()
+        if isinstance(value, dict):
+            return value
+        return {(): value}
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in self.get_values().items():
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    """Counts observed values in buckets."""
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, *, buckets=LATENCY_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = buckets
+        # Observations per combination of labels, as a list of bucket counts, followed by the count and sum
+        self.values: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        counts = self.values.get(key)
+        if counts is None:
+            counts = self.values[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += 1
+        counts[-1] += value
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"]
+        for labels, counts in self.values.items():
+            accumulated = 0
+            for bucket, count in zip(self.buckets, counts):
+                accumulated += count
+                le = 'le="+Inf"' if bucket == float("inf") else f'le="{bucket}"'
+                lines.append(f"{self.name}_bucket{_format_labels(labels, le)} {accumulated}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {counts[-2]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {counts[-1]}")
+        return lines
+
+
+# Tracker
+tracked_worlds = Gauge("nabbot_tracked_worlds", "Worlds tracked by at least one server")
+worlds_scanned = Counter("nabbot_worlds_scanned_total", "Online lists of worlds scanned")
+world_scan_duration = Histogram("nabbot_world_scan_duration_seconds",
+                                "Time taken to process a world's online list, including level up and death checks")
+online_characters = Gauge("nabbot_online_characters", "Registered characters currently online",
+                          function=lambda: len(global_online_list))
+death_checks = Counter("nabbot_death_checks_total", "Characters checked for new deaths")
+death_check_cycle = Gauge("nabbot_death_check_cycle_seconds",
+                          "Estimated time until every online character is checked for deaths again",
+                          function=lambda: len(global_online_list) * config.death_scan_interval)
+announcements = Counter("nabbot_announcements_total", "Level up and death announcements made")
+announcement_messages = Counter("nabbot_announcement_messages_total", "Announcement messages sent to channels")
+announcement_queue = Gauge("nabbot_announcement_queue", "Announcements waiting to be sent")
+# Tibia.com and TibiaData
+http_requests = Counter("nabbot_http_requests_total", "Requests made to Tibia.com and TibiaData")
+http_request_duration = Histogram("nabbot_http_request_duration_seconds",
+                                  "Time taken by requests to Tibia.com and TibiaData")
+# Caches
+cache_requests = Counter("nabbot_cache_requests_total", "Lookups in NabBot's caches, by result")
+# Database
+sqlite_seconds = Counter("nabbot_sqlite_seconds_total", "Time spent running queries and fetching rows from SQLite",
+                         function=lambda: phase_seconds.get("db", 0.0))
+sqlite_operations = Counter("nabbot_sqlite_operations_total", "Queries and fetches made to SQLite",
+                            function=lambda: phase_counts.get("db", 0))
+# Event loop
+event_loop_lag = Gauge("nabbot_event_loop_lag_seconds", "Time the last event loop lag sample was late by")
+
+
+def expose() -> str:
+    """Gets all metrics in Prometheus' text format."""
+    lines = []
+    for metric in metrics:
+        try:
+            lines.extend(metric.expose())
+        except Exception:
+            log.exception(f"metrics: Error exposing {metric.name}")
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=expose().encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_server(host: str, port: int) -> Optional[web.AppRunner]:
+    """Starts the HTTP server exposing the metrics in /metrics.
+
+    :param host: The address to listen on.
+    :param port: The port to listen on.
+    :return: The server's runner, to clean it up when closing.
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+    except OSError as e:
+        log.error(f"metrics: Couldn't start server on {host}:{port}: {e}")
+        await runner.cleanup()
+        return None
+    log.info(f"metrics: Serving metrics on http://{host}:{port}/metrics")
+    return runner
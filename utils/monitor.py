@@ -0,0 +1,412 @@
+import asyncio
+import bisect
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional, Deque, Tuple, List
+
+from utils.general import log
+
+# NabBot's root folder, used to find the bot's own code in stacks
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Phases a command's latency is split into, the time not spent in other phases is counted as render
+PHASES = ("network", "db", "discord", "render")
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+# Time spent in each phase by the command invocations in progress, key:value = task:{phase:seconds}
+_invocations: Dict[asyncio.Task, Dict[str, float]] = {}
+# Total time spent and number of operations in each phase, including background tasks, key:value = phase:value
+phase_seconds: Dict[str, float] = {}
+phase_counts: Dict[str, int] = {}
+
+try:
+    _current_task = asyncio.current_task
+except AttributeError:
+    _current_task = asyncio.Task.current_task
+
+
+class TaskHealth:
+    """Iteration statistics of a background task."""
+    def __init__(self, name: str):
+        self.name = name
+        self.iterations = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = 0.0
+        self.last_success: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_error_time: Optional[float] = None
+
+    @property
+    def average_time(self) -> float:
+        return self.total_time / self.iterations if self.iterations else 0.0
+
+    def __repr__(self):
+        return f"<TaskHealth name={self.name!r} iterations={self.iterations} errors={self.errors}>"
+
+
+class LoopMonitor:
+    """Measures the event loop's lag and the health of background tasks.
+
+    A sampler coroutine sleeps for a fixed interval and measures how late it wakes up, which is the time the loop spent
+    blocked by other code. A watchdog thread checks the sampler's progress, if the loop is blocked longer than the
+    threshold, it records where the loop's thread is at that moment."""
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, interval: float = 0.5, block_threshold: float = 0.5,
+                 summary_interval: float = 900):
+        self.loop = loop
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.summary_interval = summary_interval
+        # Lag samples in seconds, covers the last 10 minutes at the default interval
+        self.lag_samples: Deque[float] = deque(maxlen=1200)
+        # Iteration statistics per task, key:value = name:TaskHealth
+        self.tasks: Dict[str, TaskHealth] = {}
+        # Recent blocks of the event loop, each entry is a tuple of time, duration and location
+        self.blocks: Deque[Tuple[float, float, str]] = deque(maxlen=20)
+        self.block_count = 0
+        self.start_time = time.time()
+        self._loop_thread: Optional[int] = None
+        self._tick = 0.0
+        # Location where the watchdog saw the loop blocked, as a tuple of tick and location
+        self._blocked_at: Optional[Tuple[float, str]] = None
+        self._stop = threading.Event()
+        # Profiling session in progress, only one can be active at a time
+        self.profile_session: Optional[ProfileSession] = None
+
+    @contextmanager
+    def iteration(self, name: str):
+        """Records the duration and outcome of an iteration of a background task.
+
+        Exceptions are recorded and raised again, so the task can still handle them.
+
+        :param name: The name of the task."""
+        health = self.tasks.get(name)
+        if health is None:
+            health = self.tasks[name] = TaskHealth(name)
+        session = self.profile_session
+        if session is not None and not session.matches("task", name):
+            session = None
+        start = time.perf_counter()
+        if session is not None:
+            session.start()
+        try:
+            yield health
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            health.errors += 1
+            health.last_error = f"{e.__class__.__name__}: {e}"
+            health.last_error_time = time.time()
+            raise
+        else:
+            health.last_success = time.time()
+        finally:
+            if session is not None:
+                session.stop()
+            elapsed = time.perf_counter() - start
+            health.iterations += 1
+            health.total_time += elapsed
+            health.last_time = elapsed
+            health.max_time = max(health.max_time, elapsed)
+
+    async def run(self):
+        """Samples the event loop's lag until cancelled, logging a summary periodically."""
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        watchdog = threading.Thread(target=self._watch, name="LoopMonitor", daemon=True)
+        watchdog.start()
+        last_summary = time.perf_counter()
+        try:
+            while True:
+                tick = self._tick = time.perf_counter()
+                await asyncio.sleep(self.interval)
+                now = time.perf_counter()
+                lag = max(now - tick - self.interval, 0.0)
+                self.lag_samples.append(lag)
+                if lag >= self.block_threshold:
+                    self.block_count += 1
+                    blocked_at = self._blocked_at
+                    location = blocked_at[1] if blocked_at and blocked_at[0] == tick else "Unknown"
+                    self.blocks.append((time.time(), lag, location))
+                    log.warning(f"Event loop blocked for {lag*1000:.0f}ms at {location}")
+                if self.summary_interval and now - last_summary >= self.summary_interval:
+                    last_summary = now
+                    log.info(self.get_summary())
+        finally:
+            self._stop.set()
+
+    def _watch(self):
+        """Watchdog thread, saves the location of the loop's thread when the sampler is late."""
+        check_interval = self.block_threshold / 2
+        while not self._stop.wait(check_interval):
+            tick = self._tick
+            if time.perf_counter() - tick - self.interval < self.block_threshold:
+                continue
+            if self._blocked_at and self._blocked_at[0] == tick:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                self._blocked_at = (tick, self.get_location(frame))
+
+    @staticmethod
+    def get_location(frame) -> str:
+        """Describes where a thread is, using the innermost frame inside NabBot's code.
+
+        :param frame: The thread's current frame.
+        :return: A string describing the location."""
+        stack = traceback.extract_stack(frame)
+        if not stack:
+            return "Unknown"
+        innermost = stack[-1]
+        for entry in reversed(stack):
+            if entry.filename.startswith(ROOT_PATH):
+                location = f"{entry.name} ({os.path.relpath(entry.filename, ROOT_PATH)}:{entry.lineno})"
+                if entry is not innermost:
+                    location += f" in {innermost.name} ({os.path.basename(innermost.filename)}:{innermost.lineno})"
+                return location
+        return f"{innermost.name} ({innermost.filename}:{innermost.lineno})"
+
+    def get_lag_stats(self) -> Tuple[float, float, float]:
+        """Gets the average, 95th percentile and maximum lag of the recent samples, in seconds."""
+        if not self.lag_samples:
+            return 0.0, 0.0, 0.0
+        samples = sorted(self.lag_samples)
+        return sum(samples) / len(samples), samples[int(len(samples) * 0.95)], samples[-1]
+
+    def get_task_list(self) -> List[TaskHealth]:
+        """Gets the statistics of all tasks, sorted by name."""
+        return sorted(self.tasks.values(), key=lambda t: t.name)
+
+    def get_summary(self) -> str:
+        """Gets a one line summary of the loop lag and tasks."""
+        average, p95, maximum = self.get_lag_stats()
+        now = time.time()
+        tasks = []
+        for task in self.get_task_list():
+            last_success = f"{now-task.last_success:.0f}s ago" if task.last_success else "never"
+            tasks.append(f"{task.name}: {task.iterations} runs, avg {task.average_time*1000:.0f}ms, "
+                         f"{task.errors} errors, last success {last_success}")
+        return f"Loop lag: avg {average*1000:.1f}ms, p95 {p95*1000:.1f}ms, max {maximum*1000:.1f}ms, " \
+               f"{self.block_count} blocks | " + " | ".join(tasks)
+
+
+class ProfileSession:
+    """Profiles the invocations of a command or the iterations of a background task using cProfile.
+
+    The profiler runs in the event loop's thread, so code from other tasks running while the target awaits is profiled
+    too.
+
+    :param kind: The kind of target, either command or task.
+    :param name: The qualified name of the command or the name of the task.
+    :param count: The number of command invocations to profile, if any."""
+    def __init__(self, kind: str, name: str, *, count: int = None):
+        self.kind = kind
+        self.name = name
+        self.remaining = count
+        self.runs = 0
+        self.profile = cProfile.Profile()
+        self.finished = asyncio.Event()
+        self._active = 0
+
+    def matches(self, kind: str, name: str) -> bool:
+        return not self.finished.is_set() and self.kind == kind and self.name == name
+
+    def start(self):
+        """Starts profiling a run, the profiler is only enabled once for overlapping runs."""
+        if self._active == 0:
+            self.profile.enable()
+        self._active += 1
+
+    def stop(self):
+        """Stops profiling a run, the session is finished once the requested number of runs is reached."""
+        if self.finished.is_set():
+            return
+        self._active -= 1
+        self.runs += 1
+        if self._active == 0:
+            self.profile.disable()
+        if self.remaining is not None:
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self.finish()
+
+    def finish(self):
+        """Finishes the session, disabling the profiler if a run is still in progress."""
+        if self.finished.is_set():
+            return
+        if self._active:
+            self.profile.disable()
+            self._active = 0
+        self.finished.set()
+
+    def get_report(self, limit: int = 40) -> str:
+        """Gets the functions with the highest cumulative and internal times.
+
+        :param limit: The number of functions to show on each list.
+        :return: The report as text."""
+        output = io.StringIO()
+        output.write(f"Profile of {self.kind} {self.name}, {self.runs} runs\n\n")
+        try:
+            stats = pstats.Stats(self.profile, stream=output)
+        except TypeError:
+            # Nothing was profiled
+            output.write("No calls were recorded.\n")
+            return output.getvalue()
+        stats.strip_dirs()
+        for sort, label in (("cumulative", "cumulative time"), ("tottime", "internal time")):
+            output.write(f"Top {limit} functions by {label}\n")
+            stats.sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+
+class Phase:
+    """Adds the time spent inside the block to a phase of the command being invoked in the current task, if any.
+
+    Used by the network, database and Discord layers. The time is also added to the phase's totals.
+
+    :param name: The name of the phase."""
+    __slots__ = ("name", "phases", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.phases = None
+        self.start = 0.0
+
+    def __enter__(self):
+        if _invocations:
+            try:
+                self.phases = _invocations.get(_current_task())
+            except RuntimeError:
+                # Not in the event loop's thread
+                self.phases = None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.perf_counter() - self.start
+        phase_seconds[self.name] = phase_seconds.get(self.name, 0.0) + elapsed
+        phase_counts[self.name] = phase_counts.get(self.name, 0) + 1
+        if self.phases is not None:
+            self.phases[self.name] = self.phases.get(self.name, 0.0) + elapsed
+            self.phases = None
+        return False
+
+
+class Histogram:
+    """A latency histogram with fixed buckets."""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percentile: float) -> float:
+        """Estimates a percentile, interpolating linearly inside the bucket it falls in.
+
+        :param percentile: The percentile to estimate, from 0 to 100.
+        :return: The estimated value."""
+        if not self.count:
+            return 0.0
+        rank = self.count * percentile / 100
+        accumulated = 0
+        for i, count in enumerate(self.counts):
+            if count and accumulated + count >= rank:
+                lower = self.buckets[i-1] if i > 0 else 0.0
+                upper = min(self.buckets[i], self.max)
+                return lower + (upper - lower) * (rank - accumulated) / count
+            accumulated += count
+        return self.max
+
+
+class CommandStats:
+    """Latency statistics of a command."""
+    def __init__(self, name: str):
+        self.name = name
+        self.latency = Histogram()
+        self.errors = 0
+        # Total time spent in each phase
+        self.phases: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+
+
+class CommandMetrics:
+    """Records the latency of command invocations, split by phase.
+
+    Time spent waiting for user input is not counted. Invocations slower than the threshold are logged along with
+    their phases."""
+    def __init__(self, *, slow_threshold: float = 5.0):
+        self.slow_threshold = slow_threshold
+        # Statistics per command, key:value = qualified_name:CommandStats
+        self.commands: Dict[str, CommandStats] = {}
+
+    @contextmanager
+    def invocation(self, ctx):
+        """Records the latency of a command invocation.
+
+        :param ctx: The invocation's context."""
+        task = _current_task()
+        phases = _invocations[task] = {}
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield phases
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            del _invocations[task]
+            failed = failed or ctx.command_failed
+            self.record(ctx, elapsed, phases, failed)
+
+    def record(self, ctx, elapsed: float, phases: Dict[str, float], failed: bool = False):
+        """Records an invocation's latency.
+
+        :param ctx: The invocation's context.
+        :param elapsed: The total time of the invocation, including time spent waiting for input.
+        :param phases: The time spent in each phase.
+        :param failed: Whether the command failed or not."""
+        name = ctx.command.qualified_name
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = self.commands[name] = CommandStats(name)
+        latency = max(elapsed - phases.get("input", 0.0), 0.0)
+        phases["render"] = max(latency - sum(phases.get(p, 0.0) for p in PHASES if p != "render"), 0.0)
+        stats.latency.observe(latency)
+        if failed:
+            stats.errors += 1
+        for p in PHASES:
+            stats.phases[p] += phases.get(p, 0.0)
+        if self.slow_threshold and latency >= self.slow_threshold:
+            breakdown = ", ".join(f"{p} {phases.get(p, 0.0):.2f}s" for p in PHASES)
+            log.warning(f"Slow command: {ctx.message.clean_content} took {latency:.2f}s ({breakdown})")
+
+    def get_table(self) -> str:
+        """Gets a table with the latency percentiles and phase breakdown of every command, slowest first."""
+        header = f"{'Command':<24}{'Count':>7}{'p50':>8}{'p95':>8}{'p99':>8}{'Max':>8}" \
+                 + "".join(f"{p.title():>9}" for p in PHASES)
+        lines = [header, "-" * len(header)]
+        for stats in sorted(self.commands.values(), key=lambda s: s.latency.percentile(95), reverse=True):
+            latency = stats.latency
+            total = latency.sum or 1
+            lines.append(f"{stats.name[:23]:<24}{latency.count:>7}"
+                         + "".join(f"{v:>7.2f}s" for v in (latency.percentile(50), latency.percentile(95),
+                                                            latency.percentile(99), latency.max))
+                         + "".join(f"{stats.phases[p]/total:>8.0%} " for p in PHASES))
+        return "\n".join(lines)
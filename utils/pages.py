@@ -1,7 +1,7 @@
 import asyncio
 import inspect
 import itertools
-from typing import Union
+from typing import Union, Iterator
 
 import discord
 from discord.ext import commands
@@ -107,12 +107,7 @@ class Pages:
             p.append(f'{index}. {entry}')
 
         if self.maximum_pages > 1:
-            if self.show_entry_count:
-                text = f'Page {page}/{self.maximum_pages} ({len(self.entries)} entries)'
-            else:
-                text = f'Page {page}/{self.maximum_pages}'
-
-            self.embed.set_footer(text=text)
+            self.embed.set_footer(text=self.get_footer(page))
 
         if not self.paginating:
             self.embed.description = '\n'.join(p)
@@ -140,6 +135,11 @@ class Pages:
             reaction = reaction.replace("<", "").replace(">", "")
             await self.message.add_reaction(reaction)
 
+    def get_footer(self, page):
+        if self.show_entry_count:
+            return f'Page {page}/{self.maximum_pages} ({len(self.entries)} entries)'
+        return f'Page {page}/{self.maximum_pages}'
+
     async def checked_show_page(self, page):
         if page != 0 and page <= self.maximum_pages:
             await self.show_page(page)
@@ -215,6 +215,46 @@ class Pages:
             await self.match()
 
 
+class LazyPages(Pages):
+    """A paginator that takes its entries from an iterator as pages are shown.
+
+    Entries are only taken when the page containing them is shown, plus one to know if there's a next page.
+    While the iterator isn't exhausted, the total number of pages is unknown and shown with a `+`.
+
+    Parameters
+    ------------
+    source: Iterator[str]
+        An iterator of the entries to paginate.
+    """
+    def __init__(self, ctx: NabCtx, *, source: Iterator[str], per_page=10, **kwargs):
+        self.source = source
+        entries = list(itertools.islice(source, per_page + 1))
+        self.exhausted = len(entries) <= per_page
+        super().__init__(ctx, entries=entries, per_page=per_page, **kwargs)
+
+    def load_entries(self, count):
+        """Takes entries from the source until there are at least count entries or it's exhausted."""
+        missing = count - len(self.entries)
+        if self.exhausted or missing <= 0:
+            return
+        new_entries = list(itertools.islice(self.source, missing))
+        self.entries.extend(new_entries)
+        self.exhausted = len(new_entries) < missing
+        pages, left_over = divmod(len(self.entries), self.per_page)
+        if left_over:
+            pages += 1
+        self.maximum_pages = pages
+
+    def get_page(self, page):
+        self.load_entries(page * self.per_page + 1)
+        return super().get_page(page)
+
+    def get_footer(self, page):
+        if self.exhausted:
+            return super().get_footer(page)
+        return f'Page {page}/{self.maximum_pages}+'
+
+
 class VocationPages(Pages):
     def __init__(self, ctx: commands.Context, *, entries, vocations, **kwargs):
         super().__init__(ctx, entries=entries, **kwargs)
@@ -2,6 +2,7 @@ import asyncio
 import datetime as dt
 import io
 import json
+import os
 import re
 import time
 import urllib.parse
@@ -15,8 +16,10 @@ from PIL import Image, ImageDraw
 from bs4 import BeautifulSoup
 from discord.ext import commands
 
+from utils import metrics
 from utils.config import config
 from utils.database import userDatabase, tibiaDatabase
+from utils.monitor import Phase
 from .general import log
 
 # Constants
@@ -56,6 +59,9 @@ highscore_format = {"achievements": "{0} __achievement points__ are **{1}**, on
 # This is preloaded on startup
 tibia_worlds: List[str] = []
 
+# Folder where each world's tracked online characters are saved
+ONLINE_LISTS_PATH = "data/online_lists"
+
 HIGHSCORE_CATEGORIES = ["sword", "axe", "club", "distance", "shielding", "fist", "fishing", "magic",
                         "magic_ek", "magic_rp", "loyalty", "achievements"]
 
@@ -239,6 +245,8 @@ class Character:
 
 
 class Achievement:
+    __slots__ = ("name", "grade")
+
     def __init__(self, name: str, grade: int):
         self.name = name
         self.grade = grade
@@ -249,6 +257,8 @@ class Achievement:
 
 # TODO: Handle deaths by multiple killers
 class Death:
+    __slots__ = ("level", "killer", "time", "by_player", "participants")
+
     def __init__(self, level: int, killer: str, time: dt.datetime, by_player: bool, participants=None):
         if participants is None:
             participants = []
@@ -262,6 +272,36 @@ class Death:
         return f"Death({self.level},{self.killer!r},{self.time!r},{self.by_player},{self.participants!r})"
 
 
+class OnlineCharacter:
+    """Represents a character seen in a world's online list.
+
+    This is a lightweight version of :class:`Character`, holding only the attributes available in online lists.
+    Thousands of these are kept in memory and saved to disk by the tracker, so no instance dictionary is used."""
+    __slots__ = ("name", "world", "level", "vocation")
+
+    def __init__(self, name: str, world: str, level: int = 0, vocation: str = None):
+        self.name = name
+        self.world = world
+        self.level = level
+        self.vocation = vocation
+
+    def __repr__(self) -> str:
+        return f"OnlineCharacter({self.name!r}, {self.world!r}, {self.level}, {self.vocation!r})"
+
+    def __eq__(self, o: object) -> bool:
+        """Overrides the default implementation"""
+        if isinstance(o, self.__class__):
+            return self.name.lower() == o.name.lower()
+        return False
+
+    def __hash__(self) -> int:
+        return hash(self.name.lower())
+
+    @property
+    def url(self) -> str:
+        return Character.get_url(self.name)
+
+
 class World:
     """
     Represents a Tibia world
@@ -276,7 +316,7 @@ class World:
         self.premium_type = kwargs.get("premium_type")
         self.transfer_type = kwargs.get("transfer_type")
         self.location = kwargs.get("location")
-        self.players_online: List[Character] = []
+        self.players_online: List[OnlineCharacter] = []
         self.online_count = kwargs.get("online_count", 0)
         self.quests: List[str] = None
 
@@ -319,8 +359,8 @@ class World:
             world.quests = world_info["world_quest_titles"]
 
         for player in _world.get("players_online", []):
-            world.players_online.append(Character(player["name"], world.name, level=int(player["level"]),
-                                                  vocation=player["vocation"], online=True))
+            world.players_online.append(OnlineCharacter(player["name"], world.name, int(player["level"]),
+                                                        player["vocation"]))
         world.online_count = len(world.players_online)
         return world
 
@@ -383,6 +423,42 @@ class Guild:
         return tibia_guild
 
 
+def rebase_url(url: str, base_url: str) -> str:
+    """Replaces the scheme and host of a url with the ones of a base url, keeping the path and query.
+
+    Used to fetch pages from the configured data sources, while displaying links to the real websites.
+
+    :param url: The url to rebase.
+    :param base_url: The base url to use, it may include a path prefix.
+    :return: The rebased url."""
+    parts = urllib.parse.urlsplit(url)
+    return base_url.rstrip("/") + urllib.parse.urlunsplit(("", "", parts.path, parts.query, parts.fragment))
+
+
+async def fetch_content(url: str) -> str:
+    """Fetches a page from Tibia.com or TibiaData.
+
+    The time spent is counted as part of the current command's network time and recorded in the metrics.
+    Exceptions are not handled.
+
+    :param url: The url to fetch.
+    :return: The content of the response."""
+    host = urllib.parse.urlsplit(url).hostname
+    result = "error"
+    start = time.perf_counter()
+    try:
+        with Phase("network"):
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as resp:
+                    content = await resp.text(encoding='ISO-8859-1')
+                    if resp.status == 200:
+                        result = "success"
+                    return content
+    finally:
+        metrics.http_requests.inc(host=host, result=result)
+        metrics.http_request_duration.observe(time.perf_counter() - start, host=host)
+
+
 async def get_character(name, tries=5, *, bot: commands.Bot=None) -> Optional[Character]:
     """Fetches a character from TibiaData, parses and returns a Character object
 
@@ -395,14 +471,12 @@ async def get_character(name, tries=5, *, bot: commands.Bot=None) -> Optional[Ch
         log.error("get_character: Couldn't fetch {0}, network error.".format(name))
         raise NetworkError()
     try:
-        url = f"https://api.tibiadata.com/v2/characters/{urllib.parse.quote(name.strip(), safe='')}.json"
+        url = f"{config.tibiadata_url}/v2/characters/{urllib.parse.quote(name.strip(), safe='')}.json"
     except UnicodeEncodeError:
         return None
     # Fetch website
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                content = await resp.text(encoding='ISO-8859-1')
+        content = await fetch_content(url)
     except Exception:
         await asyncio.sleep(config.network_retry_delay)
         return await get_character(name, tries - 1)
@@ -487,7 +561,7 @@ async def get_highscores(world, category, pagenum, profession=0, tries=5):
     """Gets a specific page of the highscores
     Each list element is a dictionary with the following keys: rank, name, value.
     May return ERROR_NETWORK"""
-    url = url_highscores.format(world, category, profession, pagenum)
+    url = rebase_url(url_highscores.format(world, category, profession, pagenum), config.tibia_url)
 
     if tries == 0:
         log.error("get_highscores: Couldn't fetch {0}, {1}, page {2}, network error.".format(world, category, pagenum))
@@ -495,9 +569,7 @@ async def get_highscores(world, category, pagenum, profession=0, tries=5):
 
     # Fetch website
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                content = await resp.text(encoding='ISO-8859-1')
+        content = await fetch_content(url)
     except Exception:
         await asyncio.sleep(config.network_retry_delay)
         return await get_highscores(world, category, pagenum, profession, tries - 1)
@@ -534,12 +606,10 @@ async def get_highscores_tibiadata(world, category=None, vocation=None, tries=5)
         vocation = "all"
     if category is None:
         category = "experience"
-    url = f"https://api.tibiadata.com/v2/highscores/{world}/{category}/{vocation}.json"
+    url = f"{config.tibiadata_url}/v2/highscores/{world}/{category}/{vocation}.json"
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                content = await resp.text(encoding='ISO-8859-1')
+        content = await fetch_content(url)
     except Exception:
         await asyncio.sleep(config.network_retry_delay)
         return await get_highscores_tibiadata(world, category, vocation, tries - 1)
@@ -557,7 +627,7 @@ async def get_highscores_tibiadata(world, category=None, vocation=None, tries=5)
 
 
 async def get_world(name, tries=5) -> Optional[World]:
-    url = f"https://api.tibiadata.com/v2/world/{name}.json"
+    url = f"{config.tibiadata_url}/v2/world/{name}.json"
     name = name.strip()
     if tries == 0:
         log.error("get_world: Couldn't fetch {0}, network error.".format(name))
@@ -565,9 +635,7 @@ async def get_world(name, tries=5) -> Optional[World]:
         # Fetch website
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                content = await resp.text(encoding='ISO-8859-1')
+        content = await fetch_content(url)
     except Exception:
         await asyncio.sleep(config.network_retry_delay)
         return await get_world(name, tries - 1)
@@ -584,7 +652,7 @@ async def get_guild(name, title_case=True, tries=5) -> Optional[Guild]:
     Guilds are case sensitive on tibia.com so guildstats.eu is checked for correct case.
     If the guild can't be fetched due to a network error, an NetworkError exception is raised
     If the character doesn't exist, None is returned."""
-    guildstats_url = f"http://guildstats.eu/guild?guild={urllib.parse.quote(name)}"
+    guildstats_url = f"{config.guildstats_url}/guild?guild={urllib.parse.quote(name)}"
 
     if tries == 0:
         log.error("get_guild_online: Couldn't fetch {0}, network error.".format(name))
@@ -594,9 +662,7 @@ async def get_guild(name, title_case=True, tries=5) -> Optional[Guild]:
     # Sorry guildstats.eu :D
     if not title_case:
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(guildstats_url) as resp:
-                    content = await resp.text(encoding='ISO-8859-1')
+            content = await fetch_content(guildstats_url)
         except Exception:
             await asyncio.sleep(config.network_retry_delay)
             return await get_guild(name, title_case, tries - 1)
@@ -629,13 +695,11 @@ async def get_guild(name, title_case=True, tries=5) -> Optional[Guild]:
     else:
         name = name.title()
 
-    tibiadata_url = f"https://api.tibiadata.com/v2/guild/{urllib.parse.quote(name)}.json"
+    tibiadata_url = f"{config.tibiadata_url}/v2/guild/{urllib.parse.quote(name)}.json"
 
     # Fetch website
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(tibiadata_url) as resp:
-                content = await resp.text(encoding='ISO-8859-1')
+        content = await fetch_content(tibiadata_url)
     except Exception:
         await asyncio.sleep(config.network_retry_delay)
         return await get_guild(name, title_case, tries - 1)
@@ -661,14 +725,12 @@ async def get_recent_news(tries = 5):
         log.error("get_recent_news: network error.")
         raise NetworkError()
     try:
-        url = f"https://api.tibiadata.com/v2/latestnews.json"
+        url = f"{config.tibiadata_url}/v2/latestnews.json"
     except UnicodeEncodeError:
         return None
     # Fetch website
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                content = await resp.text(encoding='ISO-8859-1')
+        content = await fetch_content(url)
     except Exception:
         await asyncio.sleep(config.network_retry_delay)
         return await get_recent_news(tries - 1)
@@ -691,14 +753,12 @@ async def get_news_article(article_id: int, tries=5) -> Optional[Dict[str, Union
         log.error("get_recent_news: network error.")
         raise NetworkError()
     try:
-        url = f"https://api.tibiadata.com/v2/news/{article_id}.json"
+        url = f"{config.tibiadata_url}/v2/news/{article_id}.json"
     except UnicodeEncodeError:
         return None
     # Fetch website
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                content = await resp.text(encoding='ISO-8859-1')
+        content = await fetch_content(url)
     except Exception:
         await asyncio.sleep(config.network_retry_delay)
         return await get_recent_news(tries - 1)
@@ -830,11 +890,9 @@ def get_share_range(level: int):
 
 
 async def get_world_bosses(world):
-    url = f"http://www.tibiabosses.com/{world}/"
+    url = f"{config.tibiabosses_url}/{world}/"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                content = await resp.text(encoding='ISO-8859-1')
+        content = await fetch_content(url)
     except Exception as e:
         return ERROR_NETWORK
 
@@ -891,9 +949,7 @@ async def get_house(name, world=None):
         tries = 5
         while True:
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(house["url"]) as resp:
-                        content = await resp.text(encoding='ISO-8859-1')
+                content = await fetch_content(rebase_url(house["url"], config.tibia_url))
             except Exception:
                 tries -= 1
                 if tries == 0:
@@ -1063,13 +1119,11 @@ async def get_world_list(tries=3) -> Optional[List[World]]:
         log.error("get_world_list(): Couldn't fetch TibiaData for the worlds list, network error.")
         return
 
-    url = "https://api.tibiadata.com/v2/worlds.json"
+    url = f"{config.tibiadata_url}/v2/worlds.json"
 
     # Fetch website
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                content = await resp.text(encoding='ISO-8859-1')
+        content = await fetch_content(url)
     except Exception:
         await asyncio.sleep(config.network_retry_delay)
         return await get_world_list(tries - 1)
@@ -1111,3 +1165,70 @@ def load_tibia_worlds_file():
             return json.load(json_file)
     except Exception:
         log.error("load_tibia_worlds_file(): Error loading backup .json file.")
+
+
+def save_online_list_file(world: str, characters: List[OnlineCharacter]):
+    """Saves the tracked online characters of a world to its snapshot file.
+
+    The file is replaced atomically, so an interrupted write never leaves a corrupt snapshot behind.
+    This does blocking file I/O, so it should be called through an executor, one call at a time per world.
+
+    :param world: The name of the world.
+    :param characters: The tracked characters currently online in that world.
+    """
+    path = os.path.join(ONLINE_LISTS_PATH, f"{world}.json")
+    try:
+        os.makedirs(ONLINE_LISTS_PATH, exist_ok=True)
+        with open(path + ".tmp", "w") as json_file:
+            json.dump({"timestamp": time.time(), "characters": [[c.name, c.level, c.vocation] for c in characters]},
+                      json_file, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+    except Exception:
+        log.error(f"save_online_list_file(): Could not save online list of {world}.")
+
+
+def touch_online_list_file(world: str):
+    """Marks the snapshot file of a world as up to date, when its online list was scanned without changes.
+
+    Snapshots expire based on the file's modification time, so quiet worlds keep their snapshot valid.
+    This does blocking file I/O, so it should be called through an executor, one call at a time per world.
+
+    :param world: The name of the world.
+    """
+    try:
+        os.utime(os.path.join(ONLINE_LISTS_PATH, f"{world}.json"))
+    except FileNotFoundError:
+        # Nothing was saved yet, so there's nothing to restore for this world either
+        pass
+    except OSError:
+        log.error(f"touch_online_list_file(): Could not update online list of {world}.")
+
+
+def load_online_list_files(expiration: int) -> List[OnlineCharacter]:
+    """Loads the tracked online characters saved for every world.
+
+    :param expiration: The maximum time in seconds since a world was last scanned, older snapshots are discarded.
+    :return: The characters found in all snapshots that haven't expired.
+    """
+    characters = []
+    try:
+        filenames = os.listdir(ONLINE_LISTS_PATH)
+    except FileNotFoundError:
+        return characters
+    now = time.time()
+    for filename in filenames:
+        world, ext = os.path.splitext(filename)
+        if ext != ".json":
+            continue
+        path = os.path.join(ONLINE_LISTS_PATH, filename)
+        try:
+            if now - os.path.getmtime(path) >= expiration:
+                log.info(f"load_online_list_files(): Online list of {world} is too old, discarding")
+                continue
+            with open(path) as json_file:
+                snapshot = json.load(json_file)
+            characters.extend(OnlineCharacter(name, world, level, vocation)
+                              for name, level, vocation in snapshot["characters"])
+        except (ValueError, KeyError, TypeError, OSError):
+            log.error(f"load_online_list_files(): Couldn't read online list of {world}.")
+    return characters